@@ -22,6 +22,7 @@ from qgis.core import QgsFeature, QgsGeometry, QgsPointXY
 from ..cls.lrslayerclass import LRSLayerClass
 from ..utils import qgis_utils
 from ..utils import misc_utils
+from ..utils import wkb
 
 
 class LRSBasePointEventClass(LRSLayerClass):
@@ -32,6 +33,7 @@ class LRSBasePointEventClass(LRSLayerClass):
         self.__layer = layer
         self.__pg_conn = pg_conn
         self.__event_class_name = qgis_utils.tablename_by_layername_get(self.__schema, self.__layer.name)
+        self.__bulk_insert = None
 
     def basepoint_delete(self, feat_id):
         self.editing_start()
@@ -97,15 +99,20 @@ class LRSBasePointEventClass(LRSLayerClass):
             self.__layer.destroyEditCommand()
 
     def basepoint_sql_insert(self, qgis_point, route_id, event_id, meas, azi, srid):
+        # buffered, written with basepoints_sql_flush
+        if self.__bulk_insert is None:
+            self.__bulk_insert = self.__pg_conn.bulk_insert_get(self.__schema, self.__event_class_name)
         now_utc = misc_utils.datetime_utc_get()
-        uuid = misc_utils.uuid_get()
-        fields = "uuid, geom, event_id, azi, route_id, meas, apprtstz, createtstz, changetstz, geomtstz"
-        values = "'{uuid}', ST_SetSRID(ST_MakePoint({x}, {y}), {srid}), '{event_id}', {azi}, '{route_id}', " \
-                 "{meas}, '{now_utc}', '{now_utc}', '{now_utc}', '{now_utc}'" \
-                 .format(uuid=uuid, x=qgis_point.x(), y=qgis_point.y(), srid=srid, event_id=event_id, azi=azi,
-                         route_id=route_id, meas=meas, now_utc=now_utc)
+        fields = ["uuid", "geom", "event_id", "azi", "route_id", "meas", "apprtstz", "createtstz", "changetstz",
+                  "geomtstz"]
+        geom = wkb.point_ewkb_get(qgis_point.x(), qgis_point.y(), srid).hex()
+        values = [str(misc_utils.uuid_get()), geom, event_id, azi, route_id, meas, now_utc, now_utc, now_utc,
+                  now_utc]
+        self.__bulk_insert.add(fields, values)
 
-        self.__pg_conn.table_insert(self.__schema, self.__event_class_name, fields, values)
+    def basepoints_sql_flush(self):
+        if self.__bulk_insert is not None:
+            self.__bulk_insert.flush()
 
     def basepoint_insert(self, qgis_point, route_id, event_id, meas, azi):
         self.editing_start()
@@ -151,62 +158,92 @@ class LRSBasePointEventClass(LRSLayerClass):
             self.__layer.destroyEditCommand()
 
     def basepoints_update(self, routelist, route_class, srid, tol):
+        # relocate the basepoints of all routes in routelist, changes are written with one update
+        if len(routelist) == 0:
+            return
         now_utc = self.datetime
-        for route_id in routelist:
-            fields = """bp.{id}, {bp_x}, {bp_y}, bp.{meas}, bp.{event_id}, {ev_x}, {ev_y}""" \
-                     .format(id="id", bp_x="ST_X(bp.geom)", bp_y="ST_Y(bp.geom)", meas="meas",
-                             event_id="event_id", ev_x="ST_X(ev.geom)", ev_y="ST_Y(ev.geom)")
-            countfield = "bp.id"
-            tablename_a = self.__event_class_name + " bp"
-            tablename_b = self.__event_class_name[:-3] + " ev"
-            a_id_field = "bp.event_id"
-            b_id_field = "ev.uuid"
-            group = "bp.id, ev.geom"
-            where = "bp.route_id = '" + route_id + "'"
-            basepoints = self.__pg_conn.table_select_count_leftjoin(self.__schema, tablename_a, tablename_b, fields,
+        fields = """bp.{id}, {bp_x}, {bp_y}, bp.{meas}, bp.{event_id}, {ev_x}, {ev_y}, bp.{route_id}""" \
+                 .format(id="id", bp_x="ST_X(bp.geom)", bp_y="ST_Y(bp.geom)", meas="meas",
+                         event_id="event_id", ev_x="ST_X(ev.geom)", ev_y="ST_Y(ev.geom)", route_id="route_id")
+        countfield = "bp.id"
+        tablename_a = self.__event_class_name + " bp"
+        tablename_b = self.__event_class_name[:-3] + " ev"
+        a_id_field = "bp.event_id"
+        b_id_field = "ev.uuid"
+        group = "bp.id, ev.geom"
+        where = "bp.route_id IN (" + misc_utils.sql_list_get(routelist) + ")"
+        basepoints_all = self.__pg_conn.table_select_count_leftjoin(self.__schema, tablename_a, tablename_b, fields,
                                                                     countfield, a_id_field, b_id_field, group, where)
-            for basepoint in basepoints:
-                qgis_point = QgsPointXY(basepoint[5], basepoint[6])
-                # get new basepoint with point event
-                result = route_class.point_meas_get(route_id, qgis_point, srid)
-                qgis_point_new = result[0]
-                meas_new = result[1]
+        # group basepoints by route
+        basepoints_route = {}
+        for basepoint in basepoints_all:
+            basepoints_route.setdefault(str(basepoint[7]), []).append(basepoint)
+
+        upd_list = []
+        for route_id, basepoints in basepoints_route.items():
+            # get new basepoints with point events in one pass
+            points = [[basepoint[5], basepoint[6]] for basepoint in basepoints]
+            results = route_class.points_meas_get(route_id, points, srid)
+            for i, basepoint in enumerate(basepoints):
+                qgis_point_new = results[0][i]
+                meas_new = results[1][i]
                 dist = misc_utils.points_dist_get([basepoint[1], basepoint[2]], [qgis_point_new.x(),
                                                                                  qgis_point_new.y()])
                 meas_diff = abs(meas_new - basepoint[3])
                 if dist <= tol < meas_diff:
                     # new meas, route changes underneath basepoint
-                    expression = """meas = {meas}, azi = {azi}, changetstz = '{utc}'""" \
-                                 .format(meas=meas_new, azi=result[2], utc=now_utc)
+                    upd_list.append((basepoint[0], False, None, meas_new, results[2][i]))
                 elif dist > tol:
                     # new geom, route changes along basepoint
-                    expression = """geom = ST_SetSRID(ST_MakePoint({x}, {y}), {srid}), meas = {meas},
-                                 azi = {azi}, apprtstz = '1000-01-01 01:01:01', changetstz = '{utc}',
-                                 geomtstz = '{utc}'""" \
-                                 .format(x=qgis_point_new.x(), y=qgis_point_new.y(), srid=srid, meas=meas_new,
-                                         azi=result[2], utc=now_utc)
-                else:
-                    # route changes above basepoint
-                    expression = ""
-                if len(expression) > 0:
-                    where_upd = "id = " + str(basepoint[0])
-                    self.__pg_conn.table_update1(self.__schema, self.__event_class_name, expression, where_upd)
-            self.__layer.updateExtents()
+                    upd_list.append((basepoint[0], True,
+                                     wkb.point_ewkb_get(qgis_point_new.x(), qgis_point_new.y(), srid).hex(),
+                                     meas_new, results[2][i]))
+                # else: route changes above basepoint
 
-    def events_approvable_get(self, route_class_name, tolerance, checkonly=False):
-        # keep tolerance as a parameter in function
-        fields = """bp.{id}, bp.{meas}, bp.{event_id}, bp.{route_id}, ev.{name}""" \
+        if len(upd_list) > 0:
+            # data.move: new geom (hex EWKB), otherwise only meas and azi change
+            expression = """geom = CASE WHEN data.move THEN data.geom ELSE a.geom END, meas = data.meas, 
+                         azi = data.azi, apprtstz = CASE WHEN data.move THEN '1000-01-01 01:01:01' ELSE a.apprtstz END, 
+                         changetstz = '{utc}', geomtstz = CASE WHEN data.move THEN '{utc}' ELSE a.geomtstz END""" \
+                         .format(utc=now_utc)
+            valuefields = "id, move, geom, meas, azi"
+            template = "(%s, %s, %s::geometry, %s::double precision, %s::double precision)"
+            self.__pg_conn.table_update3(self.__schema, self.__event_class_name, expression, "id", valuefields,
+                                         upd_list, template)
+        self.__layer.updateExtents()
+
+    def __events_approvable_query_get(self, route_class_name):
+        # basepoints with event name and route name in one query, parts of a route are grouped
+        fields = """bp.{id}, bp.{meas}, bp.{event_id}, bp.{route_id}, ev.{name}, rc.{name}""" \
                  .format(id="id", meas="meas", event_id="event_id", route_id="route_id", name="name")
         where = "bp.apprtstz = '1000-01-01 01:01:01'"
-        a_id_field = "bp.event_id"
-        b_id_field = "ev.uuid"
-        tablename_a = self.__event_class_name + " bp"
-        tablename_b = self.__event_class_name[:-3] + " ev"
-        countfield = "bp.id"
-        group = "bp.id, ev.name"
-        order = "bp.route_id ASC, bp.meas ASC"
-        basepoints = self.__pg_conn.table_select_count_leftjoin(self.__schema, tablename_a, tablename_b, fields,
-                                                                countfield, a_id_field, b_id_field, group, where, order)
+        joinlist = [[self.__event_class_name[:-3] + " ev", "bp.event_id = ev.uuid"],
+                    [route_class_name + " rc", "bp.route_id = rc.route_id"]]
+        group = "bp.id, ev.name, rc.name"
+        order = "rc.name ASC, bp.meas ASC"
+        return [self.__schema, self.__event_class_name + " bp", joinlist, fields, where, group, order]
+
+    def events_approvable_fetch(self, route_class_name, size=500):
+        # like events_approvable_get, but yields blocks of [route name, route_id, event] ordered by route name
+        # from a server-side cursor
+        # unique name, the uuid first -> not lost when postgres truncates the name to 63 characters
+        cursorname = "lrs_approvable_" + misc_utils.uuid_get().hex + "_" + self.__event_class_name
+        blocks = self.__pg_conn.table_select_join_fetch(cursorname, *self.__events_approvable_query_get(
+            route_class_name), size=size)
+        try:
+            for basepoints in blocks:
+                yield [[basepoint[5], str(basepoint[3]), str(basepoint[0]) + ": " + (basepoint[4]) + " / " +
+                        str(basepoint[1])] for basepoint in basepoints]
+        finally:
+            blocks.close()
+
+    def route_meas_errors_get(self, route_id, tolerance, route_class_name):
+        # no measure check for basepoints
+        return []
+
+    def events_approvable_get(self, route_class_name, tolerance, checkonly=False):
+        # keep tolerance as a parameter in function
+        basepoints = self.__pg_conn.table_select_join(*self.__events_approvable_query_get(route_class_name))
 
         if checkonly:
             if len(basepoints) > 0:
@@ -218,9 +255,7 @@ class LRSBasePointEventClass(LRSLayerClass):
         routedict = {}
         tmplist = []
         for count, basepoint in enumerate(basepoints):
-            route_id = str(basepoint[3])
-            where = "route_id = '" + route_id + "'"
-            route_name = self.__pg_conn.table_select(self.__schema, route_class_name, "name", where)[0][0]
+            route_name = basepoint[5]
             if route_name != route_name_old and count > 0:
                 routedict[route_name_old] = tmplist
                 tmplist = []
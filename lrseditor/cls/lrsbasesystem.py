@@ -17,6 +17,8 @@
  *                                                                         *
  ***************************************************************************/
 """
+import numpy as np
+
 from ..utils import misc_utils
 
 
@@ -41,6 +43,8 @@ class LRSBasesystem:
         self.__point_route_id_field = None
         self.__point_sortnr_field = None
         self.__point_type_field = None
+        # current hashes of the base system per route name: [geomhash, nodehash]
+        self.__route_hashes = None
 
         if not self.__pg_conn.table_exists(self.__schema, "lrs_basesystem"):
             self.__pg_conn.table_basesystem_create(self.__schema)
@@ -84,10 +88,68 @@ class LRSBasesystem:
         newlist = []
         newlist.insert(0, valuelist)
         self.__pg_conn.table_update2(self.__schema, "lrs_basesystem", updatefields, "id", valuefields, newlist)
+        # other classes or fields, next route update has to check all routes
+        if self.__pg_conn.table_exists(self.__schema, "lrs_route_snapshot"):
+            self.__pg_conn.table_truncate(self.__schema, "lrs_route_snapshot")
 
         self.__values_set(valuelist)
 
-    def __topology_loops_check(self, srid):
+    def routes_changed_get(self):
+        # names of routes with changed linestrings or points since the last route update
+        # None if all routes have to be checked
+        hashlist = self.__pg_conn_bs.route_hashes_get(self.__schema_bs, self.__base_class, self.__base_route_id_field,
+                                                      self.__base_geom_field, self.__point_class,
+                                                      self.__point_route_id_field, self.__point_geom_field,
+                                                      self.__point_sortnr_field, self.__point_type_field)
+        self.__route_hashes = {}
+        for route_hash in hashlist:
+            if route_hash[0] is not None:
+                self.__route_hashes[route_hash[0]] = [route_hash[1], route_hash[2]]
+
+        if not self.__pg_conn.table_exists(self.__schema, "lrs_route_class"):
+            return None
+        if not self.__pg_conn.table_exists(self.__schema, "lrs_route_snapshot"):
+            return None
+        snapshot = self.__pg_conn.table_select(self.__schema, "lrs_route_snapshot",
+                                               "name, geomhash, nodehash, basesystem_id")
+        if len(snapshot) == 0:
+            return None
+        snapshot_hashes = {}
+        for route_hash in snapshot:
+            if route_hash[3] != self.__id:
+                return None
+            snapshot_hashes[route_hash[0]] = [route_hash[1], route_hash[2]]
+
+        # new, deleted and changed routes
+        routeset_changed = set(snapshot_hashes.keys()).symmetric_difference(self.__route_hashes.keys())
+        for route_name, route_hash in self.__route_hashes.items():
+            if route_name in snapshot_hashes and snapshot_hashes[route_name] != route_hash:
+                routeset_changed.add(route_name)
+        return routeset_changed
+
+    def snapshot_save(self, routenames_rejected=None):
+        # store hashes of routes_changed_get for the next route update
+        # invalid routes (topology_check) and routes_rejected (not updated) get no hashes -> checked again next time
+        if self.__route_hashes is None:
+            return
+        routes_invalid = self.__pg_conn.table_select_group(self.__schema, "lrs_route_class", "name", "name",
+                                                           "valid = 0")
+        routeset_recheck = set(route[0] for route in routes_invalid)
+        if routenames_rejected is not None:
+            routeset_recheck.update(routenames_rejected)
+        self.__pg_conn.table_route_snapshot_create(self.__schema)
+        self.__pg_conn.table_truncate(self.__schema, "lrs_route_snapshot")
+        values = []
+        for route_name, route_hash in self.__route_hashes.items():
+            if route_name in routeset_recheck:
+                values.append((route_name, None, None, self.__id))
+            else:
+                values.append((route_name, route_hash[0], route_hash[1], self.__id))
+        if len(values) > 0:
+            self.__pg_conn.table_insert2(self.__schema, "lrs_route_snapshot", "name, geomhash, nodehash, basesystem_id",
+                                         values)
+
+    def __topology_loops_check(self, srid, routenames=None):
         # check if column 'id' in baseclass and pointclass exists
         if not self.__pg_conn_bs.field_exists(self.__schema_bs, self.__base_class, "id"):
             return
@@ -104,6 +166,8 @@ class LRSBasesystem:
         fields1 = self.__base_geom_field + ", " + self.__base_route_id_field + ", id"
         fields2 = "geom, name, baseclass_id"
         for route in routelist_equal_points:
+            if routenames is not None and route[0] not in routenames:
+                continue
             # looping routes have just one path, no more route parts are allowed -> sortnr/pathnr should be 1
             route_closed = self.__pg_conn.linestring_closed(self.__schema, "geom", route[0], 1)[0]
             if route_closed[1]:
@@ -157,7 +221,8 @@ class LRSBasesystem:
             logfile.write("Data Check successfully finished", "INFORM")
             return True
 
-    def topology_check(self, logfile):
+    def topology_check(self, logfile, routenames=None):
+        # routenames: check only these routes (see routes_changed_get), None = all routes
         logfile.write("CHECK TOPOLOGY OF BASE SYSTEM", "INFORM")
 
         # naming: node = points from point class, point = start- or endpoint from linestring
@@ -172,37 +237,45 @@ class LRSBasesystem:
         dsn_dict2 = self.__pg_conn.conn_dsn_get()
 
         # create internal lrs_route_class, create and insert routes from baseclass
-        self.__pg_conn.table_lrs_route_class_create(self.__schema, srid)
+        # incremental: keep unchanged routes, replace changed routes
+        base_where = None
+        rc_where = None
+        node_where = None
+        if routenames is None:
+            self.__pg_conn.table_lrs_route_class_create(self.__schema, srid)
+        else:
+            logfile.write(str(len(routenames)) + " changed routes since last update", "INFORM")
+            if len(routenames) == 0:
+                return
+            names = misc_utils.sql_list_get(routenames)
+            base_where = "TRIM(BOTH FROM e." + self.__base_route_id_field + ") IN (" + names + ")"
+            rc_where = "name IN (" + names + ")"
+            node_where = "TRIM(BOTH FROM " + self.__point_route_id_field + ") IN (" + names + ")"
+            self.__pg_conn.table_lrs_route_class_create(self.__schema, srid, False)
+            self.__pg_conn.table_delete_row(self.__schema, "lrs_route_class", rc_where)
         if dsn_dict1 == dsn_dict2:
             # baseclass is in same db like lrs_route_class (faster)
             self.__pg_conn.lrs_route_class_insert(self.__schema, self.__base_class, self.__base_route_id_field,
-                                                  self.__base_geom_field)
+                                                  self.__base_geom_field, base_where)
         else:
-            # baseclass is in different db
-            base_class_list = self.__pg_conn_bs.base_class_geom_select(self.__schema_bs, self.__base_class,
-                                                                       self.__base_route_id_field,
-                                                                       self.__base_geom_field)
-            fields = "geom, name, pathnr"
-            for base_class_line in base_class_list:
-                pathnr = base_class_line[2]
-                # set default value
-                if pathnr is None:
-                    pathnr = 1
-                values = "'{}', '{}', {}".format(base_class_line[0], base_class_line[1], pathnr)
-                self.__pg_conn.table_insert(self.__schema, "lrs_route_class", fields, values)
+            # baseclass is in different db, stream blocks of rows with COPY (bounded memory)
+            for base_class_list in self.__pg_conn_bs.base_class_geom_fetch(self.__schema_bs, self.__base_class,
+                                                                           self.__base_route_id_field,
+                                                                           self.__base_geom_field, base_where):
+                self.__pg_conn.lrs_route_class_copy(self.__schema, base_class_list)
 
         # check loops, can only executed before route parts get sortnr, because looping routes have just one path
-        self.__topology_loops_check(srid)
+        self.__topology_loops_check(srid, routenames)
 
         # get all routes grouped from internal route class
         fields = "name, COUNT (pathnr)"
-        routelist = self.__pg_conn.table_select_group(self.__schema, "lrs_route_class", fields, "name", None,
+        routelist = self.__pg_conn.table_select_group(self.__schema, "lrs_route_class", fields, "name", rc_where,
                                                       "name")
 
         # get all nodes for the routes from internal route class
         r_fields = "id, name, pathnr"
         routepointlist = self.__pg_conn.linestrings_nodes_get(self.__schema, "lrs_route_class",
-                                                              "geom", fields=r_fields)
+                                                              "geom", fields=r_fields, where=rc_where)
 
         # create dicts with points and id (-> no need to sort)
         # key = route_name+_+pathnr+_+S/E
@@ -212,25 +285,33 @@ class LRSBasesystem:
             key = routepoint[1] + "_" + str(routepoint[2]) + "_" + routepoint[3]
             routedict[key] = [coords, routepoint[0]]
 
-        # prepare query for nodes
-        n_fields = """{sortnr}, {type}, {x}, {y}""" \
-            .format(sortnr=self.__point_sortnr_field, type=self.__point_type_field,
-                    x="ST_X(" + self.__point_geom_field + ")", y="ST_Y(" + self.__point_geom_field + ")")
-        n_order = """{sortnr} ASC, {type} ASC""" \
-            .format(sortnr=self.__point_sortnr_field, type=self.__point_type_field)
+        # get all nodes of all routes with one query, grouped by route name
+        n_fields = """{route_id}, {sortnr}, {type}, {x}, {y}""" \
+            .format(route_id=self.__point_route_id_field, sortnr=self.__point_sortnr_field,
+                    type=self.__point_type_field, x="ST_X(" + self.__point_geom_field + ")",
+                    y="ST_Y(" + self.__point_geom_field + ")")
+        n_order = """{route_id} ASC, {sortnr} ASC, {type} ASC""" \
+            .format(route_id=self.__point_route_id_field, sortnr=self.__point_sortnr_field,
+                    type=self.__point_type_field)
+        nodelist_all = self.__pg_conn_bs.table_select(self.__schema_bs, self.__point_class, n_fields, node_where,
+                                                      n_order)
+        nodedict = {}
+        for node in nodelist_all:
+            if node[0] is not None:
+                nodedict.setdefault(str(node[0]).strip(), []).append([node[1], node[2], node[3], node[4]])
 
-        # loop routes
+        # loop routes, changes are collected and written in bulk
         routes_noupdate = []
+        pathnr_list = []
+        reverse_list = []
         routeset = set()
         for route in routelist:
             route_name = route[0]
             routeset.add(route_name)
             path_count = route[1]
 
-            # get nodes for route_name
-            n_where = self.__point_route_id_field + " = '" + route_name + "'"
-            nodelist = self.__pg_conn_bs.table_select(self.__schema_bs, self.__point_class,
-                                                      n_fields, where=n_where, order=n_order)
+            # nodes for route_name: sortnr, type, x, y
+            nodelist = nodedict.get(route_name.strip(), [])
             nodelist_count = len(nodelist)
 
             if 2 * path_count != nodelist_count:
@@ -238,37 +319,31 @@ class LRSBasesystem:
                                                       "route not valid", "ERROR")
                 routes_noupdate.append(route_name)
             else:
+                node_coords = np.array([[node[2], node[3]] for node in nodelist], dtype=float)
                 # loop paths, i.e. single LineString
                 for i in range(1, path_count + 1):
                     # spoint = StartPoint of LineString, epoint = EndPoint of LineString
                     epoint = routedict[route_name + "_" + str(i) + "_E"][0]
                     spoint = routedict[route_name + "_" + str(i) + "_S"][0]
-                    # loop nodes
-                    point_type = -1
-                    pos = 0
-                    firstnode = None
-                    for j in range(0, nodelist_count):
-                        firstnode = [nodelist[j][2], nodelist[j][3]]
-                        sdist = misc_utils.points_dist_get(firstnode, spoint)
-                        edist = misc_utils.points_dist_get(firstnode, epoint)
-                        # get first node
-                        if sdist <= self.__tolerance:
-                            # in direction of linestring
-                            point_type = 1
-                            pos = j
-                            break
-                        elif edist <= self.__tolerance:
-                            # in opposite direction of linestring
-                            point_type = 2
-                            pos = j
-                            break
+                    # distances of all nodes, get first node within tolerance
+                    sdist = np.hypot(node_coords[:, 0] - spoint[0], node_coords[:, 1] - spoint[1])
+                    edist = np.hypot(node_coords[:, 0] - epoint[0], node_coords[:, 1] - epoint[1])
+                    node_found = (sdist <= self.__tolerance) | (edist <= self.__tolerance)
 
-                    if point_type == -1:
+                    if not node_found.any():
                         logfile.write("Route " + route_name + ", Path " + str(i) + ": No points found, "
                                                                                    "route not valid", "ERROR")
                         routes_noupdate.append(route_name)
                     else:
+                        pos = int(np.argmax(node_found))
+                        if sdist[pos] <= self.__tolerance:
+                            # in direction of linestring
+                            point_type = 1
+                        else:
+                            # in opposite direction of linestring
+                            point_type = 2
                         # first node attributes
+                        firstnode = [nodelist[pos][2], nodelist[pos][3]]
                         firstsortnr = nodelist[pos][0]
                         firstnodetype = nodelist[pos][1]
 
@@ -294,9 +369,7 @@ class LRSBasesystem:
 
                                 # change pathnr to the correct sortnr
                                 route_class_id = routedict[route_name + "_" + str(i) + "_S"][1]
-                                where = "id = " + str(route_class_id)
-                                expression = "pathnr = " + str(firstsortnr)
-                                self.__pg_conn.table_update1(self.__schema, "lrs_route_class", expression, where)
+                                pathnr_list.append((route_class_id, firstsortnr))
 
                         # check geom
                         if point_type == 1:
@@ -335,22 +408,28 @@ class LRSBasesystem:
                                           ": LineString in reversed direction", "INFORM")
                             # reverse line
                             route_class_id = routedict[route_name + "_" + str(i) + "_S"][1]
-                            where = "id = " + str(route_class_id)
-                            self.__pg_conn.linestring_reverse(self.__schema, "lrs_route_class", "geom", where)
+                            reverse_list.append(route_class_id)
+
+        # change pathnr to the correct sortnr
+        if len(pathnr_list) > 0:
+            self.__pg_conn.table_update3(self.__schema, "lrs_route_class", "pathnr = data.pathnr", "id",
+                                         "id, pathnr", pathnr_list)
+        # reverse lines
+        if len(reverse_list) > 0:
+            where = "id IN (" + misc_utils.sql_list_get(reverse_list, False) + ")"
+            self.__pg_conn.linestring_reverse(self.__schema, "lrs_route_class", "geom", where)
+        # hash of the final geometries, to compare with the route class
+        self.__pg_conn.geomhash_update(self.__schema, "lrs_route_class", "geom", rc_where)
 
         # remove duplicates and update status in lrs_route_class
         routes_noupdate = list(set(routes_noupdate))
-        expression = "valid = 0"
-        for val in routes_noupdate:
-            where = "name = '" + val + "'"
+        if len(routes_noupdate) > 0:
+            expression = "valid = 0"
+            where = "name IN (" + misc_utils.sql_list_get(routes_noupdate) + ")"
             self.__pg_conn.table_update1(self.__schema, "lrs_route_class", expression, where)
 
         # check for unused nodes
-        nodelist_all = self.__pg_conn_bs.table_select_group(self.__schema_bs, self.__point_class,
-                                                            self.__point_route_id_field, self.__point_route_id_field)
-        nodeset = set()
-        for node in nodelist_all:
-            nodeset.add(node[0].strip())
+        nodeset = set(nodedict.keys())
         nodeset_unused = nodeset.difference(routeset)
         for route_unused in nodeset_unused:
             logfile.write("Route " + route_unused + ": Points without LineString", "ERROR")
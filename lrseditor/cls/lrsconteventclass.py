@@ -24,6 +24,8 @@ from qgis.core import QgsFeature, QgsGeometry, QgsPointXY, QgsFeatureRequest
 from ..cls.lrslayerclass import LRSLayerClass
 from ..utils import qgis_utils
 from ..utils import misc_utils
+from ..utils import wkb
+from ..utils import meas_check
 
 
 class LRSContEventClass(LRSLayerClass):
@@ -34,6 +36,7 @@ class LRSContEventClass(LRSLayerClass):
         self.__layer = layer
         self.__pg_conn = pg_conn
         self.__event_class_name = qgis_utils.tablename_by_layername_get(self.__schema, self.__layer.name)
+        self.__bulk_insert = None
 
     def events_get(self, route_id, reverse_order=False):
         # no sql, get actual saved attribute values of the layer
@@ -52,31 +55,21 @@ class LRSContEventClass(LRSLayerClass):
         return event_list
 
     def event_sql_insert(self, qgis_point, event_id, azi, route_id, frommeas, tomeas, srid, fields_list, fields_values):
+        # buffered, written with events_sql_flush
+        if self.__bulk_insert is None:
+            self.__bulk_insert = self.__pg_conn.bulk_insert_get(self.__schema, self.__event_class_name)
         now_utc = misc_utils.datetime_utc_get()
-        uuid = misc_utils.uuid_get()
-        fields = "uuid, geom, event_id, azi, route_id, frommeas, tomeas, apprtstz, createtstz, changetstz, geomtstz"
-        values = "'{uuid}', ST_SetSRID(ST_MakePoint({x}, {y}), {srid}), '{event_id}', {azi}, '{route_id}', " \
-                 "{frommeas}, {tomeas}, '{now_utc}', '{now_utc}', '{now_utc}', '{now_utc}'"\
-                 .format(uuid=uuid, x=qgis_point.x(), y=qgis_point.y(), srid=srid, event_id=event_id, azi=azi,
-                         route_id=route_id, frommeas=frommeas, tomeas=tomeas, now_utc=now_utc)
-
+        fields = ["uuid", "geom", "event_id", "azi", "route_id", "frommeas", "tomeas", "apprtstz", "createtstz",
+                  "changetstz", "geomtstz"]
+        geom = wkb.point_ewkb_get(qgis_point.x(), qgis_point.y(), srid).hex()
+        values = [str(misc_utils.uuid_get()), geom, event_id, azi, route_id, frommeas, tomeas, now_utc, now_utc,
+                  now_utc, now_utc]
         # additional values of fields to insert
-        for i in range(len(fields_list)):
-            value = fields_values[i]
-            fieldname = fields_list[i]
-            field_type = self.__pg_conn.field_type_get(self.__schema, self.__event_class_name, fieldname)[1]
-            if value is not None:
-                if field_type != 'other':
-                    fields = ''.join((fields, ", ", fieldname))
-                    if field_type == 'string':
-                        # replace single quotes
-                        value = value.replace("'", "''")
-                    if field_type == 'number' or field_type == 'boolean':
-                        values = ''.join((values, ", ", str(value)))
-                    else:
-                        values = ''.join((values, ", '", str(value), "'"))
+        self.__bulk_insert.add(fields + list(fields_list), values + list(fields_values))
 
-        self.__pg_conn.table_insert(self.__schema, self.__event_class_name, fields, values)
+    def events_sql_flush(self):
+        if self.__bulk_insert is not None:
+            self.__bulk_insert.flush()
 
     def event_insert(self, qgis_point, route_id, event_uuid, frommeas, tomeas, azi, feat_id_toupd=None):
         feature = QgsFeature(self.__layer.fields())
@@ -170,95 +163,131 @@ class LRSContEventClass(LRSLayerClass):
             self.__layer.endEditCommand()
 
     def events_update(self, routelist, route_class, srid, tol):
+        # relocate the events of all routes in routelist, changes are written in bulk
+        if len(routelist) == 0:
+            return
         now_utc = self.datetime
-        for route_id in routelist:
-            fields = """{id}, {x}, {y}, {frommeas}, {tomeas}""" \
-                        .format(id="id", x="ST_X(geom)", y="ST_Y(geom)", frommeas="frommeas", tomeas="tomeas")
-            where = "route_id = '" + route_id + "'"
-            order = "frommeas ASC"
-            events = self.__pg_conn.table_select(self.__schema, self.__event_class_name, fields, where, order)
-
-            if len(events) != 0:
-                # get end point
-                result_end = route_class.point_routeend_get(route_id)
-                meas_end = result_end[1]
-                frommeas = 0
-                # get all events without the last one, prevent it to be deleted
-                for event in events[:-1]:
-                    feat_id = event[0]
-                    # get existing point
-                    x, y = event[1], event[2]
-                    qgis_point = QgsPointXY(x, y)
-                    # get new event point
-                    result_new = route_class.point_meas_get(route_id, qgis_point, srid)
-                    x_new, y_new = result_new[0].x(), result_new[0].y()
-                    meas_new = result_new[1]
-                    # get diff to new event point
-                    dist = misc_utils.points_dist_get([x, y], [x_new, y_new])
-                    meas_diff = abs(meas_new - event[4])
-                    if (meas_new <= tol) or (meas_new > (meas_end - tol)):
-                        # new event point is not along the route and will be deleted
-                        # must be done first
-                        self.__pg_conn.table_delete_row(self.__schema, self.__event_class_name, "id = " + str(feat_id))
-                        expression = ""
-                    elif dist > tol:
-                        # new geom, route changes along event point
-                        expression = """geom = ST_SetSRID(ST_MakePoint({x}, {y}), {srid}), frommeas = {frommeas}, 
-                                     tomeas = {meas_new}, azi = {azi}, changetstz = '{utc}', 
-                                     apprtstz = '1000-01-01 01:01:01', geomtstz = '{utc}'""" \
-                                     .format(x=x_new, y=y_new, srid=srid,
-                                             frommeas=frommeas, meas_new=meas_new, azi=result_new[2], utc=now_utc)
-                        # set new frommeas
-                        frommeas = meas_new
-                    elif dist <= tol < meas_diff:
-                        # only meas changes, route changes underneath event point
-                        expression = """frommeas = {frommeas}, tomeas = {meas_new}, azi = {azi}, changetstz = '{utc}'""" \
-                                     .format(frommeas=frommeas, meas_new=meas_new, azi=result_new[2], utc=now_utc)
-                        # set new frommeas
-                        frommeas = meas_new
-                    else:
-                        # no changes, route changes above event point
-                        # set new frommeas
-                        frommeas = meas_new
-                        expression = ""
-                    if len(expression) > 0:
-                        self.__pg_conn.table_update1(self.__schema, self.__event_class_name, expression, "id = "
-                                                     + str(feat_id))
+        fields = """{id}, {x}, {y}, {frommeas}, {tomeas}, {route_id}""" \
+                 .format(id="id", x="ST_X(geom)", y="ST_Y(geom)", frommeas="frommeas", tomeas="tomeas",
+                         route_id="route_id")
+        where = "route_id IN (" + misc_utils.sql_list_get(routelist) + ")"
+        order = "route_id ASC, frommeas ASC"
+        events_all = self.__pg_conn.table_select(self.__schema, self.__event_class_name, fields, where, order)
+        # group events by route, ordered by frommeas
+        events_route = {}
+        for event in events_all:
+            events_route.setdefault(str(event[5]), []).append(event)
 
-                # get last point of route
-                event_end = events[-1]
-                x_new, y_new = result_end[0].x(), result_end[0].y()
-                dist_end = misc_utils.points_dist_get([event_end[1], event_end[2]], [x_new, y_new])
-                if dist_end > tol:
-                    # new geom, route changes at the end
-                    expression = """geom = ST_SetSRID(ST_MakePoint({x}, {y}), {srid}), frommeas = {frommeas}, 
-                                 tomeas = {meas_end}, azi = {azi}, changetstz = '{utc}', 
-                                 apprtstz = '1000-01-01 01:01:01', geomtstz = '{utc}'""" \
-                                 .format(x=x_new, y=y_new, srid=srid,
-                                         frommeas=frommeas, meas_end=meas_end, azi=result_end[2], utc=now_utc)
+        del_list = []
+        geom_list = []
+        meas_list = []
+        for route_id, events in events_route.items():
+            # get end point
+            result_end = route_class.point_routeend_get(route_id)
+            meas_end = result_end[1]
+            frommeas = 0
+            # get new event points of all events without the last one in one pass
+            points = [[event[1], event[2]] for event in events[:-1]]
+            results_new = route_class.points_meas_get(route_id, points, srid)
+            # get all events without the last one, prevent it to be deleted
+            for i, event in enumerate(events[:-1]):
+                feat_id = event[0]
+                # get existing point
+                x, y = event[1], event[2]
+                # get new event point
+                x_new, y_new = results_new[0][i].x(), results_new[0][i].y()
+                meas_new = results_new[1][i]
+                azi_new = results_new[2][i]
+                # get diff to new event point
+                dist = misc_utils.points_dist_get([x, y], [x_new, y_new])
+                meas_diff = abs(meas_new - event[4])
+                if (meas_new <= tol) or (meas_new > (meas_end - tol)):
+                    # new event point is not along the route and will be deleted
+                    del_list.append(feat_id)
+                elif dist > tol:
+                    # new geom, route changes along event point
+                    geom_list.append((feat_id, wkb.point_ewkb_get(x_new, y_new, srid).hex(), frommeas, meas_new,
+                                      azi_new))
+                    # set new frommeas
+                    frommeas = meas_new
+                elif dist <= tol < meas_diff:
+                    # only meas changes, route changes underneath event point
+                    meas_list.append((feat_id, frommeas, meas_new, azi_new))
+                    # set new frommeas
+                    frommeas = meas_new
                 else:
-                    expression = """frommeas = {frommeas}, tomeas = {meas_end}, azi = {azi}, changetstz = '{utc}'""" \
-                                 .format(frommeas=frommeas, meas_end=meas_end, azi=result_end[2], utc=now_utc)
-                # update last point of route
-                where = "id = " + str(event_end[0])
-                self.__pg_conn.table_update1(self.__schema, self.__event_class_name, expression, where)
+                    # no changes, route changes above event point
+                    # set new frommeas
+                    frommeas = meas_new
+
+            # get last point of route
+            event_end = events[-1]
+            x_new, y_new = result_end[0].x(), result_end[0].y()
+            dist_end = misc_utils.points_dist_get([event_end[1], event_end[2]], [x_new, y_new])
+            if dist_end > tol:
+                # new geom, route changes at the end
+                geom_list.append((event_end[0], wkb.point_ewkb_get(x_new, y_new, srid).hex(), frommeas, meas_end,
+                                  result_end[2]))
+            else:
+                meas_list.append((event_end[0], frommeas, meas_end, result_end[2]))
+
+        # deleting must be done first
+        if len(del_list) > 0:
+            where = "id IN (" + misc_utils.sql_list_get(del_list, False) + ")"
+            self.__pg_conn.table_delete_row(self.__schema, self.__event_class_name, where)
+        if len(geom_list) > 0:
+            # geom as hex EWKB
+            expression = """geom = data.geom, frommeas = data.frommeas, 
+                         tomeas = data.tomeas, azi = data.azi, changetstz = '{utc}', 
+                         apprtstz = '1000-01-01 01:01:01', geomtstz = '{utc}'""".format(utc=now_utc)
+            valuefields = "id, geom, frommeas, tomeas, azi"
+            template = "(%s, %s::geometry, %s::double precision, %s::double precision, %s::double precision)"
+            self.__pg_conn.table_update3(self.__schema, self.__event_class_name, expression, "id", valuefields,
+                                         geom_list, template)
+        if len(meas_list) > 0:
+            expression = """frommeas = data.frommeas, tomeas = data.tomeas, azi = data.azi, changetstz = '{utc}'""" \
+                         .format(utc=now_utc)
+            valuefields = "id, frommeas, tomeas, azi"
+            template = "(%s, %s::double precision, %s::double precision, %s::double precision)"
+            self.__pg_conn.table_update3(self.__schema, self.__event_class_name, expression, "id", valuefields,
+                                         meas_list, template)
+        # materialized view: geometries of the changed routes
+        self.__pg_conn.event_view_routes_refresh(self.__schema, self.__event_class_name, routelist)
 
         self.__layer.updateExtents()
 
-    def events_approvable_get(self, route_class_name, tolerance, checkonly=False):
-        fields = """val.{id}, val.{tomeas}, val.{event_id}, val.{route_id}, et.{name}""" \
+    def __events_approvable_query_get(self, route_class_name):
+        # events with event name and route name in one query, parts of a route are grouped
+        fields = """val.{id}, val.{tomeas}, val.{event_id}, val.{route_id}, et.{name}, rc.{name}""" \
                  .format(id="id", tomeas="tomeas", event_id="event_id", route_id="route_id", name="name")
-
         where = "val.apprtstz = '1000-01-01 01:01:01'"
-        tablename_a = self.__event_class_name + " val"
-        tablename_b = self.__event_class_name + "_et et"
-        a_id_field = "val.event_id"
-        b_id_field = "et.uuid"
-        countfield = "val.id"
-        group = "val.id, et.name"
-        order = "val.route_id ASC, val.tomeas ASC"
-        events = self.__pg_conn.table_select_count_leftjoin(self.__schema, tablename_a, tablename_b, fields,
-                                                            countfield, a_id_field, b_id_field, group, where, order)
+        joinlist = [[self.__event_class_name + "_et et", "val.event_id = et.uuid"],
+                    [route_class_name + " rc", "val.route_id = rc.route_id"]]
+        group = "val.id, et.name, rc.name"
+        order = "rc.name ASC, val.tomeas ASC"
+        return [self.__schema, self.__event_class_name + " val", joinlist, fields, where, group, order]
+
+    def events_approvable_fetch(self, route_class_name, size=500):
+        # like events_approvable_get, but yields blocks of [route name, route_id, event] ordered by route name
+        # from a server-side cursor, without measure checks
+        # unique name, the uuid first -> not lost when postgres truncates the name to 63 characters
+        cursorname = "lrs_approvable_" + misc_utils.uuid_get().hex + "_" + self.__event_class_name
+        blocks = self.__pg_conn.table_select_join_fetch(cursorname, *self.__events_approvable_query_get(
+            route_class_name), size=size)
+        try:
+            for events in blocks:
+                yield [[event[5], str(event[3]), str(event[0]) + ": " + (event[4]) + " / " + str(event[1])]
+                       for event in events]
+        finally:
+            blocks.close()
+
+    def route_meas_errors_get(self, route_id, tolerance, route_class_name):
+        # events with wrong measures along the route
+        return meas_check.route_meas_errors_get(self.__pg_conn, self.__schema, self.__event_class_name, "c", route_id,
+                                                tolerance, route_class_name)
+
+    def events_approvable_get(self, route_class_name, tolerance, checkonly=False):
+        events = self.__pg_conn.table_select_join(*self.__events_approvable_query_get(route_class_name))
 
         if checkonly:
             if len(events) > 0:
@@ -274,8 +303,7 @@ class LRSContEventClass(LRSLayerClass):
         # get all events in a dict to display in the eventapprovaldockwidget
         for count, event in enumerate(events):
             route_id = str(event[3])
-            where = "route_id = '" + route_id + "'"
-            route_name = self.__pg_conn.table_select(self.__schema, route_class_name, "name", where)[0][0]
+            route_name = event[5]
             route_id_set.add(route_name + "%%" + route_id)
             if route_name != route_name_old and count > 0:
                 routedict[route_name_old] = tmplist
@@ -291,14 +319,9 @@ class LRSContEventClass(LRSLayerClass):
         routeerrdict = {}
         if len(route_id_set) > 0:
             for route_id in route_id_set:
-                result = self.events_meas_check(route_id.split("%%")[1], tolerance, route_class_name)
-                if result is not None:
-                    tmplist = []
-                    for errlist in result[0]:
-                        val = str(errlist[0]) + ": " + str(errlist[3])
-                        tmplist.append(val)
-                    if len(tmplist) > 0:
-                        routeerrdict[route_id.split("%%")[0]] = tmplist
+                tmplist = self.route_meas_errors_get(route_id.split("%%")[1], tolerance, route_class_name)
+                if len(tmplist) > 0:
+                    routeerrdict[route_id.split("%%")[0]] = tmplist
         return routedict, routeerrdict
 
     def event_approve(self, feat_id):
@@ -308,41 +331,5 @@ class LRSContEventClass(LRSLayerClass):
         self.__pg_conn.table_update1(self.__schema, self.__event_class_name, expression, where)
 
     def events_meas_check(self, route_id, tolerance, route_class_name):
-        fields = """{id}, {uuid}, {frommeas}, {tomeas}, {geom}""" \
-                    .format(id="id", uuid="uuid", frommeas="frommeas", tomeas="tomeas",
-                            geom="geom")
-        where = "route_id = '" + route_id + "'"
-        order = "frommeas ASC"
-        event_list = self.__pg_conn.table_select(self.__schema, self.__event_class_name, fields, where, order)
-
-        result = []
-        # no events on route
-        if len(event_list) == 0:
-            return None
-
-        # check if first meas is 0
-        firstzero = True
-        if event_list[0][2] > tolerance:
-            firstzero = False
-
-        # check following meas
-        oldmeas = 0
-        for event in event_list:
-            frommeas = event[2]
-            tomeas = event[3]
-            if abs(frommeas - oldmeas) > tolerance:
-                result.append([event[0], event[1], frommeas, tomeas, event[4]])
-            oldmeas = tomeas
-
-        # check last meas with length of route
-        fields = """{route_id}, {length}""".format(route_id="route_id", length="length")
-        length_list = self.__pg_conn.table_select(self.__schema, route_class_name, fields, where)
-        # sum for routes with many parts
-        total_length = 0
-        for length in length_list:
-            total_length = total_length + length[1]
-        lastmeas = True
-        if abs(total_length - oldmeas) > tolerance:
-            lastmeas = False
-
-        return result, firstzero, lastmeas
+        return meas_check.cont_events_meas_check(self.__pg_conn, self.__schema, self.__event_class_name, route_id,
+                                                 tolerance, route_class_name)
@@ -18,6 +18,9 @@
  ***************************************************************************/
 """
 
+# bits of options in lrs_event_classes
+OPTION_MATERIALIZED = 1
+
 
 class LRSEventClasses:
 
@@ -69,10 +72,12 @@ class LRSEventClasses:
             self.__pg_conn.point_event_class_create(self.__schema, event_class_name, srid)
         elif event_class_type == "c":
             self.__pg_conn.cont_event_class_create(self.__schema, event_class_name, srid)
-            self.__pg_conn.cont_event_view_create(self.__schema, event_class_name, route_class_name, srid)
+            self.__pg_conn.cont_event_view_create(self.__schema, event_class_name, route_class_name, srid,
+                                                  bool(event_class_option & OPTION_MATERIALIZED))
         elif event_class_type == "t":
             self.__pg_conn.tour_event_class_create(self.__schema, event_class_name, srid)
-            self.__pg_conn.tour_event_view_create(self.__schema, event_class_name, route_class_name, srid)
+            self.__pg_conn.tour_event_view_create(self.__schema, event_class_name, route_class_name, srid,
+                                                  bool(event_class_option & OPTION_MATERIALIZED))
         # add to list and dictionaries
         self.__idlist.append(event_class_id)
         self.__namedict[event_class_id] = event_class_name
@@ -109,6 +114,31 @@ class LRSEventClasses:
                 ret_val = self.event_class_types[key]
         return ret_val
 
+    def event_class_materialized_get(self, event_class_name):
+        # view of the event class is a table refreshed by triggers
+        ret_val = False
+        for key, val in self.__namedict.items():
+            if val == event_class_name:
+                ret_val = bool(self.__optiondict[key] & OPTION_MATERIALIZED)
+        return ret_val
+
+    def routes_referenced_get(self, routelist):
+        # (route_id, event class name) for all routes of routelist referenced by events, with one query
+        if len(routelist) == 0 or len(self.__idlist) == 0:
+            return set()
+        tablelist = []
+        for clid in self.__idlist:
+            event_class_name = self.__namedict[clid]
+            event_class_type = self.__typedict[clid]
+            if event_class_type == "p":
+                tablelist.append([event_class_name + "_bp", event_class_name])
+            elif event_class_type == "c":
+                tablelist.append([event_class_name, event_class_name])
+            elif event_class_type == "t":
+                tablelist.append([event_class_name + "_mt", event_class_name])
+        references = self.__pg_conn.route_references_get(self.__schema, tablelist, routelist)
+        return set((str(reference[0]), reference[1]) for reference in references)
+
     def event_classes_stat(self):
         count_c = 0
         count_p = 0
@@ -23,6 +23,7 @@ from qgis.core import QgsGeometry, QgsPointXY, QgsFeatureRequest
 
 from ..cls.lrslayerclass import LRSLayerClass
 from ..utils import qgis_utils
+from ..utils import wkb
 
 
 class LRSPointEventClass(LRSLayerClass):
@@ -38,6 +39,7 @@ class LRSPointEventClass(LRSLayerClass):
         self.__namedict = None
         self.__bp_countdict = None
         self.__useddict = None
+        self.__bulk_insert = None
 
         self.__data_get()
 
@@ -144,37 +146,23 @@ class LRSPointEventClass(LRSLayerClass):
                 return val
 
     def event_sql_insert(self, event_name, qgis_point, srid, fields_list, fields_values):
+        # buffered, written with events_sql_flush, returns the uuid of the new point event
+        if self.__bulk_insert is None:
+            self.__bulk_insert = self.__pg_conn.bulk_insert_get(self.__schema, self.__event_class_name)
         now_utc = self.datetime
         uuid = self.uuid
-        fields = "uuid, geom, name, createtstz, changetstz, geomtstz"
-        values = "'{uuid}', ST_SetSRID(ST_MakePoint({x}, {y}), {srid}), '{event_name}', '{now_utc}', '{now_utc}', " \
-                 "'{now_utc}'" \
-                 .format(uuid=uuid, x=qgis_point.x(), y=qgis_point.y(), srid=srid, event_name=event_name,
-                         now_utc=now_utc)
-
+        fields = ["uuid", "geom", "name", "createtstz", "changetstz", "geomtstz"]
+        geom = wkb.point_ewkb_get(qgis_point.x(), qgis_point.y(), srid).hex()
+        values = [uuid, geom, event_name, now_utc, now_utc, now_utc]
         # additional values of fields to insert
-        for i in range(len(fields_list)):
-            value = fields_values[i]
-            fieldname = fields_list[i]
-            field_type = self.__pg_conn.field_type_get(self.__schema, self.__event_class_name, fieldname)[1]
-            if value is not None:
-                if field_type != 'other':
-                    fields = ''.join((fields, ", ", fieldname))
-                    if field_type == 'string':
-                        # replace single quotes
-                        value = value.replace("'", "''")
-                    if field_type == 'number' or field_type == 'boolean':
-                        values = ''.join((values, ", ", str(value)))
-                    else:
-                        values = ''.join((values, ", '", str(value), "'"))
-
-        event_name_id = self.__pg_conn.table_insert(self.__schema, self.__event_class_name, fields, values, "id")
-
-        self.__uuiddict[event_name_id] = uuid
-        self.__namedict[event_name_id] = event_name
-        self.__bp_countdict[event_name_id] = "0"
-        self.__useddict[event_name_id] = "0"
-        return event_name_id
+        self.__bulk_insert.add(fields + list(fields_list), values + list(fields_values))
+        return uuid
+
+    def events_sql_flush(self):
+        if self.__bulk_insert is not None:
+            self.__bulk_insert.flush()
+            # ids are given by the database
+            self.__data_get()
 
     def event_insert(self, event_id, qgis_point):
         now_utc = self.datetime
@@ -82,9 +82,11 @@ class LRSProject:
 
         self.__values_set(valuelist)
 
-    def routes_synchronize(self, basesystem_id, logfile):
+    def routes_synchronize(self, basesystem_id, logfile, routenames=None):
+        # routenames: compare only these routes (see LRSBasesystem.routes_changed_get), None = all routes
         logfile.write("UPDATE ROUTE CLASS", "INFORM")
         self.__route_class = LRSRouteClass(self.__pg_conn, self.__schema, self.__route_class_name)
+        self.__pg_conn.route_measure_columns_add(self.__schema, self.__route_class_name.lower(), self.__srid)
 
         # get existing routes from route class and valid routes from lrs_route_class
         routelist_valid = self.__pg_conn.table_select_group(self.__schema, "lrs_route_class", "name", "name",
@@ -97,8 +99,8 @@ class LRSProject:
         # compare, get differences -> new routes
         routeset_new = routeset_valid.difference(routeset_exist)
         # insert new routes
-        for route_new in routeset_new:
-            self.__route_class.route_insert(route_new, basesystem_id)
+        self.__route_class.routes_insert(sorted(routeset_new), basesystem_id)
+        for route_new in sorted(routeset_new):
             logfile.write("Route " + route_new + ": new route inserted", "INFORM")
 
         # get ALL routes from lrs_route_class
@@ -110,11 +112,12 @@ class LRSProject:
         routeset_del = routeset_exist.difference(routeset_all)
         # get name and route_id of routes to delete
         route_del_list = []
-        for route_name_del in routeset_del:
-            where = "name = '" + route_name_del + "'"
-            route_id_del_list = self.__pg_conn.table_select(self.__schema, self.__route_class_name, "route_id", where)
+        if len(routeset_del) > 0:
+            where = "name IN (" + misc_utils.sql_list_get(routeset_del) + ")"
+            route_id_del_list = self.__pg_conn.table_select(self.__schema, self.__route_class_name,
+                                                            "route_id, name", where)
             for route_id_del in route_id_del_list:
-                route_del_list.append([route_id_del[0], route_name_del])
+                route_del_list.append([route_id_del[0], route_id_del[1]])
 
         # get all event classes
         self.__lrs_event_classes = LRSEventClasses(self.__pg_conn, self.__schema, self.__id)
@@ -123,22 +126,15 @@ class LRSProject:
         # create a list with route_id with existing events
         route_del_list_def = []
         route_del_list_tmp = []
+        # get references of all routes to delete with one query
+        references = self.__lrs_event_classes.routes_referenced_get([route_del[0] for route_del in route_del_list])
         for route_del in route_del_list:
             event_class_name_list = []
             route_id = str(route_del[0])
             route_name = route_del[1]
             for clid in self.__lrs_event_classes.event_class_idlist:
                 event_class_name = self.__lrs_event_classes.event_class_names[clid]
-                event_class_type = self.__lrs_event_classes.event_class_types[clid]
-                where = "route_id = '" + route_id + "'"
-                classname = ""
-                if event_class_type == "p":
-                    classname = event_class_name + "_bp"
-                elif event_class_type == "c":
-                    classname = event_class_name
-                elif event_class_type == "t":
-                    classname = event_class_name + "_mt"
-                if len(self.__pg_conn.table_select(self.__schema, classname, "id", where)) > 0:
+                if (route_id, event_class_name) in references:
                     event_class_name_list.append(event_class_name)
             if len(event_class_name_list) > 0:
                 for val in event_class_name_list:
@@ -148,34 +144,42 @@ class LRSProject:
             else:
                 route_del_list_def.append(route_name)
         # delete routes
+        self.__route_class.routes_delete(route_del_list_def)
         for route_name_del in route_del_list_def:
-            self.__route_class.route_delete(route_name_del)
             logfile.write("Route " + route_name_del + ": deleted", "INFORM")
 
         # return changed routes, compares only VALID routes
-        routelist = self.__pg_conn.linestring_compare(self.__schema, self.__route_class_name, "geom")
+        if routenames is None:
+            routelist = self.__pg_conn.linestring_compare(self.__schema, self.__route_class_name, "geom")
+        elif len(routenames) > 0:
+            where = "a.name IN (" + misc_utils.sql_list_get(routenames) + ")"
+            routelist = self.__pg_conn.linestring_compare(self.__schema, self.__route_class_name, "geom", where)
+        else:
+            routelist = []
 
-        routelist_upd = []
+        routenames_upd = []
+        # routes not updated because of errors
+        routenames_rejected = []
         for route in routelist:
             if not route[1] is None:
                 route_name = route[0]
                 if not route[1]:
                     # st_equals = false -> not considering order of coord
-                    where = "name = '" + route_name + "'"
-                    route_id = self.__pg_conn.table_select(self.__schema, self.__route_class_name,
-                                                           "route_id", where)[0][0]
-                    self.__route_class.route_update(route_name, route_id, basesystem_id)
-                    routelist_upd.append(route_id)
-                    logfile.write("Route " + route_name + ": updated", "INFORM")
+                    routenames_upd.append(route_name)
                 elif route[1] and not route[2]:
                     # st_equals = true, st_orderingequals = false -> no route update
                     logfile.write("Route " + route_name + ": coordinates are not in the same order. Route not updated.",
                                   "ERROR")
+                    routenames_rejected.append(route_name)
+        # update changed routes, get route_id of all changed routes with one query
+        routedict_upd = self.__route_class.routes_id_get(routenames_upd)
+        self.__route_class.routes_update(routedict_upd, basesystem_id)
+        routelist_upd = []
+        for route_name in routenames_upd:
+            routelist_upd.append(routedict_upd[route_name])
+            logfile.write("Route " + route_name + ": updated", "INFORM")
 
-        # update length of all routes
-        self.__route_class.routes_length_update()
-
-        return routelist_upd, route_del_list_tmp
+        return routelist_upd, route_del_list_tmp, routenames_rejected
 
     def __values_set(self, valuelist):
         self.__id = valuelist[0]
@@ -222,6 +226,15 @@ class LRSProject:
         else:
             return None
 
+    def routes_edited_get(self):
+        # routes edited in the route class since the last route update, must be repaired also if the
+        # basesystem has not changed
+        if not self.__pg_conn.table_exists(self.__schema, "lrs_route_class"):
+            return []
+        if not self.__pg_conn.table_exists(self.__schema, self.__route_class_name.lower()):
+            return []
+        return self.__pg_conn.linestring_hash_changed_get(self.__schema, self.__route_class_name, "geom")
+
     # set property without a value -> regular function
     def routeupdatetstz_set(self):
         now_utc = misc_utils.datetime_utc_get()
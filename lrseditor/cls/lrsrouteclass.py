@@ -17,108 +17,116 @@
  *                                                                         *
  ***************************************************************************/
 """
+import math
+
 from qgis.core import QgsPoint
 
 from ..cls.lrslayerclass import LRSLayerClass
 from ..utils import qgis_utils
 from ..utils import misc_utils
+from ..utils.routegeom import RouteGeom
 
 
 class LRSRouteClass(LRSLayerClass):
+    # route geometries with route_id as key per route class layer (layer id), shared by all instances:
+    # the map tools keep their instance, changes by the route class update must be seen there too
+    ROUTE_GEOMS = {}
 
     def __init__(self, pg_conn, schema, route_class_name):
         self.__schema = schema
         self.__pg_conn = pg_conn
         self.__name = route_class_name
         self.__layer = qgis_utils.layer_by_tablename_get(self.__schema, self.__name)
+        if self.__layer is None:
+            self.__route_geoms = {}
+        else:
+            layer_id = self.__layer.id()
+            if layer_id not in LRSRouteClass.ROUTE_GEOMS:
+                LRSRouteClass.ROUTE_GEOMS[layer_id] = {}
+                # route class edited in QGIS, connected once per layer
+                self.__layer.afterCommitChanges.connect(LRSRouteClass.ROUTE_GEOMS[layer_id].clear)
+            self.__route_geoms = LRSRouteClass.ROUTE_GEOMS[layer_id]
         LRSLayerClass.__init__(self, self.__layer)
 
     def route_name_get(self, route_id, sortnr=None):
-        if not sortnr:
-            where = "route_id = '" + route_id + "'"
-        else:
-            where = "route_id = '" + route_id + "' and sortnr = " + str(sortnr)
-
-        result = self.__pg_conn.table_select(self.__schema, self.__name, "name", where)
-        if len(result) > 0:
-            return result[0][0]
-        else:
-            return None
+        return self.__pg_conn.route_name_get(self.__schema, self.__name, route_id, sortnr if sortnr else None)
 
     def route_id_get(self, route_name, sortnr=None):
-        if not sortnr:
-            where = "name = '" + route_name + "'"
-        else:
-            where = "name = '" + route_name + "' and sortnr = " + str(sortnr)
-
-        result = self.__pg_conn.table_select(self.__schema, self.__name, "route_id", where)
-        if len(result) > 0:
-            return result[0][0]
-        else:
-            return None
+        return self.__pg_conn.route_id_get(self.__schema, self.__name, route_name, sortnr if sortnr else None)
 
     def route_update(self, route_name, route_id, basesystem_id):
-        # get all routes from lrs_route_class
-        where = "name = '" + str(route_name) + "'"
-        fields = "name, pathnr"
-        order = "name ASC, pathnr ASC"
-        routelist_lrs = self.__pg_conn.table_select(self.__schema, "lrs_route_class", fields, where, order)
-        routeset_lrs = set(str(route[0]) + "&&" + str(route[1]) for route in routelist_lrs)
-        # get all routes from route class
-        fields = "name, sortnr"
-        order = "name ASC, sortnr ASC"
-        routelist = self.__pg_conn.table_select(self.__schema, self.__name, fields, where, order)
-        routeset = set(str(route[0]) + "&&" + str(route[1]) for route in routelist)
-
-        # get route parts to delete
-        route_parts_del = routeset.difference(routeset_lrs)
-        # delete route parts
-        for route_part in route_parts_del:
-            route_name, sortnr = route_part.split("&&")[0], route_part.split("&&")[1]
-            where = "name = '" + str(route_name) + "' AND sortnr = " + str(sortnr)
-            self.__pg_conn.table_delete_row(self.__schema, self.__name, where)
-
-        # update route part or insert new one
+        self.routes_update({route_name: route_id}, basesystem_id)
+
+    def routes_update(self, routedict, basesystem_id):
+        # update route parts from lrs_route_class, routedict: route name -> route_id
+        if len(routedict) == 0:
+            return
+        names = misc_utils.sql_list_get(routedict.keys())
         now_utc = misc_utils.datetime_utc_get()
-        for route_part in sorted(routeset_lrs):
-            route_name, sortnr = route_part.split("&&")[0], route_part.split("&&")[1]
-            where = "name = '" + str(route_name) + "' AND sortnr = " + str(sortnr)
-            if self.__pg_conn.row_exists(self.__schema, self.__name, where):
-                updatetablename = self.__name + " a"
-                fromtablename = "lrs_route_class b"
-                expression = "geom = b.geom"
-                where_upd = "a.name = b.name AND a.sortnr = b.pathnr AND a.name = '" + route_name + "' AND " \
-                            "a.sortnr = " + str(sortnr)
-                # update geom
-                self.__pg_conn.table_update_fromtable(self.__schema, updatetablename, expression,
-                                                      fromtablename, where_upd)
-                where_upd = "name = '" + route_name + "' AND sortnr = " + str(sortnr)
-                expression = "geomtstz = '" + now_utc + "', changetstz = '" + now_utc + "'"
-                # update tstz
-                self.__pg_conn.table_update1(self.__schema, self.__name, expression, where_upd)
-            else:
-                fields = "geom, sortnr, name, route_id, basesystem_id, createtstz, changetstz, geomtstz"
-                fromfields = "geom, pathnr, name, '" + route_id + "', '" + str(basesystem_id) + "', '" + now_utc + \
-                             "', '" + now_utc + "', '" + now_utc + "'"
-                where_ins = "name = '" + str(route_name) + "' AND pathnr = " + str(sortnr)
-                # insert new part
-                self.__pg_conn.table_insert_fromtable(self.__schema, self.__name, fields, fromfields,
-                                                      "lrs_route_class", where_ins)
+        # insert new parts with the route_id of the existing route
+        values = [(route_name, str(route_id)) for route_name, route_id in routedict.items()]
+        fields = "geom, sortnr, name, route_id, basesystem_id, createtstz, changetstz, geomtstz"
+        fromfields = "b.geom, b.pathnr, b.name, data.route_id::uuid, " + str(basesystem_id) + ", '" + now_utc + \
+                     "', '" + now_utc + "', '" + now_utc + "'"
+        where = "NOT EXISTS (SELECT 1 FROM {schema}.{name} a WHERE a.name = b.name AND a.sortnr = b.pathnr)" \
+                .format(schema=self.__schema, name=self.__name)
+        self.__pg_conn.table_insert_fromtable_values(self.__schema, self.__name, fields, fromfields,
+                                                     "lrs_route_class b", "name, route_id", "b.name = data.name",
+                                                     values, where)
+        # update geom and tstz of existing parts
+        updatetablename = self.__name + " a"
+        fromtablename = "lrs_route_class b"
+        expression = "geom = b.geom, geomtstz = '" + now_utc + "', changetstz = '" + now_utc + "'"
+        where = "a.name = b.name AND a.sortnr = b.pathnr AND a.name IN (" + names + ")"
+        self.__pg_conn.table_update_fromtable(self.__schema, updatetablename, expression, fromtablename, where)
+        # delete parts not existing anymore
+        where = "name IN ({names}) AND NOT EXISTS (SELECT 1 FROM {schema}.lrs_route_class b WHERE " \
+                "b.name = {name}.name AND b.pathnr = {name}.sortnr)" \
+                .format(names=names, schema=self.__schema, name=self.__name)
+        self.__pg_conn.table_delete_row(self.__schema, self.__name, where)
+        # length and measures of all parts of the routes
+        self.__pg_conn.route_measures_update(self.__schema, self.__name, "name IN (" + names + ")")
+        # geometry has changed
+        for route_id in routedict.values():
+            self.__route_geoms.pop(str(route_id), None)
 
     def route_insert(self, route_name, basesystem_id):
-        # insert route from lrs_route_class
+        self.routes_insert([route_name], basesystem_id)
+
+    def routes_insert(self, route_names, basesystem_id):
+        # insert routes from lrs_route_class, every route gets a new route_id
+        if len(route_names) == 0:
+            return
+        values = [(route_name, str(self.uuid)) for route_name in route_names]
         fields = "geom, sortnr, name, route_id, basesystem_id, createtstz, changetstz, geomtstz"
         now_utc = misc_utils.datetime_utc_get()
-        where = "name = '" + route_name + "'"
-        uuid = self.uuid
-        fromfields = "geom, pathnr, name, '" + str(uuid) + "', '" + str(basesystem_id) + "', '" + now_utc + \
+        fromfields = "b.geom, b.pathnr, b.name, data.route_id::uuid, " + str(basesystem_id) + ", '" + now_utc + \
                      "', '" + now_utc + "', '" + now_utc + "'"
-        self.__pg_conn.table_insert_fromtable(self.__schema, self.__name, fields, fromfields,
-                                              "lrs_route_class", where)
+        self.__pg_conn.table_insert_fromtable_values(self.__schema, self.__name, fields, fromfields,
+                                                     "lrs_route_class b", "name, route_id", "b.name = data.name",
+                                                     values)
+        # length and measures of all parts of the routes
+        where = "name IN (" + misc_utils.sql_list_get(route_names) + ")"
+        self.__pg_conn.route_measures_update(self.__schema, self.__name, where)
 
     def route_delete(self, route_name):
-        where = "name = '" + route_name + "'"
+        self.routes_delete([route_name])
+
+    def routes_delete(self, route_names):
+        if len(route_names) == 0:
+            return
+        where = "name IN (" + misc_utils.sql_list_get(route_names) + ")"
         self.__pg_conn.table_delete_row(self.__schema, self.__name, where)
+        self.routes_cache_clear()
+
+    def routes_id_get(self, route_names):
+        # route name -> route_id for all route_names with one query
+        if len(route_names) == 0:
+            return {}
+        where = "name IN (" + misc_utils.sql_list_get(route_names) + ")"
+        result = self.__pg_conn.table_select_group(self.__schema, self.__name, "name, route_id", "name, route_id",
+                                                   where)
+        return {route[0]: route[1] for route in result}
 
     def route_reselect(self):
         selected = False
@@ -135,75 +143,84 @@ class LRSRouteClass(LRSLayerClass):
         return selected
 
     def point_meas_get(self, route_id, qgis_point, srid, sortnr=None):
+        # srid is kept for the interface, coordinates of qgis_point must be in the srid of the route class
+        route_geom = self.__route_geom_get(route_id)
         # get closest LineString from a point, respectively the sortnr
         if not sortnr:
-            sortnr = self.__pg_conn.linestring_sortnr_get(self.__schema, self.__name, route_id,
-                                                          qgis_point.x(), qgis_point.y(), "geom", srid)
+            sortnr = route_geom.sortnr_get(qgis_point.x(), qgis_point.y())
+        else:
+            sortnr = int(sortnr)
 
         # return fraction at the position of qgis_point
-        fract = self.__pg_conn.linestring_dist_get(self.__schema, self.__name, route_id, sortnr,
-                                                   qgis_point.x(), qgis_point.y(), "geom", srid)
-        meas, length = self.__meas_get(route_id, sortnr, fract)
-        azi = self.__azi_get(route_id, sortnr, fract, length)
-        qgis_point_along = QgsPoint()
-        pg_point = self.__pg_conn.linestring_point_get(self.__schema, self.__name, route_id, sortnr, fract, "geom")
-        qgis_point_along.fromWkt(pg_point)
-
-        return [qgis_point_along, meas, azi]
+        fract = route_geom.fract_get(sortnr, qgis_point.x(), qgis_point.y())
+        meas = route_geom.meas_get(sortnr, fract)
+        azi = route_geom.azi_get(sortnr, fract)
+        x, y = route_geom.point_get(sortnr, fract)
+
+        return [QgsPoint(x, y), meas, azi]
+
+    def points_meas_get(self, route_id, points, srid, sortnrs=None):
+        # vectorized point_meas_get, points: [[x, y], ...]
+        # returns lists of snapped points, measures and azimuths in the order of points
+        if len(points) == 0:
+            return [[], [], []]
+        route_geom = self.__route_geom_get(route_id)
+        xs = [point[0] for point in points]
+        ys = [point[1] for point in points]
+        if sortnrs is None:
+            sortnrs = route_geom.sortnrs_get(xs, ys)
+        else:
+            sortnrs = [int(sortnr) for sortnr in sortnrs]
+        fracts = route_geom.fracts_get(sortnrs, xs, ys)
+        meas_list = route_geom.meas_array_get(sortnrs, fracts).tolist()
+        azi_list = [None if math.isnan(azi) else azi for azi in route_geom.azis_get(sortnrs, fracts).tolist()]
+        xs_new, ys_new = route_geom.points_get(sortnrs, fracts)
+        qgis_points = [QgsPoint(x, y) for x, y in zip(xs_new.tolist(), ys_new.tolist())]
+
+        return [qgis_points, meas_list, azi_list]
+
+    def points_meas_list_get(self, route_id, qgis_points, srid, sortnrs=None):
+        # like point_meas_get for several points in one pass, e.g. both endpoints of a tour part
+        points = [[qgis_point.x(), qgis_point.y()] for qgis_point in qgis_points]
+        results = self.points_meas_get(route_id, points, srid, sortnrs)
+        return [[results[0][i], results[1][i], results[2][i]] for i in range(len(points))]
+
+    def routes_preload(self, routelist):
+        # load the geometries of several routes with one query
+        routelist = [str(route_id) for route_id in routelist if str(route_id) not in self.__route_geoms]
+        if len(routelist) == 0:
+            return
+        parts = self.__pg_conn.linestrings_parts_get(self.__schema, self.__name, routelist, "geom")
+        route_parts = {}
+        for part in parts:
+            route_parts.setdefault(str(part[0]), []).append(part[1:])
+        for route_id, partlist in route_parts.items():
+            self.__route_geoms[route_id] = RouteGeom(partlist)
 
     def point_routeend_get(self, route_id):
         # return point at route end
-        where = "route_id = '" + route_id + "'"
-        maxsortnr = self.__pg_conn.max_number_get(self.__schema, self.__name, "sortnr", where)
-        meas, length = self.__meas_get(route_id, maxsortnr, 1)
-        azi = self.__azi_get(route_id, maxsortnr, 1, length)
-        qgis_point_end = QgsPoint()
-        pg_point = self.__pg_conn.linestring_point_get(self.__schema, self.__name, route_id, maxsortnr, 1, "geom")
-        qgis_point_end.fromWkt(pg_point)
+        route_geom = self.__route_geom_get(route_id)
+        maxsortnr = route_geom.sortnr_max
+        meas = route_geom.meas_get(maxsortnr, 1)
+        azi = route_geom.azi_get(maxsortnr, 1)
+        x, y = route_geom.point_get(maxsortnr, 1)
 
-        return [qgis_point_end, meas, azi]
+        return [QgsPoint(x, y), meas, azi]
 
-    def routes_length_update(self):
-        self.__pg_conn.linestring_length_update(self.__schema, self.__name, "geom", "length")
+    def routes_cache_clear(self):
+        # cached geometries must be reloaded after changing routes
+        self.__route_geoms.clear()
 
     def route_length_get(self, route_id):
-        fields = """{route_id}, {length}""".format(route_id="route_id", length="length")
-        where = "route_id = '" + route_id + "'"
-        length_list = self.__pg_conn.table_select(self.__schema, self.__name, fields, where)
-        # sum for routes with multipart
-        total_length = 0
-        for length in length_list:
-            total_length = total_length + length[1]
-        return total_length
-
-    def __azi_get(self, route_id, sortnr, fract, length):
-        # get azimuth, calc points 0.1 m above and underneath
-        # needs length to convert from percent to meters
-        fract1 = fract - (0.1 / length)
-        if fract1 < 0:
-            fract1 = 0
-        fract2 = fract + (0.1 / length)
-        if fract2 > 1:
-            fract2 = 1
-
-        pg_point1 = self.__pg_conn.linestring_point_get(self.__schema, self.__name, route_id, sortnr, fract1, "geom")
-        pg_point2 = self.__pg_conn.linestring_point_get(self.__schema, self.__name, route_id, sortnr, fract2, "geom")
-        return self.__pg_conn.linestring_azi_get(pg_point1, pg_point2)
-
-    def __meas_get(self, route_id, sortnr, fract):
-        # meas respects multipart linestring
-        meas = 0
-        length_sel = 0
-        for i in range(1, sortnr + 1):
-            length = self.__pg_conn.linestring_length_get(self.__schema, self.__name, route_id, i, "geom")
-            if i != sortnr:
-                meas = meas + length
-            else:
-                meas = meas + length * fract
-                length_sel = length
-                break
-        # meas = total distance till position (fract), length = length of linestring with sortnr i
-        return meas, length_sel
+        return self.__pg_conn.route_length_get(self.__schema, self.__name, route_id)
+
+    def __route_geom_get(self, route_id):
+        # load all route parts once, measures and azimuths are computed locally
+        route_id = str(route_id)
+        if route_id not in self.__route_geoms:
+            partlist = self.__pg_conn.linestring_parts_get(self.__schema, self.__name, route_id, "geom")
+            self.__route_geoms[route_id] = RouteGeom(partlist)
+        return self.__route_geoms[route_id]
 
     # get properties
     @property
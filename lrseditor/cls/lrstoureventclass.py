@@ -26,6 +26,111 @@ from ..cls.lrslayerclass import LRSLayerClass
 from ..cls.lrseventnamesclass import LRSEventNamesClass
 from ..utils import qgis_utils
 from ..utils import misc_utils
+from ..utils import wkb
+from ..utils import meas_check
+
+
+class TourPartIndex:
+    # index of the tour parts (_mt), one per layer shared by all LRSTourEventClass instances (the tools create an
+    # instance per click), built with the first lookup and updated on edits of the layer
+    # feature id -> values of INDEX_FIELDS, event_id -> feature ids, point uuid -> feature ids
+    # fields of the tour parts in the index, in this order after the feature id
+    INDEX_FIELDS = ['uuid', 'event_id', 'route_id', 'sortnr', 'frommeas', 'frompoint_id', 'tomeas', 'topoint_id',
+                    'routedir']
+    # layer id -> index
+    INDEXES = {}
+
+    @classmethod
+    def get(cls, layer_mt):
+        if layer_mt.id() not in cls.INDEXES:
+            cls.INDEXES[layer_mt.id()] = TourPartIndex(layer_mt)
+        return cls.INDEXES[layer_mt.id()]
+
+    def __init__(self, layer_mt):
+        self.__layer_mt = layer_mt
+        self.__layer_id = layer_mt.id()
+        self.__index = None
+        self.__index_event = None
+        self.__index_point = None
+        self.__layer_mt.featureAdded.connect(self.__feature_added)
+        self.__layer_mt.featuresDeleted.connect(self.__features_deleted)
+        self.__layer_mt.attributeValueChanged.connect(self.__attribute_changed)
+        # feature ids change with commit, rolled back edits are not signaled one by one
+        self.__layer_mt.afterCommitChanges.connect(self.clear)
+        self.__layer_mt.afterRollBack.connect(self.clear)
+        self.__layer_mt.willBeDeleted.connect(self.disconnect)
+
+    def disconnect(self):
+        # layer removed from the project
+        self.__layer_mt.featureAdded.disconnect(self.__feature_added)
+        self.__layer_mt.featuresDeleted.disconnect(self.__features_deleted)
+        self.__layer_mt.attributeValueChanged.disconnect(self.__attribute_changed)
+        self.__layer_mt.afterCommitChanges.disconnect(self.clear)
+        self.__layer_mt.afterRollBack.disconnect(self.clear)
+        self.__layer_mt.willBeDeleted.disconnect(self.disconnect)
+        TourPartIndex.INDEXES.pop(self.__layer_id, None)
+        self.clear()
+
+    def clear(self):
+        self.__index = None
+        self.__index_event = None
+        self.__index_point = None
+
+    def parts_event_get(self, event_id):
+        # [feat_id, values of INDEX_FIELDS] of the parts of a tour
+        self.__build()
+        return [[feat_id] + self.__index[feat_id] for feat_id in self.__index_event.get(event_id, ())]
+
+    def parts_point_get(self, point_uuid):
+        # [feat_id, values of INDEX_FIELDS] of the parts starting or ending at a point
+        self.__build()
+        return [[feat_id] + self.__index[feat_id] for feat_id in self.__index_point.get(point_uuid, ())]
+
+    def __build(self):
+        if self.__index is not None:
+            return
+        self.__index = {}
+        self.__index_event = {}
+        self.__index_point = {}
+        request = QgsFeatureRequest().setFlags(QgsFeatureRequest.NoGeometry)
+        request.setSubsetOfAttributes(self.INDEX_FIELDS, self.__layer_mt.fields())
+        for feature in self.__layer_mt.getFeatures(request):
+            self.__add(feature.id(), [feature[field] for field in self.INDEX_FIELDS])
+
+    def __add(self, feat_id, values):
+        self.__index[feat_id] = values
+        self.__index_event.setdefault(values[1], set()).add(feat_id)
+        self.__index_point.setdefault(values[5], set()).add(feat_id)
+        self.__index_point.setdefault(values[7], set()).add(feat_id)
+
+    def __remove(self, feat_id):
+        values = self.__index.pop(feat_id, None)
+        if values is None:
+            return
+        self.__index_event.get(values[1], set()).discard(feat_id)
+        self.__index_point.get(values[5], set()).discard(feat_id)
+        self.__index_point.get(values[7], set()).discard(feat_id)
+
+    def __feature_added(self, feat_id):
+        if self.__index is not None:
+            feature = self.__layer_mt.getFeature(feat_id)
+            self.__add(feat_id, [feature[field] for field in self.INDEX_FIELDS])
+
+    def __features_deleted(self, feat_ids):
+        if self.__index is not None:
+            for feat_id in feat_ids:
+                self.__remove(feat_id)
+
+    def __attribute_changed(self, feat_id, ind, value):
+        if self.__index is None or feat_id not in self.__index:
+            return
+        fieldname = self.__layer_mt.fields().at(ind).name()
+        if fieldname not in self.INDEX_FIELDS:
+            return
+        values = list(self.__index[feat_id])
+        values[self.INDEX_FIELDS.index(fieldname)] = value
+        self.__remove(feat_id)
+        self.__add(feat_id, values)
 
 
 class LRSTourEventClass(LRSLayerClass):
@@ -40,61 +145,95 @@ class LRSTourEventClass(LRSLayerClass):
         self.__tablename_mt = self.__event_class_name + "_mt"
         self.__table_et_name = self.__event_class_name + "_et"
         self.__tour_event_names = LRSEventNamesClass(self.__pg_conn, self.__schema, self.__event_class_name, "t")
+        self.__bulk_insert = None
+        self.__bulk_insert_mt = None
 
     def events_update(self, routelist, route_class, srid, tol):
-        for route_id in routelist:
-            fields = """{id}, {frommeas}, {tomeas}, {frompoint_id}, {topoint_id}""" \
-                     .format(id="id", frommeas="frommeas", tomeas="tomeas", frompoint_id="frompoint_id",
-                             topoint_id="topoint_id")
-            where = "route_id = '" + route_id + "'"
-            order = "event_id ASC, frommeas ASC"
-            events_list = self.__pg_conn.table_select(self.__schema, self.__tablename_mt, fields, where, order)
-
-            for events in events_list:
-                frommeas_new = self.__event_point_update(events[3], events[1], route_class, route_id, srid, tol)
-                tomeas_new = self.__event_point_update(events[4], events[2], route_class, route_id, srid, tol)
-                where = "id = " + str(events[0])
-                if frommeas_new > -1:
-                    expression = """frommeas = {frommeas_new}""".format(frommeas_new=frommeas_new)
-                    self.__pg_conn.table_update1(self.__schema, self.__tablename_mt, expression, where)
-                if tomeas_new > -1:
-                    expression = """tomeas = {tomeas_new}""".format(tomeas_new=tomeas_new)
-                    self.__pg_conn.table_update1(self.__schema, self.__tablename_mt, expression, where)
+        # relocate the event points of all routes in routelist, every point once also when shared by
+        # several tour parts, changes are written with one update of the points and one of the tour parts
+        if len(routelist) == 0:
+            return
+        now_utc = self.datetime
+        fields = """{id}, {frommeas}, {tomeas}, {frompoint_id}, {topoint_id}, {route_id}""" \
+                 .format(id="id", frommeas="frommeas", tomeas="tomeas", frompoint_id="frompoint_id",
+                         topoint_id="topoint_id", route_id="route_id")
+        where = "route_id IN (" + misc_utils.sql_list_get(routelist) + ")"
+        order = "route_id ASC, event_id ASC, frommeas ASC"
+        events_all = self.__pg_conn.table_select(self.__schema, self.__tablename_mt, fields, where, order)
+        # group tour parts by route
+        events_route = {}
+        for event in events_all:
+            events_route.setdefault(str(event[5]), []).append(event)
+
+        # get all event points of the routes in one query
+        fields = """{uuid}, {x}, {y}""".format(uuid="uuid", x="ST_X(geom)", y="ST_Y(geom)")
+        where = self.__points_where_get(where)
+        event_points = {}
+        for event_point in self.__pg_conn.table_select(self.__schema, self.__event_class_name, fields, where):
+            event_points[str(event_point[0])] = [event_point[1], event_point[2]]
+
+        point_list = []
+        meas_list = []
+        for route_id, events in events_route.items():
+            # unique event points of the route with their new positions in one pass
+            uuids = list(dict.fromkeys(point_id for event in events for point_id in (str(event[3]), str(event[4]))
+                                       if point_id in event_points))
+            results = route_class.points_meas_get(route_id, [event_points[uuid] for uuid in uuids], srid)
+            # uuid -> [moved, meas_new, azi_new, x_new, y_new]
+            points_new = {}
+            for i, uuid in enumerate(uuids):
+                x_new, y_new = results[0][i].x(), results[0][i].y()
+                dist = misc_utils.points_dist_get(event_points[uuid], [x_new, y_new])
+                points_new[uuid] = [dist > tol, results[1][i], results[2][i], x_new, y_new]
+
+            points_changed = set()
+            for event in events:
+                meas_new = []
+                for point_id, meas in ((str(event[3]), event[1]), (str(event[4]), event[2])):
+                    if point_id not in points_new:
+                        meas_new.append(None)
+                        continue
+                    moved, point_meas, azi_new, x_new, y_new = points_new[point_id]
+                    if moved or abs(point_meas - meas) > tol:
+                        # route changes along or underneath event point
+                        points_changed.add(point_id)
+                        meas_new.append(point_meas)
+                    else:
+                        # no changes, route changes above event point
+                        meas_new.append(None)
+                if meas_new[0] is not None or meas_new[1] is not None:
+                    meas_list.append((event[0], meas_new[0], meas_new[1]))
+
+            for point_id in points_changed:
+                moved, point_meas, azi_new, x_new, y_new = points_new[point_id]
+                geom = None
+                if moved:
+                    geom = wkb.point_ewkb_get(x_new, y_new, srid).hex()
+                point_list.append((point_id, moved, geom, azi_new))
+
+        if len(point_list) > 0:
+            # data.move: new geom (hex EWKB), otherwise only azi changes
+            expression = """geom = CASE WHEN data.move THEN data.geom ELSE a.geom END, azi = data.azi, 
+                         apprtstz = CASE WHEN data.move THEN '1000-01-01 01:01:01' ELSE a.apprtstz END, 
+                         changetstz = '{utc}', geomtstz = CASE WHEN data.move THEN '{utc}' ELSE a.geomtstz END""" \
+                         .format(utc=now_utc)
+            valuefields = "uuid, move, geom, azi"
+            template = "(%s::uuid, %s, %s::geometry, %s::double precision)"
+            self.__pg_conn.table_update3(self.__schema, self.__event_class_name, expression, "uuid", valuefields,
+                                         point_list, template)
+        if len(meas_list) > 0:
+            # NULL: meas of the tour part remains
+            expression = "frommeas = COALESCE(data.frommeas, a.frommeas), tomeas = COALESCE(data.tomeas, a.tomeas)"
+            valuefields = "id, frommeas, tomeas"
+            template = "(%s, %s::double precision, %s::double precision)"
+            self.__pg_conn.table_update3(self.__schema, self.__tablename_mt, expression, "id", valuefields,
+                                         meas_list, template)
+        # materialized view: geometries of the changed routes
+        self.__pg_conn.event_view_routes_refresh(self.__schema, self.__event_class_name, routelist)
+        self.index_clear()
 
         self.__layer.updateExtents()
 
-    def __event_point_update(self, event_uuid, meas, route_class, route_id, srid, tol):
-        fields = """{id}, {x}, {y}""".format(id="id", x="ST_X(geom)", y="ST_Y(geom)")
-        where = "uuid = '" + event_uuid + "'"
-        event = self.__pg_conn.table_select(self.__schema, self.__event_class_name, fields, where)[0]
-        # get existing point
-        x, y = event[1], event[2]
-        qgis_point = QgsPointXY(x, y)
-        # get new event point
-        result_new = route_class.point_meas_get(route_id, qgis_point, srid)
-        x_new, y_new = result_new[0].x(), result_new[0].y()
-        meas_new = result_new[1]
-        # get diff to new event point
-        dist = misc_utils.points_dist_get([x, y], [x_new, y_new])
-        meas_diff = abs(meas_new - meas)
-        now_utc = self.datetime
-        expression = ""
-        if dist > tol:
-            # new geom, route changes along event point
-            expression = """geom = ST_SetSRID(ST_MakePoint({x}, {y}), {srid}), azi = {azi}, changetstz = '{utc}', 
-                         apprtstz = '1000-01-01 01:01:01', geomtstz = '{utc}'""" \
-                         .format(x=x_new, y=y_new, srid=srid, azi=result_new[2], utc=now_utc)
-        elif dist <= tol < meas_diff:
-            # only meas changes, route changes underneath event point
-            expression = """azi = {azi}, changetstz = '{utc}'""".format(azi=result_new[2], utc=now_utc)
-
-        if len(expression) > 0:
-            self.__pg_conn.table_update1(self.__schema, self.__event_class_name, expression, where)
-            return meas_new
-        else:
-            # no changes, route changes above event point
-            return -1
-
     def event_meas_get(self, event_uuid, route_id):
         event_list = self.__events_part_get(event_uuid)
         # inconsistent data, more or less than one point found
@@ -107,9 +246,14 @@ class LRSTourEventClass(LRSLayerClass):
         events_list = self.__events_tour_get(event_id, route_id)
         # order by frommeas
         events_list.sort(key=operator.itemgetter(4), reverse=False)
-        # get position (indices) of event_uuid in events_list
-        [listind, pointtype] = \
-            [(i, sub.index(event_uuid)) for (i, sub) in enumerate(events_list) if event_uuid in sub][0]
+        # get position of the tour part in events_list, event_uuid is its frompoint or topoint
+        listind = [events[0] for events in events_list].index(event_list[0][0])
+        if events_list[listind][5] == event_uuid:
+            pointtype = 5
+        elif events_list[listind][7] == event_uuid:
+            pointtype = 7
+        else:
+            pointtype = None
 
         if pointtype == 5:
             # is frompoint
@@ -155,59 +299,35 @@ class LRSTourEventClass(LRSLayerClass):
         if len(event_list) != 1:
             return False
         event_id = event_list[0][1]
-        # get all events for the tour
-        events_list = self.__events_tour_get(event_id)
-        for events in events_list:
-            where = "uuid = '" + events[5] + "'"
-            self.__pg_conn.table_delete_row(self.__schema, self.__event_class_name, where)
-            where = "uuid = '" + events[7] + "'"
-            self.__pg_conn.table_delete_row(self.__schema, self.__event_class_name, where)
-            where = "uuid = '" + events[1] + "'"
+        # delete all parts of the tour with their event points and the event name
+        where = "event_id = '" + event_id + "'"
+        with self.__pg_conn.transaction():
+            self.__pg_conn.table_delete_row(self.__schema, self.__event_class_name, self.__points_where_get(where))
             self.__pg_conn.table_delete_row(self.__schema, self.__tablename_mt, where)
-
-        # delete event name
-        where = "uuid = '" + event_id + "'"
-        self.__pg_conn.table_delete_row(self.__schema, self.__table_et_name, where)
+            where = "uuid = '" + event_id + "'"
+            self.__pg_conn.table_delete_row(self.__schema, self.__table_et_name, where)
+        self.index_clear()
         return True
 
     def events_sql_delete(self, route_id):
+        # delete all tour parts along the route with their event points,
+        # the remaining parts of the tours are renumbered
         where = "route_id = '" + route_id + "'"
-        fields = "id, event_id, sortnr, frompoint_id, topoint_id"
-        order = "event_id ASC, sortnr ASC"
-        event_list = self.__pg_conn.table_select(self.__schema, self.__tablename_mt, fields, where, order)
-        for event in event_list:
-            feat_id = event[0]
-            where = "id = " + str(feat_id)
-            # get current sortnr
-            toursortnr_old = self.__pg_conn.table_select(self.__schema, self.__tablename_mt, "sortnr",
-                                                         where)[0][0]
-            event_id = event[1]
-            fields = "id, sortnr"
-            where = "event_id = '" + event_id + "'"
-            order = "sortnr ASC"
-            # create list with sortnr to update
-            events_list = self.__pg_conn.table_select(self.__schema, self.__tablename_mt, fields,
-                                                      where, order)
-            tour_list = []
-            for events in events_list:
-                if events[1] > toursortnr_old:
-                    tour_list.append([events[0], events[1]])
-                    tour_list.sort(key=operator.itemgetter(1), reverse=False)
-            # delete event points and record in measure table
-            frompoint_id = event[3]
-            topoint_id = event[4]
-            where = "uuid = '" + frompoint_id + "'"
-            self.__pg_conn.table_delete_row(self.__schema, self.__event_class_name, where)
-            where = "uuid = '" + topoint_id + "'"
-            self.__pg_conn.table_delete_row(self.__schema, self.__event_class_name, where)
-            where = "id = " + str(event[0])
+        tours = self.__pg_conn.table_select_group(self.__schema, self.__tablename_mt, "event_id", "event_id", where)
+        if len(tours) == 0:
+            return
+        with self.__pg_conn.transaction():
+            self.__pg_conn.table_delete_row(self.__schema, self.__event_class_name, self.__points_where_get(where))
             self.__pg_conn.table_delete_row(self.__schema, self.__tablename_mt, where)
-            # update sortnr of tour
-            for tour_event in tour_list:
-                toursortnr = tour_event[1]
-                where = "id = " + str(tour_event[0])
-                expression = "sortnr = " + str(toursortnr - 1)
-                self.__pg_conn.table_update1(self.__schema, self.__tablename_mt, expression, where)
+            where = "event_id IN (" + misc_utils.sql_list_get([tour[0] for tour in tours]) + ")"
+            self.__pg_conn.table_sortnr_renumber(self.__schema, self.__tablename_mt, "event_id", where)
+        self.index_clear()
+
+    def __points_where_get(self, where):
+        # event points of the tour parts selected by where
+        return "uuid IN (SELECT frompoint_id FROM {schema}.{table_mt} WHERE {where}) OR " \
+               "uuid IN (SELECT topoint_id FROM {schema}.{table_mt} WHERE {where})" \
+               .format(schema=self.__schema, table_mt=self.__tablename_mt, where=where)
 
     def event_delete(self, event_uuid):
         result = False
@@ -414,8 +534,7 @@ class LRSTourEventClass(LRSLayerClass):
     def event_sql_insert(self, qgis_point_fi, qgis_point_se, event_uuid, route_id, route_class, toursortnr, srid,
                          fields_list, fields_values):
         now_utc = self.datetime
-        result_fi = route_class.point_meas_get(route_id, qgis_point_fi, srid)
-        result_se = route_class.point_meas_get(route_id, qgis_point_se, srid)
+        result_fi, result_se = route_class.points_meas_list_get(route_id, [qgis_point_fi, qgis_point_se], srid)
         uuid_id_fi = self.uuid
         uuid_id_se = self.uuid
         azi_fi = result_fi[2]
@@ -435,47 +554,31 @@ class LRSTourEventClass(LRSLayerClass):
             topoint_id = uuid_id_fi
             routedir = False
 
-        fields = "uuid, geom, azi, apprtstz, createtstz, changetstz, geomtstz"
-        values = "'{uuid}', ST_SetSRID(ST_MakePoint({x}, {y}), {srid}), {azi}, '{now_utc}', '{now_utc}', " \
-                 "'{now_utc}', '{now_utc}'" \
-                 .format(uuid=uuid_id_fi, x=result_fi[0].x(), y=result_fi[0].y(), srid=srid, azi=azi_fi,
-                         now_utc=now_utc)
-        self.__pg_conn.table_insert(self.__schema, self.__event_class_name, fields, values)
-        values = "'{uuid}', ST_SetSRID(ST_MakePoint({x}, {y}), {srid}), {azi}, '{now_utc}', '{now_utc}', " \
-                 "'{now_utc}', '{now_utc}'" \
-                 .format(uuid=uuid_id_se, x=result_se[0].x(), y=result_se[0].y(), srid=srid, azi=azi_se,
-                         now_utc=now_utc)
-        self.__pg_conn.table_insert(self.__schema, self.__event_class_name, fields, values)
-
-        uuid_id = self.uuid
-        fields = "uuid, event_id, route_id, sortnr, frommeas, tomeas, frompoint_id, topoint_id, routedir"
-        values = "'{uuid}', '{event_id}', '{route_id}', {sortnr}, {frommeas}, {tomeas}, '{frompoint_id}', " \
-                 "'{topoint_id}', {routedir}" \
-                 .format(uuid=uuid_id, event_id=event_uuid, route_id=route_id, sortnr=toursortnr, frommeas=frommeas,
-                         tomeas=tomeas, frompoint_id=frompoint_id, topoint_id=topoint_id, routedir=routedir)
-
+        # buffered, written with events_sql_flush
+        if self.__bulk_insert is None:
+            self.__bulk_insert = self.__pg_conn.bulk_insert_get(self.__schema, self.__event_class_name)
+            self.__bulk_insert_mt = self.__pg_conn.bulk_insert_get(self.__schema, self.__tablename_mt)
+        fields = ["uuid", "geom", "azi", "apprtstz", "createtstz", "changetstz", "geomtstz"]
+        geom = wkb.point_ewkb_get(result_fi[0].x(), result_fi[0].y(), srid).hex()
+        self.__bulk_insert.add(fields, [uuid_id_fi, geom, azi_fi, now_utc, now_utc, now_utc, now_utc])
+        geom = wkb.point_ewkb_get(result_se[0].x(), result_se[0].y(), srid).hex()
+        self.__bulk_insert.add(fields, [uuid_id_se, geom, azi_se, now_utc, now_utc, now_utc, now_utc])
+
+        fields = ["uuid", "event_id", "route_id", "sortnr", "frommeas", "tomeas", "frompoint_id", "topoint_id",
+                  "routedir"]
+        values = [self.uuid, event_uuid, route_id, toursortnr, frommeas, tomeas, frompoint_id, topoint_id, routedir]
         # additional values of fields to insert
-        for i in range(len(fields_list)):
-            value = fields_values[i]
-            fieldname = fields_list[i]
-            field_type = self.__pg_conn.field_type_get(self.__schema, self.__tablename_mt, fieldname)[1]
-            if value is not None:
-                if field_type != 'other':
-                    fields = ''.join((fields, ", ", fieldname))
-                    if field_type == 'string':
-                        # replace single quotes
-                        value = value.replace("'", "''")
-                    if field_type == 'number' or field_type == 'boolean':
-                        values = ''.join((values, ", ", str(value)))
-                    else:
-                        values = ''.join((values, ", '", str(value), "'"))
+        self.__bulk_insert_mt.add(fields + list(fields_list), values + list(fields_values))
 
-        self.__pg_conn.table_insert(self.__schema, self.__tablename_mt, fields, values)
+    def events_sql_flush(self):
+        if self.__bulk_insert is not None:
+            self.__bulk_insert.flush()
+            self.__bulk_insert_mt.flush()
 
     def event_insert(self, qgis_point_fi, qgis_point_se, sortnr_fi, sortnr_se, event_uuid, route_id,
                      route_class, toursortnr, srid):
-        result_fi = route_class.point_meas_get(route_id, qgis_point_fi, srid, sortnr_fi)
-        result_se = route_class.point_meas_get(route_id, qgis_point_se, srid, sortnr_se)
+        result_fi, result_se = route_class.points_meas_list_get(route_id, [qgis_point_fi, qgis_point_se], srid,
+                                                                [sortnr_fi, sortnr_se])
         feature_fi, uuid_id_fi = self.__event_feature_get(result_fi[0], result_fi[2])
         feature_se, uuid_id_se = self.__event_feature_get(result_se[0], result_se[2])
         if result_fi[1] < result_se[1]:
@@ -534,76 +637,80 @@ class LRSTourEventClass(LRSLayerClass):
         return [feature, uuid]
 
     def __events_tour_get(self, event_id, route_id=None):
-        # no sql, get actual saved attribute values of the layer
+        # no sql, get actual attribute values of the layer from the index
         # return all values from _mt for a tour (depending of route_id)
-        request = QgsFeatureRequest().setFlags(QgsFeatureRequest.NoGeometry)
-        request.setSubsetOfAttributes(['uuid', 'route_id', 'sortnr', 'frommeas', 'frompoint_id',
-                                       'tomeas', 'topoint_id', 'routedir'], self.__layer_mt.fields())
-        if route_id is None:
-            expression = "event_id = \'" + event_id + "'"
-        else:
-            expression = "event_id = \'" + event_id + "' AND route_id = \'" + route_id + "'"
-        request.setFilterExpression(expression)
         events_list = []
-        for feature in self.__layer_mt.getFeatures(request):
-            events_list.append([feature.id(), feature['uuid'], feature['route_id'], feature['sortnr'],
-                                feature['frommeas'], feature['frompoint_id'], feature['tomeas'], feature['topoint_id'],
-                                feature['routedir']])
+        for part in TourPartIndex.get(self.__layer_mt).parts_event_get(event_id):
+            if route_id is None or part[3] == route_id:
+                events_list.append([part[0], part[1]] + part[3:])
         return events_list
 
     def __events_part_get(self, event_uuid):
-        # no sql, get actual saved attribute values of the layer
+        # no sql, get actual attribute values of the layer from the index
         # return single value from _mt (tour part)
-        request = QgsFeatureRequest().setFlags(QgsFeatureRequest.NoGeometry)
-        request.setSubsetOfAttributes(['event_id', 'route_id', 'sortnr', 'frommeas', 'frompoint_id',
-                                       'tomeas', 'topoint_id', 'routedir'], self.__layer_mt.fields())
-        expression = "frompoint_id = \'" + event_uuid + "' OR topoint_id = \'" + event_uuid + "'"
-        request.setFilterExpression(expression)
         event_list = []
-        for feature in self.__layer_mt.getFeatures(request):
-            event_list.append([feature.id(), feature['event_id'], feature['route_id'], feature['sortnr'],
-                               feature['frommeas'], feature['frompoint_id'], feature['tomeas'], feature['topoint_id'],
-                               feature['routedir']])
+        for part in TourPartIndex.get(self.__layer_mt).parts_point_get(event_uuid):
+            event_list.append([part[0]] + part[2:])
         return event_list
 
-    def events_approvable_get(self, route_class_name, tolerance, checkonly=False):
-        fields = """{id}, {uuid}""".format(id="id", uuid="uuid")
-        where = "apprtstz = '1000-01-01 01:01:01'"
-        events = self.__pg_conn.table_select(self.__schema, self.__event_class_name, fields, where)
+    def index_clear(self):
+        # rebuilt with the next lookup, e.g. after changes with sql
+        if self.__layer_mt is not None and self.__layer_mt.id() in TourPartIndex.INDEXES:
+            TourPartIndex.INDEXES[self.__layer_mt.id()].clear()
+
+    def __events_approvable_query_get(self, route_class_name):
+        # event points with tour part, tour name and route name in one query, parts of a route are grouped
+        # event point shared by two tour parts: meas of the part it starts
+        fields = """ev.{id}, mt.{route_id}, CASE WHEN ev.uuid = mt.frompoint_id THEN mt.frommeas ELSE mt.tomeas END 
+                 AS meas, et.{name}, rc.{name}""".format(id="id", route_id="route_id", name="name")
+        where = "ev.apprtstz = '1000-01-01 01:01:01' AND mt.id IS NOT NULL"
+        mt_join = "ev.uuid = mt.frompoint_id OR (ev.uuid = mt.topoint_id AND NOT EXISTS (SELECT 1 FROM " \
+                  "{schema}.{table_mt} m WHERE m.frompoint_id = ev.uuid))" \
+                  .format(schema=self.__schema, table_mt=self.__tablename_mt)
+        joinlist = [[self.__tablename_mt + " mt", mt_join],
+                    [self.__table_et_name + " et", "mt.event_id = et.uuid"],
+                    [route_class_name + " rc", "mt.route_id = rc.route_id"]]
+        group = "ev.id, mt.id, et.name, rc.name"
+        # order by route_name, tour_name and meas
+        order = "rc.name ASC, et.name ASC, meas ASC"
+        return [self.__schema, self.__event_class_name + " ev", joinlist, fields, where, group, order]
+
+    def events_approvable_fetch(self, route_class_name, size=500):
+        # like events_approvable_get, but yields blocks of [route name, route_id, event] ordered by route name
+        # from a server-side cursor, without measure checks
+        # unique name, the uuid first -> not lost when postgres truncates the name to 63 characters
+        cursorname = "lrs_approvable_" + misc_utils.uuid_get().hex + "_" + self.__event_class_name
+        blocks = self.__pg_conn.table_select_join_fetch(cursorname, *self.__events_approvable_query_get(
+            route_class_name), size=size)
+        try:
+            for events in blocks:
+                yield [[event[4], str(event[1]), str(event[0]) + ": " + (event[3]) + " / " + str(event[2])]
+                       for event in events]
+        finally:
+            blocks.close()
+
+    def route_meas_errors_get(self, route_id, tolerance, route_class_name):
+        # tour parts with wrong measures along the route
+        return meas_check.route_meas_errors_get(self.__pg_conn, self.__schema, self.__event_class_name, "t", route_id,
+                                                tolerance, route_class_name)
 
+    def events_approvable_get(self, route_class_name, tolerance, checkonly=False):
         if checkonly:
+            fields = """{id}""".format(id="id")
+            where = "apprtstz = '1000-01-01 01:01:01'"
+            events = self.__pg_conn.table_select(self.__schema, self.__event_class_name, fields, where)
             if len(events) > 0:
                 return True
             else:
                 return False
 
+        events = self.__pg_conn.table_select_join(*self.__events_approvable_query_get(route_class_name))
         event_list = []
         route_id_set = set()
         for event in events:
-            fields = """{event_id}, {route_id}, {frommeas}, {tomeas}"""\
-                     .format(event_id="event_id", route_id="route_id", frommeas="frommeas", tomeas="tomeas")
-            event_uuid = event[1]
-            where = "frompoint_id = '" + event_uuid + "'"
-            values_mt = self.__pg_conn.table_select(self.__schema, self.__tablename_mt, fields, where)
-            pointtype = "from"
-            if len(values_mt) == 0:
-                where = "topoint_id = '" + event_uuid + "'"
-                values_mt = self.__pg_conn.table_select(self.__schema, self.__tablename_mt, fields, where)
-                pointtype = "to"
-            if pointtype == "from":
-                meas = values_mt[0][2]
-            else:
-                meas = values_mt[0][3]
-            route_id = str(values_mt[0][1])
-            where = "route_id = '" + route_id + "'"
-            route_name = self.__pg_conn.table_select(self.__schema, route_class_name, "name", where)[0][0]
-            route_id_set.add(route_name + "%%" + route_id)
-            event_id = self.__tour_event_names.event_id_get(None, values_mt[0][0])
-            event_name = self.__tour_event_names.event_name_get(event_id)
-            event_list.append([route_name, event_name, event[0], meas])
-
-        # sort list by route_name, tour_name and meas
-        event_list.sort(key=operator.itemgetter(0, 1, 3))
+            route_name = event[4]
+            route_id_set.add(route_name + "%%" + str(event[1]))
+            event_list.append([route_name, event[3], event[0], event[2]])
 
         route_name_old = ""
         routedict = {}
@@ -624,99 +731,17 @@ class LRSTourEventClass(LRSLayerClass):
         routeerrdict = {}
         if len(route_id_set) > 0:
             for route_id in route_id_set:
-                result = self.events_meas_check(route_id.split("%%")[1], tolerance)
-                if result is not None:
-                    tmplist = []
-                    for errlist in result:
-                        val = str(errlist[1]) + ": " + str(errlist[0]) + " / " + str(errlist[2])
-                        tmplist.append(val)
+                tmplist = self.route_meas_errors_get(route_id.split("%%")[1], tolerance, route_class_name)
+                if len(tmplist) > 0:
                     routeerrdict[route_id.split("%%")[0]] = tmplist
 
         return routedict, routeerrdict
 
     def events_meas_check(self, route_id, tolerance):
-        fields = """{id}, {event_id}, {frommeas}, {tomeas}, {frompoint_id}, {topoint_id}""" \
-                    .format(id="id", event_id="event_id", frommeas="frommeas", tomeas="tomeas",
-                            frompoint_id="frompoint_id", topoint_id="topoint_id")
-        where = "route_id = '" + route_id + "'"
-        order = "event_id ASC, frommeas ASC"
-        events_list = self.__pg_conn.table_select(self.__schema, self.__tablename_mt, fields, where, order)
-
-        result = []
-        if len(events_list) == 0:
-            return None
-        event_uuid_old = None
-        frommeas_old = 0
-        tomeas_old = 0
-        for events in events_list:
-            frommeas = events[2]
-            tomeas = events[3]
-            event_uuid = events[1]
-            # check measures of tour part
-            measerror = False
-            if (abs(tomeas - frommeas) < tolerance) or (frommeas > tomeas):
-                measerror = True
-            # check if on the route are parts of the same tour
-            elif event_uuid == event_uuid_old:
-                if self.overlaps_check(frommeas, frommeas_old, tomeas, tomeas_old, tolerance):
-                    measerror = True
-
-            if measerror:
-                where = "uuid = '" + event_uuid + "'"
-                try:
-                    tour_name = self.__pg_conn.table_select(self.__schema, self.__table_et_name, "name", where)[0][0]
-                except IndexError:
-                    tour_name = "NONE"
-                    pass
-
-                where = "uuid = '" + events[4] + "'"
-                feat_from = self.__pg_conn.table_select(self.__schema, self.__event_class_name, "id, geom",
-                                                        where)[0]
-                feat_id_from = feat_from[0]
-                feat_geom_from = feat_from[1]
-                where = "uuid = '" + events[5] + "'"
-                feat_to = self.__pg_conn.table_select(self.__schema, self.__event_class_name, "id, geom",
-                                                      where)[0]
-                feat_id_to = feat_to[0]
-                feat_geom_to = feat_to[1]
-                result.append([tour_name, feat_id_from, frommeas, events[4], feat_geom_from])
-                result.append([tour_name, feat_id_to, tomeas, events[5], feat_geom_to])
-
-            frommeas_old = frommeas
-            tomeas_old = tomeas
-            event_uuid_old = event_uuid
-
-        if len(result) > 0:
-            return result
-        else:
-            return None
-
+        return meas_check.tour_events_meas_check(self.__pg_conn, self.__schema, self.__event_class_name, route_id,
+                                                 tolerance)
     def overlaps_check(self, frommeas, frommeas_old, tomeas, tomeas_old, tolerance):
-
-        # overlapping a part of existing
-        if (tomeas - frommeas_old) >= tolerance and tomeas < tomeas_old:
-            return True
-            # overlapping a part of existing
-        if (tomeas_old - frommeas) >= tolerance and frommeas > frommeas_old:
-            return True
-            # new part over existing
-        if (frommeas_old - frommeas) >= tolerance and tomeas - tomeas_old >= tolerance:
-            return True
-            # new part inside existing
-        if (frommeas - frommeas_old) >= tolerance and tomeas_old - tomeas >= tolerance:
-            return True
-            # exact overlap of existing
-        if abs(frommeas - frommeas_old) <= tolerance and abs(tomeas - tomeas_old) <= tolerance:
-            return True
-            # one overlapping point
-        if abs(frommeas - frommeas_old) <= tolerance <= (tomeas - tomeas_old):
-            return True
-            # one overlapping point
-        if (frommeas_old - frommeas) >= tolerance >= abs(tomeas - tomeas_old):
-            return True
-
-        return False
-
+        return meas_check.overlaps_check(frommeas, frommeas_old, tomeas, tomeas_old, tolerance)
     def event_point_check(self):
         # return missing event points (from/to)
         fields = "mt.uuid, mt.frompoint_id, mt.topoint_id, val.uuid"
@@ -21,8 +21,10 @@ import os
 
 from qgis.PyQt.uic import loadUiType
 from qgis.PyQt.QtWidgets import QDockWidget
+from qgis.core import QgsApplication, QgsTask
 
 from ..utils import qgis_utils
+from ..utils import meas_check
 from ..utils.pg_conn import PGConn
 from ..cls.lrsproject import LRSProject
 from ..cls.lrseventclasses import LRSEventClasses
@@ -34,7 +36,51 @@ FORM_CLASS, _ = loadUiType(os.path.join(
     os.path.dirname(__file__), os.pardir, 'ui', 'eventapprovaldockwidget.ui'))
 
 
+class EventMeasCheckTask(QgsTask):
+    # measure checks of routes in the background, with an own database connection
+    def __init__(self, pg_conn, schema, event_class_name, event_class_type, routedict, route_class_name, tolerance,
+                 callback):
+        super(EventMeasCheckTask, self).__init__("LRS-Editor: Check Measures of " + event_class_name,
+                                                 QgsTask.CanCancel)
+        self.pg_conn = pg_conn
+        self.schema = schema
+        self.event_class_name = event_class_name
+        self.event_class_type = event_class_type
+        # route name -> route_id
+        self.routedict = routedict
+        self.route_class_name = route_class_name
+        self.tolerance = tolerance
+        self.callback = callback
+        self.routeerrdict = {}
+
+    def run(self):
+        try:
+            for count, (route_name, route_id) in enumerate(self.routedict.items()):
+                if self.isCanceled():
+                    return False
+                errlist = meas_check.route_meas_errors_get(self.pg_conn, self.schema, self.event_class_name,
+                                                           self.event_class_type, route_id, self.tolerance,
+                                                           self.route_class_name)
+                if len(errlist) > 0:
+                    self.routeerrdict[route_name] = errlist
+                self.setProgress(100.0 * (count + 1) / len(self.routedict))
+        except Exception:
+            self.pg_conn.rollback()
+            return False
+        return True
+
+    def finished(self, result):
+        # back in the main thread
+        self.pg_conn.db_close()
+        self.callback(self, result)
+
+
 class EventApprovalDockWidget(QDockWidget, FORM_CLASS):
+    # events are loaded in blocks from a server-side cursor, the next block is loaded when the user
+    # selects the last entry of the route combo box
+    PAGE_SIZE = 500
+    ROUTES_MORE = "<more Routes...>"
+
     def __init__(self, parent, iface):
         # call superclass constructor
         super(EventApprovalDockWidget, self).__init__(parent)
@@ -42,6 +88,8 @@ class EventApprovalDockWidget(QDockWidget, FORM_CLASS):
         self.canvas = iface.mapCanvas()
         self.setupUi(self)
         self.pg_conn = None
+        # read connection of the event blocks, never commits (the server-side cursors live in its transaction)
+        self.pg_conn_fetch = None
         self.schema = None
         self.lrs_project = None
         self.lrs_event_classes = None
@@ -51,6 +99,16 @@ class EventApprovalDockWidget(QDockWidget, FORM_CLASS):
 
         self.eventclassdict = None
         self.eventclasserrdict = None
+        # event class name -> generator of the event blocks, None when all events are loaded
+        self.eventclassfetch = {}
+        self.conn_params = None
+        # measure checks: one running task per event class, each with an own connection
+        # event class name -> task
+        self.tasks = {}
+        # cancelled tasks, release their connection when finished
+        self.tasks_cancelled = []
+        # event class name -> routes (route name -> route_id) waiting for the running task
+        self.routes_pending = {}
 
         # config buttons
         self.pb_ok.setEnabled(True)
@@ -83,11 +141,17 @@ class EventApprovalDockWidget(QDockWidget, FORM_CLASS):
         if credentials is None:
             self.iface.messageBar().pushWarning("No Connection", "Missing credentials.")
             return
-        self.pg_conn = PGConn(entries[1], entries[2], entries[4], credentials[0], credentials[1])
+        self.conn_close()
+        self.conn_params = [entries[1], entries[2], entries[4], credentials[0], credentials[1]]
+        self.pg_conn = PGConn(*self.conn_params)
         return_message = self.pg_conn.db_connect()
         if return_message:
             self.iface.messageBar().pushWarning("No Connection", "No connection established.")
             return
+        self.pg_conn_fetch = PGConn(*self.conn_params)
+        if self.pg_conn_fetch.db_connect():
+            self.iface.messageBar().pushWarning("No Connection", "No connection established.")
+            return
 
         self.lrs_project = LRSProject(self.pg_conn, self.schema)
         if not self.lrs_project:
@@ -101,24 +165,15 @@ class EventApprovalDockWidget(QDockWidget, FORM_CLASS):
         self.eventclasserrdict = {}
         for clid in self.lrs_event_classes.event_class_idlist:
             event_class_name = self.lrs_event_classes.event_class_names[clid]
-            lrs_l = None
-            if self.lrs_event_classes.event_class_types[clid] == "p":
-                layer = qgis_utils.layer_by_tablename_get(self.schema, event_class_name + "_bp")
-                lrs_l = LRSBasePointEventClass(self.pg_conn, self.schema, layer)
-            elif self.lrs_event_classes.event_class_types[clid] == "c":
-                layer = qgis_utils.layer_by_tablename_get(self.schema, event_class_name)
-                lrs_l = LRSContEventClass(self.pg_conn, self.schema, layer)
-            elif self.lrs_event_classes.event_class_types[clid] == "t":
-                layer = qgis_utils.layer_by_tablename_get(self.schema, event_class_name)
-                lrs_l = LRSTourEventClass(self.pg_conn, self.schema, layer)
-            tolerance = self.lrs_project.tolerance
-            routedict, routeerrdict = lrs_l.events_approvable_get(route_class_name, tolerance, False)
+            lrs_l = self.lrs_layer_get(self.pg_conn_fetch, event_class_name)
+            # first block of events, measures are checked in the background
+            self.eventclassdict[event_class_name] = {}
+            self.eventclassfetch[event_class_name] = lrs_l.events_approvable_fetch(route_class_name, self.PAGE_SIZE)
+            self.routes_fetch(event_class_name)
 
             # add only, if not empty
-            if bool(routedict):
-                self.eventclassdict[event_class_name] = routedict
-            if bool(routeerrdict):
-                self.eventclasserrdict[event_class_name] = routeerrdict
+            if not bool(self.eventclassdict[event_class_name]):
+                self.eventclassdict.pop(event_class_name)
 
         event_class_names = []
         for key, val in self.eventclassdict.items():
@@ -135,16 +190,29 @@ class EventApprovalDockWidget(QDockWidget, FORM_CLASS):
         if len(self.cbx_event_class_name.currentText()) == 0:
             return
 
-        routedict = self.eventclassdict[self.cbx_event_class_name.currentText()]
+        event_class_name = self.cbx_event_class_name.currentText()
         self.cbx_route_name.clear()
-        for key, val in sorted(routedict.items()):
+        for key in sorted(self.routes_complete_get(event_class_name)):
             self.cbx_route_name.addItem(key)
+        if self.eventclassfetch.get(event_class_name) is not None:
+            self.cbx_route_name.addItem(self.ROUTES_MORE)
 
     def route_name_changed(self):
         # ignore signal, when combo box with route name is cleared
         if len(self.cbx_route_name.currentText()) == 0:
             return
 
+        if self.cbx_route_name.currentText() == self.ROUTES_MORE:
+            # load next block, select the first new route
+            routes_old = set(self.routes_complete_get(self.cbx_event_class_name.currentText()))
+            self.routes_fetch(self.cbx_event_class_name.currentText())
+            self.event_name_changed()
+            for ind in range(self.cbx_route_name.count()):
+                if self.cbx_route_name.itemText(ind) not in routes_old:
+                    self.cbx_route_name.setCurrentIndex(ind)
+                    break
+            return
+
         routedict = self.eventclassdict[self.cbx_event_class_name.currentText()]
         events = routedict[self.cbx_route_name.currentText()]
         self.cbx_event.clear()
@@ -153,6 +221,9 @@ class EventApprovalDockWidget(QDockWidget, FORM_CLASS):
         for val in events:
             self.cbx_event.addItem(val)
 
+        self.route_errors_show()
+
+    def route_errors_show(self):
         # check for routes with error
         self.textEdit.clear()
         self.textEdit.hide()
@@ -178,7 +249,6 @@ class EventApprovalDockWidget(QDockWidget, FORM_CLASS):
     def event_select(self):
         event_class_name = self.cbx_event_class_name.currentText()
         feat_id = int(self.cbx_event.currentText().split(":")[0])
-        event_class_type = self.lrs_event_classes.event_class_type_get(event_class_name)
 
         if self.lrs_layer_old is not None:
             try:
@@ -186,16 +256,7 @@ class EventApprovalDockWidget(QDockWidget, FORM_CLASS):
             except RuntimeError:
                 pass
 
-        self.lrs_layer = None
-        if event_class_type == "p":
-            layer = qgis_utils.layer_by_tablename_get(self.schema, event_class_name + "_bp")
-            self.lrs_layer = LRSBasePointEventClass(self.pg_conn, self.schema, layer)
-        elif event_class_type == "c":
-            layer = qgis_utils.layer_by_tablename_get(self.schema, event_class_name)
-            self.lrs_layer = LRSContEventClass(self.pg_conn, self.schema, layer)
-        elif event_class_type == "t":
-            layer = qgis_utils.layer_by_tablename_get(self.schema, event_class_name)
-            self.lrs_layer = LRSTourEventClass(self.pg_conn, self.schema, layer)
+        self.lrs_layer = self.lrs_layer_get(self.pg_conn, event_class_name)
 
         self.lrs_layer.select_by_id(feat_id)
         self.canvas.zoomToSelected(self.lrs_layer.qgslayer)
@@ -228,7 +289,105 @@ class EventApprovalDockWidget(QDockWidget, FORM_CLASS):
         else:
             self.cbx_event.setCurrentIndex(index + 1)
 
+    def lrs_layer_get(self, pg_conn, event_class_name):
+        event_class_type = self.lrs_event_classes.event_class_type_get(event_class_name)
+        lrs_l = None
+        if event_class_type == "p":
+            layer = qgis_utils.layer_by_tablename_get(self.schema, event_class_name + "_bp")
+            lrs_l = LRSBasePointEventClass(pg_conn, self.schema, layer)
+        elif event_class_type == "c":
+            layer = qgis_utils.layer_by_tablename_get(self.schema, event_class_name)
+            lrs_l = LRSContEventClass(pg_conn, self.schema, layer)
+        elif event_class_type == "t":
+            layer = qgis_utils.layer_by_tablename_get(self.schema, event_class_name)
+            lrs_l = LRSTourEventClass(pg_conn, self.schema, layer)
+        return lrs_l
+
+    def routes_complete_get(self, event_class_name):
+        # the last route can have more events in the next block
+        routes = list(self.eventclassdict[event_class_name].keys())
+        if self.eventclassfetch.get(event_class_name) is not None:
+            routes = routes[:-1]
+        return routes
+
+    def routes_fetch(self, event_class_name):
+        # load blocks of events until at least one more route is complete
+        routedict = self.eventclassdict[event_class_name]
+        count_old = len(self.routes_complete_get(event_class_name))
+        routes_new = {}
+        while self.eventclassfetch[event_class_name] is not None:
+            events = next(self.eventclassfetch[event_class_name], None)
+            if events is None:
+                # all events loaded, cursor is closed
+                self.eventclassfetch[event_class_name] = None
+                break
+            for route_name, route_id, val in events:
+                if route_name not in routedict:
+                    routes_new[route_name] = route_id
+                routedict.setdefault(route_name, []).append(val)
+            if len(self.routes_complete_get(event_class_name)) > count_old:
+                break
+        self.meas_check_start(event_class_name, routes_new)
+
+    def meas_check_start(self, event_class_name, routes_new):
+        if len(routes_new) == 0:
+            return
+        self.routes_pending.setdefault(event_class_name, {}).update(routes_new)
+        self.meas_check_next(event_class_name)
+
+    def meas_check_next(self, event_class_name):
+        # start a task with the pending routes, if no task of this event class is running
+        if event_class_name in self.tasks:
+            return
+        for task in self.tasks_cancelled:
+            if task.event_class_name == event_class_name:
+                return
+        routes = self.routes_pending.pop(event_class_name, {})
+        if len(routes) == 0:
+            return
+        pg_conn = PGConn(*self.conn_params)
+        if pg_conn.db_connect():
+            return
+        event_class_type = self.lrs_event_classes.event_class_type_get(event_class_name)
+        task = EventMeasCheckTask(pg_conn, self.schema, event_class_name, event_class_type, routes,
+                                  self.lrs_project.route_class_name, self.lrs_project.tolerance,
+                                  self.meas_check_finished)
+        self.tasks[event_class_name] = task
+        QgsApplication.taskManager().addTask(task)
+
+    def meas_check_finished(self, task, result):
+        if task in self.tasks_cancelled:
+            # check of a former update of the form
+            self.tasks_cancelled.remove(task)
+        elif self.tasks.get(task.event_class_name) is task:
+            self.tasks.pop(task.event_class_name)
+            if result and bool(task.routeerrdict):
+                self.eventclasserrdict.setdefault(task.event_class_name, {}).update(task.routeerrdict)
+                if task.event_class_name == self.cbx_event_class_name.currentText() and \
+                        self.cbx_route_name.currentText() in task.routeerrdict:
+                    self.route_errors_show()
+        else:
+            return
+        # routes loaded in the meantime
+        self.meas_check_next(task.event_class_name)
+
+    def fetch_stop(self):
+        for event_class_name, blocks in self.eventclassfetch.items():
+            if blocks is not None:
+                blocks.close()
+        self.eventclassfetch = {}
+        for task in self.tasks.values():
+            task.cancel()
+            self.tasks_cancelled.append(task)
+        self.tasks = {}
+        self.routes_pending = {}
+
     def conn_close(self):
+        # cursors must be closed before the connection
+        self.fetch_stop()
+        if self.pg_conn_fetch:
+            self.pg_conn_fetch.db_close()
+            self.pg_conn_fetch = None
         if self.pg_conn:
             self.pg_conn.db_close()
             self.pg_conn = None
@@ -203,7 +203,7 @@ class EventClassManager(QDialog, FORM_CLASS):
             # view must be in first position in layers_list
             if event_class_type != "p":
                 if layers_list[0] is None:
-                    self.pg_conn.view_drop(self.schema, "v_" + event_class_name)
+                    self.pg_conn.event_view_drop(self.schema, event_class_name)
                     msg = QMessageBox(QMessageBox.Information, "Drop View", "View 'v_" + event_class_name +
                                       "' deleted.", QMessageBox.Ok)
                     msg.exec_()
@@ -237,12 +237,15 @@ class EventClassManager(QDialog, FORM_CLASS):
                 event_class_type = row_values[1][0].lower()
                 event_class_name = row_values[2]
                 if event_class_type != "p":
+                    materialized = self.lrs_event_classes.event_class_materialized_get(event_class_name)
                     if event_class_type == "c":
                         self.pg_conn.cont_event_view_create(self.schema, event_class_name,
-                                                            self.lrs_project.route_class_name, self.lrs_project.srid)
+                                                            self.lrs_project.route_class_name, self.lrs_project.srid,
+                                                            materialized)
                     else:
                         self.pg_conn.tour_event_view_create(self.schema, event_class_name,
-                                                            self.lrs_project.route_class_name, self.lrs_project.srid)
+                                                            self.lrs_project.route_class_name, self.lrs_project.srid,
+                                                            materialized)
                     msg = QMessageBox(QMessageBox.Information, "Create View", "View 'v_" + event_class_name +
                                       "' created.", QMessageBox.Ok)
                     msg.exec_()
@@ -27,6 +27,7 @@ from qgis.PyQt.uic import loadUiType
 from qgis.core import QgsPointXY, QgsPoint
 
 from ..utils import qgis_utils
+from ..utils import wkb
 from ..utils.pg_conn import PGConn
 from ..gui.database import DBSettings
 from ..cls.lrsproject import LRSProject
@@ -245,12 +246,17 @@ class ImportEvents(QDialog, FORM_CLASS):
                                                                                             "Import failed.")
             return
 
-        if self.event_class_type == "c":
-            self.cont_event_import(layer)
-        elif self.event_class_type == "p":
-            self.point_event_import(layer)
-        elif self.event_class_type == "t":
-            self.tour_event_import(layer)
+        try:
+            # import in one transaction, rolled back completely on error
+            with self.pg_conn.transaction():
+                if self.event_class_type == "c":
+                    self.cont_event_import(layer)
+                elif self.event_class_type == "p":
+                    self.point_event_import(layer)
+                elif self.event_class_type == "t":
+                    self.tour_event_import(layer)
+        except Exception as error:
+            self.textEdit.append("Import failed: " + str(error) + ". Changes rolled back.")
 
         QApplication.restoreOverrideCursor()
         self.canvas.redrawAllLayers()
@@ -407,6 +413,7 @@ class ImportEvents(QDialog, FORM_CLASS):
                 lrs_layer.event_sql_insert(qgis_point_fi, qgis_point_se, event_uuid, route_id, self.route_class,
                                            toursortnr, self.srid, self.fields, valuelist)
                 event_uuid_old = event_uuid
+        lrs_layer.events_sql_flush()
 
     def point_event_import(self, layer):
         lrs_layer = LRSPointEventClass(self.pg_conn, self.schema, layer)
@@ -441,7 +448,7 @@ class ImportEvents(QDialog, FORM_CLASS):
 
         QApplication.setOverrideCursor(Qt.WaitCursor)
         fields = ''.join((self.event_names_field, ", ", self.route_id_field, ", ",
-                          "ST_AsText(" + self.geom_field + ")"))
+                          "ST_AsBinary(" + self.geom_field + ")"))
         # add fields for the additional values to import
         for field in self.fields:
             fields = fields + ", " + field
@@ -465,8 +472,12 @@ class ImportEvents(QDialog, FORM_CLASS):
                 QApplication.processEvents()
                 continue
             event_name = event_point[0]
-            qgis_point = QgsPoint()
-            qgis_point.fromWkt(event_point[2])
+            try:
+                qgis_point = QgsPoint(*wkb.point_get(event_point[2]))
+            except ValueError as e:
+                self.textEdit.append("...Event Name '" + event_name + "' skipped, " + str(e) + "...")
+                QApplication.processEvents()
+                continue
             if event_name == event_name_old:
                 if route_name == route_name_old:
                     # event point with same event_name and route_name as last one
@@ -493,8 +504,7 @@ class ImportEvents(QDialog, FORM_CLASS):
                         valuelist.append(value)
                     else:
                         valuelist.append(None)
-                event_id = lrs_layer.event_sql_insert(event_name, qgis_point, self.srid, self.fields, valuelist)
-                event_uuid = lrs_layer.event_uuid_get(event_id)
+                event_uuid = lrs_layer.event_sql_insert(event_name, qgis_point, self.srid, self.fields, valuelist)
                 result = self.route_class.point_meas_get(route_id, qgis_point, self.srid)
                 lrs_layer_bp.basepoint_sql_insert(result[0], route_id, event_uuid, result[1], result[2], self.srid)
 
@@ -502,6 +512,8 @@ class ImportEvents(QDialog, FORM_CLASS):
             qgis_point_old = qgis_point
             route_name_old = route_name
             event_name_old = event_name
+        lrs_layer.events_sql_flush()
+        lrs_layer_bp.basepoints_sql_flush()
 
     def cont_event_import(self, layer):
         # check for NULL-values
@@ -577,10 +589,12 @@ class ImportEvents(QDialog, FORM_CLASS):
                         valuelist.append(value)
                     else:
                         valuelist.append(None)
-                result_start = self.route_class.point_meas_get(route_id, QgsPointXY(nodes[0], nodes[1]), self.srid)
+                result_start, result_end = self.route_class.points_meas_list_get(route_id,
+                                                                                 [QgsPointXY(nodes[0], nodes[1]),
+                                                                                  QgsPointXY(nodes[2], nodes[3])],
+                                                                                 self.srid)
                 result_start.append(event_uuid)
                 result_start.extend(valuelist)
-                result_end = self.route_class.point_meas_get(route_id, QgsPointXY(nodes[2], nodes[3]), self.srid)
                 result_end.append(event_uuid)
                 result_end.extend(valuelist)
                 if result_start[1] < result_end[1]:
@@ -670,6 +684,7 @@ class ImportEvents(QDialog, FORM_CLASS):
                 lrs_layer.event_sql_insert(result[0], event_uuid, result[2], route_id, tomeas_old, result[1],
                                            self.srid, [], [])
 
+        lrs_layer.events_sql_flush()
         self.cont_event_no_routes_create()
 
     def cont_event_no_routes_create(self):
@@ -710,6 +725,7 @@ class ImportEvents(QDialog, FORM_CLASS):
             result = route_class.point_routeend_get(route_id)
             lrs_layer.event_sql_insert(result[0], event_uuid, result[2], route_id, 0.0, result[1],
                                        self.srid, [], [])
+        lrs_layer.events_sql_flush()
 
     def conn_close(self):
         # do not close self.pg_conn, was imported from eventclassmanager
@@ -21,6 +21,8 @@ import os
 from qgis.PyQt.uic import loadUiType
 from qgis.PyQt.QtWidgets import QDialog, QMessageBox
 
+from ..cls.lrseventclasses import OPTION_MATERIALIZED
+
 FORM_CLASS, _ = loadUiType(os.path.join(
     os.path.dirname(__file__), os.pardir, 'ui', 'newevent.ui'))
 
@@ -60,9 +62,11 @@ class NewEvent(QDialog, FORM_CLASS):
             msg.exec_()
             return
 
-        # option is not in use, set it 0
+        # option bits, see lrseventclasses
         option = 0
         self.event_class_type = self.cbx_event_class_type.currentData()
+        if self.chk_materialized.isChecked() and self.event_class_type != "p":
+            option = option | OPTION_MATERIALIZED
         self.return_values = (self.le_event_class_name.text().lower(), self.event_class_type, option)
         self.accept()
 
@@ -37,6 +37,7 @@ from .tools.lrseventapprove import LRSEventApprove
 from .gui.eventnamesdockwidget import EventNamesDockWidget
 from .gui.eventapprovaldockwidget import EventApprovalDockWidget
 from .gui.pointclasscreate import PointClassCreate
+from .utils.pg_conn import conn_pool
 from .gui.project import ProjectSettings
 from .gui.basesystem import BaseSystemSettings
 from .gui.eventclassmanager import EventClassManager
@@ -214,6 +215,9 @@ class LRSEditorPlugin:
         self.iface.removeDockWidget(self.__eventnamesdockwidget)
         self.iface.removeDockWidget(self.__eventapprdockwidget)
 
+        # close pooled database connections
+        conn_pool.close_all()
+
     def tool_changed(self, new_tool):
         # when tool changes, check if it is a LRSTool
         if not isinstance(new_tool, LRSMoveTool):
@@ -134,10 +134,11 @@ class LRSDigiTool(LRSMapTool):
 
                 qgis_point_fi = self.tourmarker.point_get()
 
-                meas_fi = self.route_class.point_meas_get(route_id_fi, qgis_point_fi, self.lrs_project.srid,
-                                                          sortnr_fi)[1]
-                meas_se = self.route_class.point_meas_get(route_id_se, self.point, self.lrs_project.srid,
-                                                          sortnr_se)[1]
+                # both endpoints in one pass
+                result_fi, result_se = self.route_class.points_meas_list_get(route_id_fi, [qgis_point_fi, self.point],
+                                                                             self.lrs_project.srid,
+                                                                             [sortnr_fi, sortnr_se])
+                meas_fi, meas_se = result_fi[1], result_se[1]
 
                 if abs(meas_fi - meas_se) <= self.lrs_project.tolerance:
                     # event at an existing event position
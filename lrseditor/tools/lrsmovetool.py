@@ -97,10 +97,11 @@ class LRSMoveTool(LRSMapTool):
                         return
 
                     qgis_point_fi = self.tourmarker.point_get()
-                    result_fi = self.route_class.point_meas_get(route_id_fi, qgis_point_fi, self.lrs_project.srid,
-                                                                sortnr_fi)
-                    result_se = self.route_class.point_meas_get(route_id_se, self.point, self.lrs_project.srid,
-                                                                sortnr_se)
+                    # both endpoints in one pass
+                    result_fi, result_se = self.route_class.points_meas_list_get(route_id_fi,
+                                                                                 [qgis_point_fi, self.point],
+                                                                                 self.lrs_project.srid,
+                                                                                 [sortnr_fi, sortnr_se])
                     meas_fi, meas_se = result_fi[1], result_se[1]
                     direction = True
                     if meas_fi < meas_se:
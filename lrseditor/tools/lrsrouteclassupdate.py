@@ -76,68 +76,30 @@ class LRSRouteClassUpdate(LRSTool):
         result = lrs_basesystem.data_check(logfile)
         if result:
             # continue
-            # check topology of linestring with points
-            lrs_basesystem.topology_check(logfile)
-
-            # synchronize routes in route class and get changed routes to update events
-            routelist_upd, route_del_list_tmp = self.lrs_project.routes_synchronize(lrs_basesystem.id, logfile)
-            self.lrs_project.routeupdatetstz_set()
-
-            # update event classes
-            for clid in self.lrs_event_classes.event_class_idlist:
-                event_class_name = self.lrs_event_classes.event_class_names[clid]
-                if self.lrs_event_classes.event_class_types[clid] == "p":
-                    layer = qgis_utils.layer_by_tablename_get(self.schema, event_class_name + "_bp")
-                    lrs_layer = LRSBasePointEventClass(self.pg_conn, self.schema, layer)
-                    lrs_layer.basepoints_update(routelist_upd, self.route_class, self.lrs_project.srid,
-                                                self.lrs_project.tolerance)
-                elif self.lrs_event_classes.event_class_types[clid] == "c":
-                    layer = qgis_utils.layer_by_tablename_get(self.schema, event_class_name)
-                    lrs_layer = LRSContEventClass(self.pg_conn, self.schema, layer)
-                    lrs_layer.events_update(routelist_upd, self.route_class, self.lrs_project.srid,
-                                            self.lrs_project.tolerance)
-                elif self.lrs_event_classes.event_class_types[clid] == "t":
-                    layer = qgis_utils.layer_by_tablename_get(self.schema, event_class_name)
-                    lrs_layer = LRSTourEventClass(self.pg_conn, self.schema, layer)
-                    lrs_layer.events_update(routelist_upd, self.route_class, self.lrs_project.srid,
-                                            self.lrs_project.tolerance)
-
-            if len(route_del_list_tmp) > 0:
-                msg = QMessageBox()
-                msg.setIcon(QMessageBox.Information)
-                msg.setText("There are Routes to delete with existing Events. Do you want to delete Routes and "
-                            "the referencing Events? "
-                            "See details for Routes and Event Classes.")
-                txt = ""
-                for route in route_del_list_tmp:
-                    txt = txt + route[0] + ": " + route[2] + "\n"
-                msg.setDetailedText(txt)
-                msg.setWindowTitle("Delete Routes")
-                msg.setStandardButtons(QMessageBox.Yes | QMessageBox.No)
-                ret = msg.exec_()
-                if ret == QMessageBox.Yes:
+            try:
+                # synchronization and event update in one transaction, rolled back completely on error
+                with self.pg_conn.transaction():
+                    route_del_list_tmp = self.__routes_update(lrs_basesystem, logfile)
+                if len(route_del_list_tmp) > 0:
+                    msg = QMessageBox()
+                    msg.setIcon(QMessageBox.Information)
+                    msg.setText("There are Routes to delete with existing Events. Do you want to delete Routes and "
+                                "the referencing Events? "
+                                "See details for Routes and Event Classes.")
+                    txt = ""
                     for route in route_del_list_tmp:
-                        event_class_name = route[2]
-                        event_class_type = self.lrs_event_classes.event_class_type_get(event_class_name)
-                        if event_class_type == "p":
-                            layer_bp = qgis_utils.layer_by_tablename_get(self.schema, event_class_name + "_bp")
-                            lrs_layer_bp = LRSBasePointEventClass(self.pg_conn, self.schema, layer_bp)
-                            point_events_reset = lrs_layer_bp.basepoints_sql_delete(route[1])
-                            layer = qgis_utils.layer_by_tablename_get(self.schema, event_class_name)
-                            lrs_layer = LRSPointEventClass(self.pg_conn, self.schema, layer)
-                            # reset geom of event point with one basepoint
-                            for point_event_reset in point_events_reset:
-                                lrs_layer.event_geom_sql_reset(point_event_reset)
-                        if event_class_type == "c":
-                            layer = qgis_utils.layer_by_tablename_get(self.schema, event_class_name)
-                            lrs_layer = LRSContEventClass(self.pg_conn, self.schema, layer)
-                            lrs_layer.events_sql_delete(route[1])
-                        if event_class_type == "t":
-                            layer = qgis_utils.layer_by_tablename_get(self.schema, event_class_name)
-                            lrs_layer = LRSTourEventClass(self.pg_conn, self.schema, layer)
-                            lrs_layer.events_sql_delete(route[1])
-                        self.route_class.route_delete(route[0])
-                        logfile.write("Route " + route[0] + ": Route with events deleted", "INFORM")
+                        txt = txt + route[0] + ": " + route[2] + "\n"
+                    msg.setDetailedText(txt)
+                    msg.setWindowTitle("Delete Routes")
+                    msg.setStandardButtons(QMessageBox.Yes | QMessageBox.No)
+                    ret = msg.exec_()
+                    if ret == QMessageBox.Yes:
+                        with self.pg_conn.transaction():
+                            self.__routes_delete(route_del_list_tmp, logfile)
+            except Exception as error:
+                # cached route geometries of the rolled back changes
+                self.route_class.routes_cache_clear()
+                logfile.write("Route Class Update: " + str(error) + ". Changes rolled back.", "ERROR")
 
         logfile.close()
         QApplication.restoreOverrideCursor()
@@ -150,3 +112,66 @@ class LRSRouteClassUpdate(LRSTool):
 
         if pg_conn_bs:
             pg_conn_bs.db_close()
+
+    def __routes_update(self, lrs_basesystem, logfile):
+        # routes changed since the last update, None if all routes have to be checked
+        routenames = lrs_basesystem.routes_changed_get()
+        if routenames is not None:
+            # routes edited in the route class
+            routenames.update(self.lrs_project.routes_edited_get())
+
+        # check topology of linestring with points
+        lrs_basesystem.topology_check(logfile, routenames)
+
+        # synchronize routes in route class and get changed routes to update events
+        routelist_upd, route_del_list_tmp, routenames_rejected = \
+            self.lrs_project.routes_synchronize(lrs_basesystem.id, logfile, routenames)
+        self.lrs_project.routeupdatetstz_set()
+        lrs_basesystem.snapshot_save(routenames_rejected)
+        # load geometries of all changed routes with one query
+        self.route_class.routes_cache_clear()
+        self.route_class.routes_preload(routelist_upd)
+
+        # update event classes
+        for clid in self.lrs_event_classes.event_class_idlist:
+            event_class_name = self.lrs_event_classes.event_class_names[clid]
+            if self.lrs_event_classes.event_class_types[clid] == "p":
+                layer = qgis_utils.layer_by_tablename_get(self.schema, event_class_name + "_bp")
+                lrs_layer = LRSBasePointEventClass(self.pg_conn, self.schema, layer)
+                lrs_layer.basepoints_update(routelist_upd, self.route_class, self.lrs_project.srid,
+                                            self.lrs_project.tolerance)
+            elif self.lrs_event_classes.event_class_types[clid] == "c":
+                layer = qgis_utils.layer_by_tablename_get(self.schema, event_class_name)
+                lrs_layer = LRSContEventClass(self.pg_conn, self.schema, layer)
+                lrs_layer.events_update(routelist_upd, self.route_class, self.lrs_project.srid,
+                                        self.lrs_project.tolerance)
+            elif self.lrs_event_classes.event_class_types[clid] == "t":
+                layer = qgis_utils.layer_by_tablename_get(self.schema, event_class_name)
+                lrs_layer = LRSTourEventClass(self.pg_conn, self.schema, layer)
+                lrs_layer.events_update(routelist_upd, self.route_class, self.lrs_project.srid,
+                                        self.lrs_project.tolerance)
+        return route_del_list_tmp
+
+    def __routes_delete(self, route_del_list_tmp, logfile):
+        for route in route_del_list_tmp:
+            event_class_name = route[2]
+            event_class_type = self.lrs_event_classes.event_class_type_get(event_class_name)
+            if event_class_type == "p":
+                layer_bp = qgis_utils.layer_by_tablename_get(self.schema, event_class_name + "_bp")
+                lrs_layer_bp = LRSBasePointEventClass(self.pg_conn, self.schema, layer_bp)
+                point_events_reset = lrs_layer_bp.basepoints_sql_delete(route[1])
+                layer = qgis_utils.layer_by_tablename_get(self.schema, event_class_name)
+                lrs_layer = LRSPointEventClass(self.pg_conn, self.schema, layer)
+                # reset geom of event point with one basepoint
+                for point_event_reset in point_events_reset:
+                    lrs_layer.event_geom_sql_reset(point_event_reset)
+            if event_class_type == "c":
+                layer = qgis_utils.layer_by_tablename_get(self.schema, event_class_name)
+                lrs_layer = LRSContEventClass(self.pg_conn, self.schema, layer)
+                lrs_layer.events_sql_delete(route[1])
+            if event_class_type == "t":
+                layer = qgis_utils.layer_by_tablename_get(self.schema, event_class_name)
+                lrs_layer = LRSTourEventClass(self.pg_conn, self.schema, layer)
+                lrs_layer.events_sql_delete(route[1])
+            self.route_class.route_delete(route[0])
+            logfile.write("Route " + route[0] + ": Route with events deleted", "INFORM")
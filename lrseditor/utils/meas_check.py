@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+    name             :  LRS-Editor
+    description      :  QGIS plugin for editing linear reference systems
+    begin            :  2020-09-01
+    copyright        :  (C) 2020 by Reto Meier (Holenstein Ingenieure AG)
+    email            :  reto.meier@h-ing.ch
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+# measure checks of the events along a route, plain sql without layer objects (e.g. in a background task)
+
+
+def cont_events_meas_check(pg_conn, schema, event_class_name, route_id, tolerance, route_class_name):
+    fields = """{id}, {uuid}, {frommeas}, {tomeas}, {geom}""" \
+             .format(id="id", uuid="uuid", frommeas="frommeas", tomeas="tomeas", geom="geom")
+    where = "route_id = '" + route_id + "'"
+    order = "frommeas ASC"
+    event_list = pg_conn.table_select(schema, event_class_name, fields, where, order)
+
+    result = []
+    # no events on route
+    if len(event_list) == 0:
+        return None
+
+    # check if first meas is 0
+    firstzero = True
+    if event_list[0][2] > tolerance:
+        firstzero = False
+
+    # check following meas
+    oldmeas = 0
+    for event in event_list:
+        frommeas = event[2]
+        tomeas = event[3]
+        if abs(frommeas - oldmeas) > tolerance:
+            result.append([event[0], event[1], frommeas, tomeas, event[4]])
+        oldmeas = tomeas
+
+    # check last meas with length of route
+    # sum for routes with many parts
+    total_length = pg_conn.table_select(schema, route_class_name, "SUM(length)", where)[0][0]
+    if total_length is None:
+        total_length = 0
+    lastmeas = True
+    if abs(total_length - oldmeas) > tolerance:
+        lastmeas = False
+
+    return result, firstzero, lastmeas
+
+
+def tour_events_meas_check(pg_conn, schema, event_class_name, route_id, tolerance):
+    fields = """{id}, {event_id}, {frommeas}, {tomeas}, {frompoint_id}, {topoint_id}""" \
+             .format(id="id", event_id="event_id", frommeas="frommeas", tomeas="tomeas",
+                     frompoint_id="frompoint_id", topoint_id="topoint_id")
+    where = "route_id = '" + route_id + "'"
+    order = "event_id ASC, frommeas ASC"
+    events_list = pg_conn.table_select(schema, event_class_name + "_mt", fields, where, order)
+
+    result = []
+    if len(events_list) == 0:
+        return None
+    event_uuid_old = None
+    frommeas_old = 0
+    tomeas_old = 0
+    for events in events_list:
+        frommeas = events[2]
+        tomeas = events[3]
+        event_uuid = events[1]
+        # check measures of tour part
+        measerror = False
+        if (abs(tomeas - frommeas) < tolerance) or (frommeas > tomeas):
+            measerror = True
+        # check if on the route are parts of the same tour
+        elif event_uuid == event_uuid_old:
+            if overlaps_check(frommeas, frommeas_old, tomeas, tomeas_old, tolerance):
+                measerror = True
+
+        if measerror:
+            where = "uuid = '" + event_uuid + "'"
+            try:
+                tour_name = pg_conn.table_select(schema, event_class_name + "_et", "name", where)[0][0]
+            except IndexError:
+                tour_name = "NONE"
+                pass
+
+            where = "uuid = '" + events[4] + "'"
+            feat_from = pg_conn.table_select(schema, event_class_name, "id, geom", where)[0]
+            feat_id_from = feat_from[0]
+            feat_geom_from = feat_from[1]
+            where = "uuid = '" + events[5] + "'"
+            feat_to = pg_conn.table_select(schema, event_class_name, "id, geom", where)[0]
+            feat_id_to = feat_to[0]
+            feat_geom_to = feat_to[1]
+            result.append([tour_name, feat_id_from, frommeas, events[4], feat_geom_from])
+            result.append([tour_name, feat_id_to, tomeas, events[5], feat_geom_to])
+
+        frommeas_old = frommeas
+        tomeas_old = tomeas
+        event_uuid_old = event_uuid
+
+    if len(result) > 0:
+        return result
+    else:
+        return None
+
+
+def overlaps_check(frommeas, frommeas_old, tomeas, tomeas_old, tolerance):
+
+    # overlapping a part of existing
+    if (tomeas - frommeas_old) >= tolerance and tomeas < tomeas_old:
+        return True
+        # overlapping a part of existing
+    if (tomeas_old - frommeas) >= tolerance and frommeas > frommeas_old:
+        return True
+        # new part over existing
+    if (frommeas_old - frommeas) >= tolerance and tomeas - tomeas_old >= tolerance:
+        return True
+        # new part inside existing
+    if (frommeas - frommeas_old) >= tolerance and tomeas_old - tomeas >= tolerance:
+        return True
+        # exact overlap of existing
+    if abs(frommeas - frommeas_old) <= tolerance and abs(tomeas - tomeas_old) <= tolerance:
+        return True
+        # one overlapping point
+    if abs(frommeas - frommeas_old) <= tolerance <= (tomeas - tomeas_old):
+        return True
+        # one overlapping point
+    if (frommeas_old - frommeas) >= tolerance >= abs(tomeas - tomeas_old):
+        return True
+
+    return False
+
+
+def route_meas_errors_get(pg_conn, schema, event_class_name, event_class_type, route_id, tolerance, route_class_name):
+    # events with wrong measures along the route as text, to display in the eventapprovaldockwidget
+    # no measure check for basepoints
+    if event_class_type == "c":
+        result = cont_events_meas_check(pg_conn, schema, event_class_name, route_id, tolerance, route_class_name)
+        if result is not None:
+            return [str(errlist[0]) + ": " + str(errlist[3]) for errlist in result[0]]
+    elif event_class_type == "t":
+        result = tour_events_meas_check(pg_conn, schema, event_class_name, route_id, tolerance)
+        if result is not None:
+            return [str(errlist[1]) + ": " + str(errlist[0]) + " / " + str(errlist[2]) for errlist in result]
+    return []
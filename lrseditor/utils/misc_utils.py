@@ -32,3 +32,10 @@ def uuid_get():
 
 def points_dist_get(point1, point2):
     return math.sqrt(abs(point1[0] - point2[0]) ** 2 + abs(point1[1] - point2[1]) ** 2)
+
+
+def sql_list_get(values, quoted=True):
+    # comma separated values for SQL IN (...)
+    if quoted:
+        return ", ".join("'" + str(value).replace("'", "''") + "'" for value in values)
+    return ", ".join(str(value) for value in values)
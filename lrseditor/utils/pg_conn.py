@@ -17,11 +17,131 @@
  *                                                                         *
  ***************************************************************************/
 """
+from contextlib import contextmanager
+import hashlib
+import io
+import time
+import uuid
+
 import psycopg2
+import psycopg2.extensions
 import psycopg2.extras
 
+from ..utils import wkb
+
 EXCLUDE_TABLENAME = ["lrs_project", "lrs_basesystem", "lrs_event_classes", "lrs_route_class", "lrs_tmp1",
-                     "lrs_check_class"]
+                     "lrs_check_class", "lrs_route_snapshot"]
+
+
+class LRSConnection(psycopg2.extensions.connection):
+    # connection which knows its server-side prepared statements
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+
+class PGConnPool:
+    # process-wide pool of open connections, shared by all tools and dialogs
+    # key: connection parameters, value: idle connections with time of release
+    IDLE_TIMEOUT = 300
+    MAX_IDLE = 4
+
+    def __init__(self):
+        self.__idle = {}
+
+    def acquire(self, key):
+        self.__evict()
+        idle_list = self.__idle.get(key, [])
+        while len(idle_list) > 0:
+            conn = idle_list.pop()[0]
+            if self.__healthy(conn):
+                return conn
+            self.__close(conn)
+        # new connection
+        dbname, host, port, user, passwd = key
+        return psycopg2.connect(dbname=dbname, host=host, user=user, password=passwd, port=port,
+                                connection_factory=LRSConnection)
+
+    def release(self, key, conn):
+        if conn.closed:
+            return
+        try:
+            # never return a connection with an open transaction
+            if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+        except psycopg2.Error:
+            self.__close(conn)
+            return
+        idle_list = self.__idle.setdefault(key, [])
+        if len(idle_list) >= self.MAX_IDLE:
+            self.__close(conn)
+        else:
+            idle_list.append([conn, time.monotonic()])
+        self.__evict()
+
+    def close_all(self):
+        for idle_list in self.__idle.values():
+            for idle in idle_list:
+                self.__close(idle[0])
+        self.__idle = {}
+
+    def __evict(self):
+        # close connections idle for longer than IDLE_TIMEOUT
+        now = time.monotonic()
+        for key, idle_list in self.__idle.items():
+            for idle in [idle for idle in idle_list if now - idle[1] > self.IDLE_TIMEOUT]:
+                idle_list.remove(idle)
+                self.__close(idle[0])
+
+    def __healthy(self, conn):
+        if conn.closed:
+            return False
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT 1;")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def __close(self, conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+
+conn_pool = PGConnPool()
+
+
+class PGBulkInsert:
+    # buffered insert of many rows into one table, the column types are resolved once
+    # rows are written with execute_values every size rows and on flush
+    def __init__(self, pg_conn, schema, tablename, size=1000):
+        self.__pg_conn = pg_conn
+        self.__schema = schema
+        self.__tablename = tablename
+        self.__size = size
+        self.__types = pg_conn.field_types_get(schema, tablename)
+        # fields -> rows, rows with the same fields are inserted together
+        self.__rows = {}
+        self.__count = 0
+
+    def add(self, fields, values):
+        # fields with value None are left out and get the default of the column
+        row = [(field, value) for field, value in zip(fields, values) if value is not None]
+        self.__rows.setdefault(tuple(field for field, value in row), []).append(tuple(value for field, value in row))
+        self.__count = self.__count + 1
+        if self.__count >= self.__size:
+            self.flush()
+
+    def flush(self):
+        for fields, rows in self.__rows.items():
+            # every value is cast to the type of its column, e.g. hex EWKB to geometry
+            template = "(" + ", ".join(["%s::" + self.__types[field] for field in fields]) + ")"
+            self.__pg_conn.table_insert2(self.__schema, self.__tablename, ", ".join(fields), rows, template)
+        self.__rows = {}
+        self.__count = 0
 
 
 class PGConn:
@@ -32,6 +152,8 @@ class PGConn:
         self.user = user
         self.passwd = passwd
         self.conn = None
+        # depth of nested transactions, commits are deferred while > 0
+        self.__transaction_level = 0
 
     def conn_dsn_get(self):
         dsn_dict = self.conn.get_dsn_parameters()
@@ -40,22 +162,69 @@ class PGConn:
     def db_connect(self):
         return_message = None
         try:
-            self.conn = psycopg2.connect(dbname=self.dbname, host=self.host, user=self.user, password=self.passwd,
-                                         port=self.port)
+            self.conn = conn_pool.acquire(self.__pool_key_get())
         except psycopg2.Error as e:
             return_message = str(e)
         finally:
             return return_message
 
     def db_close(self):
+        # connection is returned to the pool, not closed
         if self.conn is not None:
-            self.conn.close()
+            conn_pool.release(self.__pool_key_get(), self.conn)
             self.conn = None
+            self.__transaction_level = 0
+
+    def __pool_key_get(self):
+        return self.dbname, self.host, self.port, self.user, self.passwd
 
     def rollback(self):
         if self.conn is not None:
             self.conn.rollback()
 
+    @contextmanager
+    def transaction(self, savepoint=False):
+        # unit of work: all statements are committed at the end of the outermost transaction
+        # or rolled back on error, nested transactions with savepoint can be rolled back on their own
+        cur = self.conn.cursor()
+        savepoint_name = None
+        if savepoint and self.__transaction_level > 0:
+            savepoint_name = "lrs_savepoint_" + str(self.__transaction_level)
+            cur.execute("SAVEPOINT {name};".format(name=savepoint_name))
+        self.__transaction_level += 1
+        try:
+            yield self
+        except Exception:
+            self.__transaction_level -= 1
+            if savepoint_name:
+                cur.execute("ROLLBACK TO SAVEPOINT {name};".format(name=savepoint_name))
+            elif self.__transaction_level == 0:
+                self.conn.rollback()
+            raise
+        else:
+            self.__transaction_level -= 1
+            if savepoint_name:
+                cur.execute("RELEASE SAVEPOINT {name};".format(name=savepoint_name))
+            elif self.__transaction_level == 0:
+                self.conn.commit()
+
+    def __commit(self):
+        # no commit within a transaction
+        if self.__transaction_level == 0:
+            self.conn.commit()
+
+    def __prepared_execute(self, cur, name, statement, types, params):
+        # statement is prepared once per connection (parsed and planned), then executed with bound parameters
+        # statement contains identifiers (schema, table) -> unique name by hash
+        name = name + "_" + hashlib.md5(statement.encode("utf-8")).hexdigest()[:12]
+        if name not in self.conn.prepared:
+            prepare = """PREPARE {name} ({types}) AS {statement};""".format(name=name, types=types,
+                                                                            statement=statement)
+            cur.execute(prepare)
+            self.conn.prepared.add(name)
+        execute = """EXECUTE {name} ({params});""".format(name=name, params=", ".join(["%s"] * len(params)))
+        cur.execute(execute, params)
+
     def postgis_exists(self):
         cur = self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
         query = """SELECT EXISTS(SELECT extname FROM pg_catalog.pg_extension WHERE extname = 'postgis')"""
@@ -102,7 +271,7 @@ class PGConn:
         query = """ALTER TABLE {schema}.{tablename} RENAME TO {tablename_new};""" \
                 .format(schema=schema, tablename=tablename, tablename_new=tablename_new)
         cur.execute(query)
-        self.conn.commit()
+        self.__commit()
 
     def tablenames_get(self, schema):
         cur = self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
@@ -151,6 +320,19 @@ class PGConn:
                      'boolean': 'boolean'}
         return [data_type, type_dict.get(data_type, 'other')]
 
+    def field_types_get(self, schema, tablename):
+        # base types of all columns without typmod, e.g. geometry, character varying, field name as key
+        # an explicit cast with typmod would truncate (varchar(n)), the typmod is checked by the assignment
+        cur = self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        query = """SELECT attname, format_type(atttypid, NULL) FROM pg_catalog.pg_attribute WHERE 
+                attrelid = '{schema}.{tablename}'::regclass AND attnum > 0 AND NOT attisdropped""" \
+                .format(schema=schema, tablename=tablename)
+        cur.execute(query)
+        return {row[0]: row[1] for row in cur.fetchall()}
+
+    def bulk_insert_get(self, schema, tablename, size=1000):
+        return PGBulkInsert(self, schema, tablename, size)
+
     def field_null_value_check(self, schema, tablename, field, isnumeric):
         cur = self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
         if isnumeric:
@@ -203,13 +385,13 @@ class PGConn:
         trunc = """TRUNCATE {schema}.{tablename} RESTART IDENTITY;""" \
             .format(schema=schema, tablename=tablename)
         cur.execute(trunc)
-        self.conn.commit()
+        self.__commit()
 
     def view_drop(self, schema, viewname):
         cur = self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
         drop = """DROP VIEW IF EXISTS {schema}.{viewname} CASCADE;""".format(schema=schema, viewname=viewname)
         cur.execute(drop)
-        self.conn.commit()
+        self.__commit()
 
     def schemes_get(self):
         cur = self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
@@ -229,7 +411,7 @@ class PGConn:
         comment = """COMMENT ON TABLE {schema}.{lrs_project_name} IS 'LRS-Editor, Project System Table';""" \
                   .format(schema=schema, lrs_project_name=lrs_project_name)
         cur.execute(comment)
-        self.conn.commit()
+        self.__commit()
 
     def table_basesystem_create(self, schema):
         cur = self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
@@ -245,7 +427,7 @@ class PGConn:
         comment = """COMMENT ON TABLE {schema}.{lrs_basesystem_name} IS 'LRS-Editor, Basesystem System Table';""" \
                   .format(schema=schema, lrs_basesystem_name=lrs_basesystem_name)
         cur.execute(comment)
-        self.conn.commit()
+        self.__commit()
 
     def table_event_classes_create(self, schema):
         cur = self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
@@ -258,7 +440,7 @@ class PGConn:
         comment = """COMMENT ON TABLE {schema}.lrs_event_classes IS 'LRS-Editor, Event Classes System Table';""" \
                   .format(schema=schema, lrs_event_classes_name=lrs_event_classes_name)
         cur.execute(comment)
-        self.conn.commit()
+        self.__commit()
 
     def table_check_class_create(self, schema, srid):
         cur = self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
@@ -274,7 +456,7 @@ class PGConn:
         comment = """COMMENT ON TABLE {schema}.{lrs_check_class_name} IS 'LRS-Editor, Check Class System Table';""" \
             .format(schema=schema, lrs_check_class_name=lrs_check_class_name)
         cur.execute(comment)
-        self.conn.commit()
+        self.__commit()
 
     def table_select(self, schema, tablename, fields, where=None, order=None):
         cur = self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
@@ -294,6 +476,43 @@ class PGConn:
         rows_list = cur.fetchall()
         return rows_list
 
+    def table_select_join(self, schema, tablename, joinlist, fields, where=None, group=None, order=None):
+        # select with left joins, joinlist: [[tablename with alias, join condition], ...]
+        cur = self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        cur.execute(self.__select_join_query_get(schema, tablename, joinlist, fields, where, group, order))
+        rows_list = cur.fetchall()
+        return rows_list
+
+    def table_select_join_fetch(self, cursorname, schema, tablename, joinlist, fields, where=None, group=None,
+                                order=None, size=500):
+        # like table_select_join, but yields the rows in blocks of size from a server-side cursor
+        # the cursor lives in the open transaction: use a connection without commits while fetching
+        # (WITH HOLD would materialize the whole result at the first commit)
+        cur = self.conn.cursor(cursorname, cursor_factory=psycopg2.extras.DictCursor)
+        cur.execute(self.__select_join_query_get(schema, tablename, joinlist, fields, where, group, order))
+        try:
+            while True:
+                rows_list = cur.fetchmany(size)
+                if len(rows_list) == 0:
+                    break
+                yield rows_list
+        finally:
+            cur.close()
+
+    def __select_join_query_get(self, schema, tablename, joinlist, fields, where, group, order):
+        query = """SELECT {fields} FROM {schema}.{tablename}""".format(fields=fields, schema=schema,
+                                                                       tablename=tablename)
+        for join in joinlist:
+            query = query + """ LEFT JOIN {schema}.{tablename} ON {condition}""" \
+                    .format(schema=schema, tablename=join[0], condition=join[1])
+        if where:
+            query = query + " WHERE " + where
+        if group:
+            query = query + " GROUP BY " + group
+        if order:
+            query = query + " ORDER BY " + order
+        return query
+
     def table_select_group(self, schema, tablename, fields, group, where=None, order=None):
         cur = self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
         if not where and not order:
@@ -343,12 +562,27 @@ class PGConn:
         rows_list = cur.fetchall()
         return rows_list
 
+    def route_references_get(self, schema, tablelist, routelist):
+        # route_id and label of all rows in several tables referencing routes of routelist, one query (UNION ALL)
+        # tablelist: [[tablename, label], ...]
+        cur = self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        selects = []
+        params = []
+        for tablename, label in tablelist:
+            selects.append("""SELECT DISTINCT route_id, %s::text FROM {schema}.{tablename} 
+                           WHERE route_id = ANY(%s::uuid[])""".format(schema=schema, tablename=tablename))
+            params.extend([label, [str(route_id) for route_id in routelist]])
+        query = " UNION ALL ".join(selects) + ";"
+        cur.execute(query, params)
+        rows_list = cur.fetchall()
+        return rows_list
+
     def table_delete_row(self, schema, tablename, where):
         cur = self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
         delete = """DELETE FROM {schema}.{tablename} WHERE {where};""" \
                  .format(schema=schema, tablename=tablename, where=where)
         cur.execute(delete)
-        self.conn.commit()
+        self.__commit()
 
     def table_insert(self, schema, tablename, fields, values, returnfield=None):
         cur = self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
@@ -359,11 +593,19 @@ class PGConn:
             insert = """INSERT INTO {schema}.{tablename} ({fields}) VALUES ({values}) RETURNING {retfield};""" \
                     .format(schema=schema, tablename=tablename, fields=fields, values=values, retfield=returnfield)
         cur.execute(insert)
-        self.conn.commit()
+        self.__commit()
         # returning last, new value of returnfield
         if returnfield:
             return cur.fetchone()[0]
 
+    def table_insert2(self, schema, tablename, fields, values, template=None):
+        # insert multiple rows
+        cur = self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        insert = """INSERT INTO {schema}.{tablename} ({fields}) VALUES %s;""" \
+                 .format(schema=schema, tablename=tablename, fields=fields)
+        psycopg2.extras.execute_values(cur, insert, values, template, page_size=1000)
+        self.__commit()
+
     def table_insert_fromtable(self, schema, tablename, fields, fromfields, fromtablename, where=None):
         cur = self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
         if not where:
@@ -377,7 +619,25 @@ class PGConn:
                     .format(schema=schema, tablename=tablename, fields=fields, fromfields=fromfields,
                             fromtablename=fromtablename, where=where)
         cur.execute(insert)
-        self.conn.commit()
+        self.__commit()
+
+    def table_insert_fromtable_values(self, schema, tablename, fields, fromfields, fromtablename, valuefields,
+                                      joinexpr, values, where=None):
+        # insert from another table, joined with multiple values (data)
+        cur = self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        if not where:
+            insert = """INSERT INTO {schema}.{tablename} ({fields}) SELECT {fromfields} FROM 
+                    {schema}.{fromtablename} JOIN (VALUES %s) as data ({valuefields}) ON {joinexpr};""" \
+                    .format(schema=schema, tablename=tablename, fields=fields, fromfields=fromfields,
+                            fromtablename=fromtablename, valuefields=valuefields, joinexpr=joinexpr)
+        else:
+            insert = """INSERT INTO {schema}.{tablename} ({fields}) SELECT {fromfields} FROM 
+                    {schema}.{fromtablename} JOIN (VALUES %s) as data ({valuefields}) ON {joinexpr} 
+                    WHERE {where};""" \
+                    .format(schema=schema, tablename=tablename, fields=fields, fromfields=fromfields,
+                            fromtablename=fromtablename, valuefields=valuefields, joinexpr=joinexpr, where=where)
+        psycopg2.extras.execute_values(cur, insert, values, page_size=1000)
+        self.__commit()
 
     def table_update1(self, schema, tablename, expression, where):
         # update with same values for all rows
@@ -385,7 +645,7 @@ class PGConn:
         update = """UPDATE {schema}.{tablename} SET {expression} WHERE {where};"""\
                  .format(schema=schema, tablename=tablename, expression=expression, where=where)
         cur.execute(update)
-        self.conn.commit()
+        self.__commit()
 
     def table_update2(self, schema, tablename, updatefields, idfield, valuefields, values):
         # update with multiple values
@@ -399,7 +659,28 @@ class PGConn:
                 {schema}.{tablename}.{idfield} = data.{idfield};"""\
                 .format(schema=schema, tablename=tablename, expr=expr, valuefields=valuefields, idfield=idfield)
         psycopg2.extras.execute_values(cur, update, values)
-        self.conn.commit()
+        self.__commit()
+
+    def table_update3(self, schema, tablename, expression, idfield, valuefields, values, template=None):
+        # update with multiple values, expression refers to the values by data.<valuefield>
+        # and to the current values of the table by a.<field>
+        cur = self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        update = """UPDATE {schema}.{tablename} a SET {expression} FROM (VALUES %s) as data ({valuefields}) WHERE 
+                a.{idfield} = data.{idfield};"""\
+                .format(schema=schema, tablename=tablename, expression=expression, valuefields=valuefields,
+                        idfield=idfield)
+        psycopg2.extras.execute_values(cur, update, values, template, page_size=1000)
+        self.__commit()
+
+    def table_sortnr_renumber(self, schema, tablename, groupfield, where):
+        # renumber sortnr 1..n within every group, in the order of the existing sortnr
+        cur = self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        update = """UPDATE {schema}.{tablename} a SET sortnr = data.sortnr FROM (SELECT id, row_number() OVER 
+                 (PARTITION BY {groupfield} ORDER BY sortnr ASC, id ASC) AS sortnr FROM {schema}.{tablename} 
+                 WHERE {where}) AS data WHERE a.id = data.id AND a.sortnr <> data.sortnr;""" \
+                 .format(schema=schema, tablename=tablename, groupfield=groupfield, where=where)
+        cur.execute(update)
+        self.__commit()
 
     def table_update_fromtable(self, schema, updatetablename, expression, fromtablename, where):
         # update with values from another table
@@ -408,7 +689,7 @@ class PGConn:
                  .format(schema=schema, updatetablename=updatetablename, expression=expression,
                          fromtablename=fromtablename, where=where)
         cur.execute(update)
-        self.conn.commit()
+        self.__commit()
 
     def point_event_class_create(self, schema, event_class_name, srid):
         cur = self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
@@ -427,7 +708,7 @@ class PGConn:
         comment = """COMMENT ON TABLE {schema}.{tablename} IS 'LRS-Editor, Point Name Table';"""\
                   .format(schema=schema, tablename=tablename)
         cur.execute(comment)
-        self.conn.commit()
+        self.__commit()
         tablename = event_class_name + "_bp"
         create = """CREATE TABLE {schema}.{tablename}(id SERIAL PRIMARY KEY, uuid UUID NOT NULL, 
                     geom geometry(Point,{srid}) NOT NULL, event_id UUID NOT NULL, azi DOUBLE PRECISION NOT NULL, 
@@ -448,7 +729,7 @@ class PGConn:
         comment = """COMMENT ON TABLE {schema}.{tablename} IS 'LRS-Editor, Base Point Event Table';"""\
                   .format(schema=schema, tablename=tablename)
         cur.execute(comment)
-        self.conn.commit()
+        self.__commit()
 
     def cont_event_class_create(self, schema, event_class_name, srid):
         cur = self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
@@ -472,7 +753,7 @@ class PGConn:
         comment = """COMMENT ON TABLE {schema}.{tablename} IS 'LRS-Editor, Continuous Event Table';""" \
                   .format(schema=schema, tablename=tablename)
         cur.execute(comment)
-        self.conn.commit()
+        self.__commit()
 
         table_et_name = event_class_name + "_et"
         create = """CREATE TABLE {schema}.{table_et_name}(id SERIAL PRIMARY KEY, uuid UUID NOT NULL, 
@@ -486,9 +767,10 @@ class PGConn:
         comment = """COMMENT ON TABLE {schema}.{table_et_name} IS 'LRS-Editor, Continuous Name Table';""" \
                   .format(schema=schema, table_et_name=table_et_name)
         cur.execute(comment)
-        self.conn.commit()
+        self.__commit()
 
-    def cont_event_view_create(self, schema, event_class_name, route_class_name, srid):
+    def cont_event_view_create(self, schema, event_class_name, route_class_name, srid, materialized=False):
+        self.route_measure_columns_add(schema, route_class_name, srid)
         cur = self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
         exclude_fieldname = ["id", "geom", "uuid", "name", "createtstz", "changetstz", "geomtstz", "event_id", "azi",
                              "route_id", "frommeas", "tomeas", "apprtstz"]
@@ -501,14 +783,21 @@ class PGConn:
 
         viewname = "v_" + event_class_name
         table_et_name = event_class_name + "_et"
+        group_fields = ""
+        if materialized:
+            # source view of the cache table v_, route_id and event_id for the refresh
+            viewname = "vs_" + event_class_name
+            user_fields = ''.join((user_fields, ", a.route_id"))
+            group_fields = ", a.route_id, a.event_id"
+            # user fields added or removed: the columns change, the cache table v_ and its triggers are rebuilt
+            drop = """DROP VIEW IF EXISTS {schema}.{viewname} CASCADE;""".format(schema=schema, viewname=viewname)
+            cur.execute(drop)
         create = """CREATE or REPLACE VIEW {schema}.{viewname} as SELECT 
                     a.id,
                     a.uuid,
                     a.frommeas,
                     a.tomeas, 
-                    ST_LocateBetween(ST_AddMeasure(
-                    ST_Collect(rc.geom ORDER BY rc.sortnr ASC), 0, 
-                    ST_Length(ST_Collect(rc.geom ORDER BY rc.sortnr ASC))), 
+                    ST_LocateBetween(ST_Collect(rc.geomm ORDER BY rc.sortnr ASC), 
                     a.frommeas, a.tomeas)::geometry(MultiLineStringM,{srid}) as geom,
                     a.event_id,
                     a.createtstz,
@@ -521,14 +810,18 @@ class PGConn:
                     FROM {schema}.{event_class_name} a 
                     LEFT JOIN {schema}.{route_class_name} rc ON a.route_id = rc.route_id 
                     LEFT JOIN {schema}.{table_et_name} b ON a.event_id = b.uuid 
-                    GROUP BY a.id, b.name, rc.name;""" \
+                    GROUP BY a.id{group_fields}, b.name, rc.name;""" \
                     .format(schema=schema, viewname=viewname, srid=srid, event_class_name=event_class_name,
-                            user_fields=user_fields, route_class_name=route_class_name, table_et_name=table_et_name)
+                            user_fields=user_fields, route_class_name=route_class_name, table_et_name=table_et_name,
+                            group_fields=group_fields)
         cur.execute(create)
         comment = """COMMENT ON VIEW {schema}.{viewname} IS 'LRS-Editor, Continuous Event View';""" \
                   .format(schema=schema, viewname=viewname)
         cur.execute(comment)
-        self.conn.commit()
+        self.__commit()
+        if materialized:
+            self.__event_view_cache_create(schema, event_class_name, event_class_name,
+                                           "LRS-Editor, Continuous Event View (materialized)")
 
     def tour_event_class_create(self, schema, event_class_name, srid):
         cur = self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
@@ -548,7 +841,7 @@ class PGConn:
         comment = """COMMENT ON TABLE {schema}.{tablename} IS 'LRS-Editor, Tour Event Table';""" \
                   .format(schema=schema, tablename=tablename)
         cur.execute(comment)
-        self.conn.commit()
+        self.__commit()
 
         table_mt_name = event_class_name + "_mt"
         create = """CREATE TABLE {schema}.{table_mt_name}(id SERIAL PRIMARY KEY, uuid UUID NOT NULL, 
@@ -572,7 +865,7 @@ class PGConn:
         comment = """COMMENT ON TABLE {schema}.{table_mt_name} IS 'LRS-Editor, Tour Measure Table';""" \
                   .format(schema=schema, table_mt_name=table_mt_name)
         cur.execute(comment)
-        self.conn.commit()
+        self.__commit()
 
         table_et_name = event_class_name + "_et"
         create = """CREATE TABLE {schema}.{table_et_name}(id SERIAL PRIMARY KEY, uuid UUID NOT NULL, 
@@ -586,9 +879,10 @@ class PGConn:
         comment = """COMMENT ON TABLE {schema}.{table_et_name} IS 'LRS-Editor, Tour Name Table';""" \
                   .format(schema=schema, table_et_name=table_et_name)
         cur.execute(comment)
-        self.conn.commit()
+        self.__commit()
 
-    def tour_event_view_create(self, schema, event_class_name, route_class_name, srid):
+    def tour_event_view_create(self, schema, event_class_name, route_class_name, srid, materialized=False):
+        self.route_measure_columns_add(schema, route_class_name, srid)
         cur = self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
         exclude_fieldname = ["id", "geom", "uuid", "name", "createtstz", "changetstz", "geomtstz", "event_id", "azi",
                              "route_id", "sortnr", "frommeas", "tomeas", "frompoint_id", "topoint_id", "routedir",
@@ -603,6 +897,15 @@ class PGConn:
 
         viewname = "v_" + event_class_name
         table_et_name = event_class_name + "_et"
+        group_fields = ""
+        if materialized:
+            # source view of the cache table v_, route_id and event_id for the refresh
+            viewname = "vs_" + event_class_name
+            user_fields = ''.join((user_fields, ", a.route_id"))
+            group_fields = ", a.route_id, a.event_id"
+            # user fields added or removed: the columns change, the cache table v_ and its triggers are rebuilt
+            drop = """DROP VIEW IF EXISTS {schema}.{viewname} CASCADE;""".format(schema=schema, viewname=viewname)
+            cur.execute(drop)
         create = """CREATE or REPLACE VIEW {schema}.{viewname} as SELECT 
                     a.id, 
                     a.uuid,
@@ -611,15 +914,11 @@ class PGConn:
                     a.frommeas,
                     a.tomeas,
                     CASE WHEN routedir THEN 
-                    ST_LocateBetween(ST_AddMeasure(
-                    ST_Collect(rc.geom ORDER BY rc.sortnr ASC), 0, 
-                    ST_Length(ST_Collect(rc.geom ORDER BY rc.sortnr ASC))), 
+                    ST_LocateBetween(ST_Collect(rc.geomm ORDER BY rc.sortnr ASC), 
                     a.frommeas, a.tomeas)::geometry(MultiLineStringM,{srid})
                     ELSE
                     ST_Reverse(
-                    ST_LocateBetween(ST_AddMeasure(
-                    ST_Collect(rc.geom ORDER BY rc.sortnr ASC), 0, 
-                    ST_Length(ST_Collect(rc.geom ORDER BY rc.sortnr ASC))), 
+                    ST_LocateBetween(ST_Collect(rc.geomm ORDER BY rc.sortnr ASC), 
                     a.frommeas, a.tomeas))::geometry(MultiLineStringM,{srid})
                     END as geom,
                     a.event_id,
@@ -629,16 +928,114 @@ class PGConn:
                     FROM {schema}.{table_mt_name} a 
                     LEFT JOIN {schema}.{route_class_name} rc ON a.route_id = rc.route_id 
                     LEFT JOIN {schema}.{table_et_name} b ON a.event_id = b.uuid 
-                    GROUP BY a.id, b.name, rc.name;""" \
+                    GROUP BY a.id{group_fields}, b.name, rc.name;""" \
                     .format(schema=schema, viewname=viewname, srid=srid, table_mt_name=table_mt_name,
-                            user_fields=user_fields, route_class_name=route_class_name, table_et_name=table_et_name)
+                            user_fields=user_fields, route_class_name=route_class_name, table_et_name=table_et_name,
+                            group_fields=group_fields)
         cur.execute(create)
         comment = """COMMENT ON VIEW {schema}.{viewname} IS 'LRS-Editor, Tour Event View';""" \
                   .format(schema=schema, viewname=viewname)
         cur.execute(comment)
-        self.conn.commit()
+        self.__commit()
+        if materialized:
+            self.__event_view_cache_create(schema, event_class_name, table_mt_name,
+                                           "LRS-Editor, Tour Event View (materialized)")
+
+    def __event_view_cache_create(self, schema, event_class_name, tablename, table_comment):
+        # table v_ with the rows of the source view vs_, kept up to date by triggers on tablename (event table or
+        # _mt) and _et, route changes by event_view_routes_refresh
+        cur = self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        viewname = "v_" + event_class_name
+        sourcename = "vs_" + event_class_name
+        table_et_name = event_class_name + "_et"
+        if self.table_exists(schema, viewname):
+            drop = """DROP TABLE {schema}.{viewname} CASCADE;""".format(schema=schema, viewname=viewname)
+        else:
+            # plain view of the event class
+            drop = """DROP VIEW IF EXISTS {schema}.{viewname} CASCADE;""".format(schema=schema, viewname=viewname)
+        cur.execute(drop)
+        create = """CREATE TABLE {schema}.{viewname} AS SELECT * FROM {schema}.{sourcename};""" \
+                 .format(schema=schema, viewname=viewname, sourcename=sourcename)
+        cur.execute(create)
+        alter = """ALTER TABLE {schema}.{viewname} ADD PRIMARY KEY (id);""".format(schema=schema, viewname=viewname)
+        cur.execute(alter)
+        idx = """CREATE INDEX IF NOT EXISTS idx_{viewname}_geom ON {schema}.{viewname}
+                 USING gist (geom)""".format(schema=schema, viewname=viewname)
+        cur.execute(idx)
+        idx = """CREATE INDEX IF NOT EXISTS idx_{viewname}_route_id ON {schema}.{viewname}
+                 USING btree (route_id)""".format(schema=schema, viewname=viewname)
+        cur.execute(idx)
+        idx = """CREATE INDEX IF NOT EXISTS idx_{viewname}_event_id ON {schema}.{viewname}
+                 USING btree (event_id)""".format(schema=schema, viewname=viewname)
+        cur.execute(idx)
+        comment = """COMMENT ON TABLE {schema}.{viewname} IS '{table_comment}';""" \
+                  .format(schema=schema, viewname=viewname, table_comment=table_comment)
+        cur.execute(comment)
+        # statement triggers, refresh all changed rows at once
+        triggerlist = [[tablename, "id", "id"], [table_et_name, "event_id", "uuid"]]
+        for trigger in triggerlist:
+            function = """CREATE OR REPLACE FUNCTION {schema}.{tablename}_cache_refresh() RETURNS trigger AS $$
+                       BEGIN
+                       IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                       DELETE FROM {schema}.{viewname} WHERE {cachefield} = ANY(ARRAY(SELECT {field} FROM old_rows));
+                       END IF;
+                       IF TG_OP IN ('UPDATE', 'INSERT') THEN
+                       DELETE FROM {schema}.{viewname} WHERE {cachefield} = ANY(ARRAY(SELECT {field} FROM new_rows));
+                       INSERT INTO {schema}.{viewname} SELECT * FROM {schema}.{sourcename} 
+                       WHERE {cachefield} = ANY(ARRAY(SELECT {field} FROM new_rows));
+                       END IF;
+                       RETURN NULL;
+                       END;
+                       $$ LANGUAGE plpgsql;""" \
+                       .format(schema=schema, tablename=trigger[0], viewname=viewname, sourcename=sourcename,
+                               cachefield=trigger[1], field=trigger[2])
+            cur.execute(function)
+            referencing = {"INSERT": "NEW TABLE AS new_rows", "UPDATE": "OLD TABLE AS old_rows NEW TABLE AS new_rows",
+                           "DELETE": "OLD TABLE AS old_rows"}
+            for operation, transition in referencing.items():
+                create = """DROP TRIGGER IF EXISTS {tablename}_cache_{op} ON {schema}.{tablename};
+                         CREATE TRIGGER {tablename}_cache_{op} AFTER {operation} ON {schema}.{tablename} 
+                         REFERENCING {transition} FOR EACH STATEMENT 
+                         EXECUTE PROCEDURE {schema}.{tablename}_cache_refresh();""" \
+                         .format(schema=schema, tablename=trigger[0], op=operation.lower(), operation=operation,
+                                 transition=transition)
+                cur.execute(create)
+        self.__commit()
+
+    def event_view_routes_refresh(self, schema, event_class_name, routelist):
+        # materialized event view: recompute the rows of the routes in routelist (e.g. changed geometry)
+        if len(routelist) == 0 or not self.table_exists(schema, "v_" + event_class_name):
+            return
+        cur = self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        viewname = "v_" + event_class_name
+        sourcename = "vs_" + event_class_name
+        routelist = [str(route_id) for route_id in routelist]
+        delete = """DELETE FROM {schema}.{viewname} WHERE route_id = ANY(%s::uuid[]);""" \
+                 .format(schema=schema, viewname=viewname)
+        cur.execute(delete, (routelist,))
+        insert = """INSERT INTO {schema}.{viewname} SELECT * FROM {schema}.{sourcename} 
+                 WHERE route_id = ANY(%s::uuid[]);""".format(schema=schema, viewname=viewname, sourcename=sourcename)
+        cur.execute(insert, (routelist,))
+        self.__commit()
+
+    def event_view_drop(self, schema, event_class_name):
+        # plain view v_ or materialized view (table v_, source view vs_, triggers)
+        cur = self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        viewname = "v_" + event_class_name
+        if self.table_exists(schema, viewname):
+            drop = """DROP TABLE IF EXISTS {schema}.{viewname} CASCADE;""".format(schema=schema, viewname=viewname)
+            cur.execute(drop)
+            for tablename in [event_class_name, event_class_name + "_mt", event_class_name + "_et"]:
+                drop = """DROP FUNCTION IF EXISTS {schema}.{tablename}_cache_refresh() CASCADE;""" \
+                       .format(schema=schema, tablename=tablename)
+                cur.execute(drop)
+            self.__commit()
+            self.view_drop(schema, "vs_" + event_class_name)
+        else:
+            self.view_drop(schema, viewname)
 
     def tour_view_create(self, schema, event_class_name, route_class_name, event_id, srid):
+        self.route_measure_columns_add(schema, route_class_name, srid)
         cur = self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
         exclude_fieldname = ["id", "geom", "uuid", "name", "createtstz", "changetstz", "geomtstz", "event_id", "azi",
                              "route_id", "sortnr", "frommeas", "tomeas", "frompoint_id", "topoint_id", "routedir",
@@ -661,15 +1058,11 @@ class PGConn:
                     a.frommeas,
                     a.tomeas,
                     CASE WHEN routedir THEN 
-                    ST_LocateBetween(ST_AddMeasure(
-                    ST_Collect(rc.geom ORDER BY rc.sortnr ASC), 0, 
-                    ST_Length(ST_Collect(rc.geom ORDER BY rc.sortnr ASC))), 
+                    ST_LocateBetween(ST_Collect(rc.geomm ORDER BY rc.sortnr ASC), 
                     a.frommeas, a.tomeas)::geometry(MultiLineStringM,{srid})
                     ELSE
                     ST_Reverse(
-                    ST_LocateBetween(ST_AddMeasure(
-                    ST_Collect(rc.geom ORDER BY rc.sortnr ASC), 0, 
-                    ST_Length(ST_Collect(rc.geom ORDER BY rc.sortnr ASC))), 
+                    ST_LocateBetween(ST_Collect(rc.geomm ORDER BY rc.sortnr ASC), 
                     a.frommeas, a.tomeas))::geometry(MultiLineStringM,{srid})
                     END as geom,
                     a.event_id,
@@ -688,7 +1081,7 @@ class PGConn:
         comment = """COMMENT ON VIEW {schema}.{viewname} IS 'LRS-Editor, Tour View';""" \
             .format(schema=schema, viewname=viewname)
         cur.execute(comment)
-        self.conn.commit()
+        self.__commit()
 
     def point_event_class_delete(self, schema, event_class_name):
         cur = self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
@@ -697,9 +1090,10 @@ class PGConn:
             drop = """DROP TABLE IF EXISTS {schema}.{tablename};"""\
                     .format(schema=schema, tablename=tablename)
             cur.execute(drop)
-            self.conn.commit()
+            self.__commit()
 
     def cont_event_class_delete(self, schema, event_class_name):
+        self.event_view_drop(schema, event_class_name)
         cur = self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
         # drop tables with view (-> CASCADE)
         tablename_list = [event_class_name, event_class_name + "_et"]
@@ -707,9 +1101,10 @@ class PGConn:
             drop = """DROP TABLE IF EXISTS {schema}.{tablename} CASCADE;"""\
                     .format(schema=schema, tablename=tablename)
             cur.execute(drop)
-            self.conn.commit()
+            self.__commit()
 
     def tour_event_class_delete(self, schema, event_class_name):
+        self.event_view_drop(schema, event_class_name)
         cur = self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
         # drop tables with view (-> CASCADE)
         tablename_list = [event_class_name, event_class_name + "_et", event_class_name + "_mt"]
@@ -717,7 +1112,7 @@ class PGConn:
             drop = """DROP TABLE IF EXISTS {schema}.{tablename} CASCADE;""" \
                 .format(schema=schema, tablename=tablename)
             cur.execute(drop)
-            self.conn.commit()
+            self.__commit()
 
     def linestring_nodes_get(self, schema, tablename, geomfield, fields, where, order=None):
         cur = self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
@@ -745,8 +1140,11 @@ class PGConn:
         rows_list = cur.fetchall()
         return rows_list
 
-    def linestrings_nodes_get(self, schema, tablename, geomfield, fields=None):
+    def linestrings_nodes_get(self, schema, tablename, geomfield, fields=None, where=None):
         cur = self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        if where:
+            # restrict both parts of the union
+            tablename = tablename + " WHERE " + where
         if not fields:
             query = """SELECT 'S' as KIND, ST_X(ST_StartPoint({geomfield})) as X,
                     ST_Y(ST_StartPoint({geomfield})) as Y FROM {schema}.{tablename}
@@ -779,7 +1177,7 @@ class PGConn:
             comment = """COMMENT ON TABLE {schema}.{lrs_tmp1} IS 'LRS-Editor, Tmp-Class1';""" \
                 .format(schema=schema, lrs_tmp1=lrs_tmp1)
             cur.execute(comment)
-            self.conn.commit()
+            self.__commit()
 
     def linestring_loop_rep2(self, schema, route_id, lrs_id, srid):
         cur = self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
@@ -801,7 +1199,7 @@ class PGConn:
                    WHERE name = '{route_id}');""" \
                    .format(schema=schema, lrs_tmp1=lrs_tmp1, route_id=route_id)
         cur.execute(update1)
-        self.conn.commit()
+        self.__commit()
 
         # collect and merge linestrings, considering direction by order of id
         update2 = """UPDATE {schema}.{lrs_rc_name} SET geom = subquery.new_geom 
@@ -811,14 +1209,14 @@ class PGConn:
                      .format(schema=schema, lrs_rc_name=lrs_rc_name, lrs_tmp1=lrs_tmp1, route_id=route_id,
                              lrs_id=lrs_id)
         cur.execute(update2)
-        self.conn.commit()
+        self.__commit()
 
         # insert startpoint to complete loop
         update3 = """UPDATE {schema}.{lrs_rc_name} SET geom = ST_AddPoint(geom, ST_GeomFromText('{startpoint}', 
                     {srid}), 0) WHERE id = {lrs_id};""" \
                      .format(schema=schema, lrs_rc_name=lrs_rc_name, startpoint=startpoint, srid=srid, lrs_id=lrs_id)
         cur.execute(update3)
-        self.conn.commit()
+        self.__commit()
 
     def linestring_loop_rep3(self, schema):
         cur = self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
@@ -826,14 +1224,14 @@ class PGConn:
         drop = """DROP TABLE IF EXISTS {schema}.{lrs_tmp1} CASCADE;""" \
                .format(schema=schema, lrs_tmp1=lrs_tmp1)
         cur.execute(drop)
-        self.conn.commit()
+        self.__commit()
 
     def linestring_reverse(self, schema, tablename, geomfield, where):
         cur = self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
         update = """UPDATE {schema}.{tablename} SET {geomfield} = ST_Reverse({geomfield}) WHERE {where};""" \
                  .format(schema=schema, tablename=tablename, geomfield=geomfield, where=where)
         cur.execute(update)
-        self.conn.commit()
+        self.__commit()
 
     def linestring_closed(self, schema, geomfield, route_id, pathnr):
         cur = self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
@@ -858,23 +1256,52 @@ class PGConn:
         rows_list = cur.fetchall()
         return rows_list
 
-    def linestring_compare(self, schema, tablename, geomfield):
+    def linestring_compare(self, schema, tablename, geomfield, where=None):
         # st_equals and st_orderingequals
+        # routes with equal hashes of all parts are equal, spatial predicates only for the others
+        # route class: hash of the current geometry, a stored hash would miss edits in QGIS
+        # a missing hash of lrs_route_class counts as changed
         cur = self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
         lrs_rc_name = EXCLUDE_TABLENAME[3]
-        query = """SELECT a.name, 
+        query = """WITH h AS (SELECT r.name, r.hashcomplete AND r.routehash = s.routehash AS hashequal FROM 
+                (SELECT a.name, count(*) = count(a.geomhash) AS hashcomplete, 
+                string_agg(a.geomhash, ',' ORDER BY a.pathnr) AS routehash 
+                FROM {schema}.{lrs_rc_name} a WHERE a.valid = 1 AND {where} GROUP BY a.name) r LEFT JOIN 
+                (SELECT b.name, string_agg(md5(ST_AsBinary(b.{geomfield})), ',' ORDER BY b.sortnr) AS routehash 
+                FROM {schema}.{tablename} b GROUP BY b.name) s ON r.name = s.name)
+                SELECT a.name, 
                 ST_Equals(ST_LineMerge(ST_Collect(a.geom ORDER BY a.name ASC, a.pathnr ASC)),  
                 ST_LineMerge(ST_Collect(b.{geomfield} ORDER BY b.name ASC, b.sortnr ASC))),  
                 ST_OrderingEquals(ST_LineMerge(ST_Collect(a.geom ORDER BY a.name ASC, a.pathnr ASC)),  
                 ST_LineMerge(ST_Collect(b.{geomfield} ORDER BY b.name ASC, b.sortnr ASC)))                 
                 FROM {schema}.{lrs_rc_name} a LEFT JOIN {schema}.{tablename} b ON a.name = b.name 
-                WHERE a.valid = 1 GROUP BY a.name;""" \
-                .format(schema=schema, tablename=tablename, geomfield=geomfield, lrs_rc_name=lrs_rc_name)
+                WHERE a.valid = 1 AND a.name IN (SELECT name FROM h WHERE hashequal IS NOT TRUE) GROUP BY a.name
+                UNION ALL
+                SELECT name, TRUE, TRUE FROM h WHERE hashequal;""" \
+                .format(schema=schema, tablename=tablename, geomfield=geomfield, lrs_rc_name=lrs_rc_name,
+                        where=where if where else "TRUE")
         # returns boolean value
         cur.execute(query)
         rows_list = cur.fetchall()
         return rows_list
 
+    def linestring_hash_changed_get(self, schema, tablename, geomfield):
+        # names of the routes, whose parts in the route class differ from the valid routes in lrs_route_class,
+        # e.g. edited in QGIS, by the same hashes as linestring_compare
+        cur = self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        lrs_rc_name = EXCLUDE_TABLENAME[3]
+        query = """SELECT r.name FROM 
+                (SELECT a.name, count(*) = count(a.geomhash) AS hashcomplete, 
+                string_agg(a.geomhash, ',' ORDER BY a.pathnr) AS routehash 
+                FROM {schema}.{lrs_rc_name} a WHERE a.valid = 1 GROUP BY a.name) r JOIN 
+                (SELECT b.name, string_agg(md5(ST_AsBinary(b.{geomfield})), ',' ORDER BY b.sortnr) AS routehash 
+                FROM {schema}.{tablename} b GROUP BY b.name) s ON r.name = s.name 
+                WHERE NOT (r.hashcomplete AND r.routehash = s.routehash);""" \
+                .format(schema=schema, tablename=tablename, geomfield=geomfield, lrs_rc_name=lrs_rc_name)
+        cur.execute(query)
+        rows_list = cur.fetchall()
+        return [row[0] for row in rows_list]
+
     def point_within1(self, schema, tablename_a, tablename_b, fields, a_geomfield, b_geomfield,
                       tolerance, a_id_field, b_id_field, group):
         cur = self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
@@ -911,21 +1338,22 @@ class PGConn:
                     pointtype VARCHAR(100) NOT NULL);""" \
                     .format(schema=schema, tablename=tablename, srid=srid)
         cur.execute(create)
-        self.conn.commit()
+        self.__commit()
 
         for row in nodelist:
-            insert = """INSERT INTO {schema}.{tablename} (geom, pointtype) VALUES 
-                        (ST_SetSRID(ST_MakePoint({x}, {y}), {srid}), '{type}');""" \
-                        .format(schema=schema, tablename=tablename, x=row[1], y=row[2], srid=srid, type=row[0])
+            insert = """INSERT INTO {schema}.{tablename} (geom, pointtype) VALUES ('{geom}', '{type}');""" \
+                        .format(schema=schema, tablename=tablename,
+                                geom=wkb.point_ewkb_get(row[1], row[2], srid).hex(), type=row[0])
             cur.execute(insert)
-            self.conn.commit()
+            self.__commit()
 
     def table_route_class_create(self, schema, tablename, srid):
         cur = self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
         create = """CREATE TABLE {schema}.{tablename}(id SERIAL PRIMARY KEY, geom geometry(LineString,{srid}) NOT NULL,
                     sortnr INTEGER NOT NULL, route_id UUID NOT NULL, name VARCHAR(100) NOT NULL,
                     basesystem_id INTEGER NOT NULL, createtstz TIMESTAMPTZ NOT NULL, changetstz TIMESTAMPTZ NOT NULL, 
-                    geomtstz TIMESTAMPTZ NOT NULL, length DOUBLE PRECISION);""" \
+                    geomtstz TIMESTAMPTZ NOT NULL, length DOUBLE PRECISION, 
+                    geomm geometry(LineStringM,{srid}), startmeas DOUBLE PRECISION);""" \
                     .format(schema=schema, tablename=tablename, srid=srid)
         cur.execute(create)
         idx = """CREATE INDEX IF NOT EXISTS idx_{tablename}_route_id ON {schema}.{tablename}
@@ -937,15 +1365,15 @@ class PGConn:
         comment = """COMMENT ON TABLE {schema}.{tablename} IS 'LRS-Editor, Route Class Table';""" \
                   .format(schema=schema, tablename=tablename)
         cur.execute(comment)
-        self.conn.commit()
+        self.__commit()
 
-    def table_lrs_route_class_create(self, schema, srid):
+    def table_lrs_route_class_create(self, schema, srid, truncate=True):
         cur = self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
         lrs_rc_name = EXCLUDE_TABLENAME[3]
         if not self.table_exists(schema, lrs_rc_name):
             create = """CREATE TABLE {schema}.{lrs_rc_name}(id SERIAL PRIMARY KEY,
                         geom geometry(LineString,{srid}) NOT NULL, name VARCHAR(100) NOT NULL, 
-                        pathnr INTEGER DEFAULT 1, valid INTEGER DEFAULT 1);""" \
+                        pathnr INTEGER DEFAULT 1, valid INTEGER DEFAULT 1, geomhash VARCHAR(32));""" \
                         .format(schema=schema, lrs_rc_name=lrs_rc_name, srid=srid)
             cur.execute(create)
             idx = """CREATE INDEX IF NOT EXISTS idx_{lrs_rc_name}_geom ON {schema}.{lrs_rc_name}
@@ -954,30 +1382,98 @@ class PGConn:
             comment = """COMMENT ON TABLE {schema}.{lrs_rc_name} IS 'LRS-Editor, Route Class System Table';""" \
                 .format(schema=schema, lrs_rc_name=lrs_rc_name)
             cur.execute(comment)
-            self.conn.commit()
+            self.__commit()
         else:
-            # truncate table, reset sequences
-            trunc = """TRUNCATE {schema}.{lrs_rc_name} RESTART IDENTITY;""" \
+            # table of older versions
+            alter = """ALTER TABLE {schema}.{lrs_rc_name} ADD COLUMN IF NOT EXISTS geomhash VARCHAR(32);""" \
                     .format(schema=schema, lrs_rc_name=lrs_rc_name)
-            cur.execute(trunc)
-            self.conn.commit()
+            cur.execute(alter)
+            if truncate:
+                # truncate table, reset sequences
+                trunc = """TRUNCATE {schema}.{lrs_rc_name} RESTART IDENTITY;""" \
+                        .format(schema=schema, lrs_rc_name=lrs_rc_name)
+                cur.execute(trunc)
+            self.__commit()
+
+    def route_measure_columns_add(self, schema, tablename, srid):
+        # route class of older versions, add and fill columns geomm and startmeas
+        cur = self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        columns = {"geomm": "geometry(LineStringM,{srid})".format(srid=srid), "startmeas": "DOUBLE PRECISION"}
+        missing = False
+        for column, column_type in columns.items():
+            if not self.field_exists(schema, tablename.lower(), column):
+                alter = """ALTER TABLE {schema}.{tablename} ADD COLUMN {column} {column_type};""" \
+                        .format(schema=schema, tablename=tablename, column=column, column_type=column_type)
+                cur.execute(alter)
+                missing = True
+        if missing:
+            self.__commit()
+            self.route_measures_update(schema, tablename)
+
+    def geomhash_update(self, schema, tablename, geomfield, where=None):
+        # md5 of the wkb of every linestring
+        cur = self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        update = """UPDATE {schema}.{tablename} SET geomhash = md5(ST_AsBinary({geomfield})) WHERE {where};""" \
+                 .format(schema=schema, tablename=tablename, geomfield=geomfield, where=where if where else "TRUE")
+        cur.execute(update)
+        self.__commit()
 
-    def lrs_route_class_insert(self, schema, tablename, idfield, geomfield):
+    def lrs_route_class_insert(self, schema, tablename, idfield, geomfield, where=None):
+        # where: restricts the rows (e) of the base class
         cur = self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
         lrs_rc_name = EXCLUDE_TABLENAME[3]
         insert = """INSERT INTO {schema}.{lrs_rc_name} (geom, name, pathnr) SELECT 
                     (ST_Dump(ST_LineMerge(new_geom))).geom, TRIM(BOTH FROM idfield), 
                     (ST_Dump(ST_LineMerge(new_geom))).path[1] FROM
                     (SELECT e.{idfield} as idfield, ST_Collect(e.{geomfield}) as new_geom FROM
-                    {schema}.{tablename} e GROUP BY e.{idfield}) as subquery;""" \
-            .format(schema=schema, lrs_rc_name=lrs_rc_name, tablename=tablename, geomfield=geomfield, idfield=idfield)
+                    {schema}.{tablename} e WHERE {where} GROUP BY e.{idfield}) as subquery;""" \
+            .format(schema=schema, lrs_rc_name=lrs_rc_name, tablename=tablename, geomfield=geomfield, idfield=idfield,
+                    where=where if where else "TRUE")
         cur.execute(insert)
-        self.conn.commit()
+        self.__commit()
 
         expression = "pathnr = DEFAULT"
         where = "pathnr IS NULL"
         self.table_update1(schema, lrs_rc_name, expression, where)
 
+    def table_route_snapshot_create(self, schema):
+        # hashes of base class geometries and points per route of the last route update
+        cur = self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        lrs_rs_name = EXCLUDE_TABLENAME[6]
+        if not self.table_exists(schema, lrs_rs_name):
+            create = """CREATE TABLE {schema}.{lrs_rs_name}(name VARCHAR(100) PRIMARY KEY, geomhash VARCHAR(32), 
+                        nodehash VARCHAR(32), basesystem_id INTEGER NOT NULL);""" \
+                        .format(schema=schema, lrs_rs_name=lrs_rs_name)
+            cur.execute(create)
+            comment = """COMMENT ON TABLE {schema}.{lrs_rs_name} IS 'LRS-Editor, Route Snapshot System Table';""" \
+                .format(schema=schema, lrs_rs_name=lrs_rs_name)
+            cur.execute(comment)
+            self.__commit()
+
+    def route_hashes_get(self, schema, tablename, idfield, geomfield, point_tablename, point_route_id_field,
+                         point_geomfield, point_sortnr_field, point_type_field):
+        # md5 per route of all linestrings of the base class and of all points of the point class
+        cur = self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        query = """SELECT COALESCE(g.name, n.name), g.geomhash, n.nodehash FROM 
+                (SELECT TRIM(BOTH FROM e.{idfield}) as name, 
+                md5(string_agg(encode(ST_AsEWKB(e.{geomfield}), 'hex'), ',' 
+                ORDER BY encode(ST_AsEWKB(e.{geomfield}), 'hex'))) as geomhash 
+                FROM {schema}.{tablename} e GROUP BY TRIM(BOTH FROM e.{idfield})) as g 
+                FULL JOIN 
+                (SELECT TRIM(BOTH FROM p.{point_route_id_field}) as name, 
+                md5(string_agg(p.{point_sortnr_field} || ':' || p.{point_type_field} || ':' || 
+                encode(ST_AsEWKB(p.{point_geomfield}), 'hex'), ',' 
+                ORDER BY p.{point_sortnr_field}, p.{point_type_field}, encode(ST_AsEWKB(p.{point_geomfield}), 'hex')))  
+                as nodehash FROM {schema}.{point_tablename} p GROUP BY TRIM(BOTH FROM p.{point_route_id_field})) as n 
+                ON g.name = n.name;""" \
+                .format(schema=schema, tablename=tablename, idfield=idfield, geomfield=geomfield,
+                        point_tablename=point_tablename, point_route_id_field=point_route_id_field,
+                        point_geomfield=point_geomfield, point_sortnr_field=point_sortnr_field,
+                        point_type_field=point_type_field)
+        cur.execute(query)
+        rows_list = cur.fetchall()
+        return rows_list
+
     def base_class_geom_select(self, schema, tablename, idfield, geomfield):
         cur = self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
         lrs_rc_name = EXCLUDE_TABLENAME[3]
@@ -991,6 +1487,48 @@ class PGConn:
         rows_list = cur.fetchall()
         return rows_list
 
+    def base_class_geom_fetch(self, schema, tablename, idfield, geomfield, where=None, size=10000):
+        # like base_class_geom_select, but yields the rows in blocks of size from a server-side cursor
+        # where: restricts the rows (e) of the base class
+        # unique name, several fetches can be open on the same connection
+        cur = self.conn.cursor("lrs_base_class_geom_" + uuid.uuid4().hex)
+        query = """SELECT (ST_Dump(ST_LineMerge(new_geom))).geom, TRIM(BOTH FROM idfield), 
+                   (ST_Dump(ST_LineMerge(new_geom))).path[1] FROM 
+                   (SELECT e.{idfield} as idfield, ST_Collect(e.{geomfield}) as new_geom FROM
+                   {schema}.{tablename} e WHERE {where} GROUP BY e.{idfield}) as subquery;""" \
+                    .format(schema=schema, tablename=tablename, geomfield=geomfield, idfield=idfield,
+                            where=where if where else "TRUE")
+        cur.execute(query)
+        try:
+            while True:
+                rows_list = cur.fetchmany(size)
+                if len(rows_list) == 0:
+                    break
+                yield rows_list
+        finally:
+            cur.close()
+
+    def lrs_route_class_copy(self, schema, rows_list):
+        # bulk insert with COPY, rows: geom as hex EWKB, name, pathnr
+        cur = self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        lrs_rc_name = EXCLUDE_TABLENAME[3]
+        data = io.StringIO()
+        for row in rows_list:
+            # set default value
+            pathnr = row[2] if row[2] is not None else 1
+            data.write(row[0] + "\t" + self.__copy_text_get(row[1]) + "\t" + str(pathnr) + "\n")
+        data.seek(0)
+        copy = """COPY {schema}.{lrs_rc_name} (geom, name, pathnr) FROM STDIN;""" \
+               .format(schema=schema, lrs_rc_name=lrs_rc_name)
+        cur.copy_expert(copy, data)
+        self.__commit()
+
+    def __copy_text_get(self, value):
+        # escape value for COPY text format
+        if value is None:
+            return "\\N"
+        return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
     def max_number_get(self, schema, tablename, field, where=None):
         cur = self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
         if not where:
@@ -1008,69 +1546,90 @@ class PGConn:
         else:
             return 0
 
-    def linestring_length_get(self, schema, tablename, route_id, sortnr, geomfield):
-        cur = self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        query = """SELECT ST_Length({geomfield}) FROM {schema}.{tablename} WHERE 
-                    route_id = '{route_id}' AND sortnr = {sortnr};"""\
-                .format(geomfield=geomfield, schema=schema, tablename=tablename, route_id=route_id, sortnr=sortnr)
-        cur.execute(query)
-        result = cur.fetchone()
-        if result is not None:
-            return result[0]
-        else:
-            return 0
-
     def linestring_length_update(self, schema, tablename, geomfield, field):
         cur = self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
         update = """UPDATE {schema}.{tablename} SET {field} = ST_Length({geomfield});"""\
                  .format(geomfield=geomfield, schema=schema, tablename=tablename, field=field)
         cur.execute(update)
-        self.conn.commit()
+        self.__commit()
 
-    def linestring_dist_get(self, schema, tablename, route_id, sortnr, x, y, geomfield, srid):
-        # must be LineString
+    def route_measures_update(self, schema, tablename, where=None):
+        # length, measure at start (0 at start of sortnr 1) and linestring with measures of every route part
+        # all parts of a route must be in where
         cur = self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        query = """SELECT ST_LineLocatePoint(a.{geomfield}, ST_SetSRID(ST_MakePoint({x}, {y}), {srid})) FROM 
-                    {schema}.{tablename} a WHERE route_id = '{route_id}' AND sortnr = {sortnr};"""\
-                .format(geomfield=geomfield, schema=schema, tablename=tablename, route_id=route_id, sortnr=sortnr,
-                        x=x, y=y, srid=srid)
-        cur.execute(query)
+        update = """UPDATE {schema}.{tablename} a SET length = ST_Length(a.geom), startmeas = b.startmeas, 
+                 geomm = ST_AddMeasure(a.geom, b.startmeas, b.startmeas + ST_Length(a.geom)) FROM 
+                 (SELECT id, COALESCE(SUM(ST_Length(geom)) OVER (PARTITION BY route_id ORDER BY sortnr 
+                 ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING), 0) AS startmeas 
+                 FROM {schema}.{tablename} WHERE {where}) b WHERE a.id = b.id;"""\
+                 .format(schema=schema, tablename=tablename, where=where if where else "TRUE")
+        cur.execute(update)
+        self.__commit()
+
+    def route_name_get(self, schema, tablename, route_id, sortnr=None):
+        # name of a route, queried per click -> prepared
+        cur = self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        if sortnr is None:
+            query = """SELECT name FROM {schema}.{tablename} WHERE route_id = $1 LIMIT 1"""\
+                    .format(schema=schema, tablename=tablename)
+            self.__prepared_execute(cur, "lrs_route_name", query, "uuid", (str(route_id),))
+        else:
+            query = """SELECT name FROM {schema}.{tablename} WHERE route_id = $1 AND sortnr = $2"""\
+                    .format(schema=schema, tablename=tablename)
+            self.__prepared_execute(cur, "lrs_route_name_sortnr", query, "uuid, integer",
+                                    (str(route_id), int(sortnr)))
         result = cur.fetchone()
         if result is not None:
             return result[0]
         else:
-            return 0
+            return None
 
-    def linestring_point_get(self, schema, tablename, route_id, sortnr, fract, geomfield):
-        # must be LineString, returns OGC Well-Known text representation (WKT)
+    def route_id_get(self, schema, tablename, route_name, sortnr=None):
+        # route_id of a route, queried per imported event -> prepared
         cur = self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        query = """SELECT ST_AsText(ST_LineInterpolatePoint(a.{geomfield}, {fract})) FROM 
-                    {schema}.{tablename} a WHERE route_id = '{route_id}' AND sortnr = {sortnr};"""\
-                .format(geomfield=geomfield, schema=schema, tablename=tablename, route_id=route_id, sortnr=sortnr,
-                        fract=fract)
-        cur.execute(query)
-        # must return a point, not a list
-        result = cur.fetchone()[0]
-        return result
+        if sortnr is None:
+            query = """SELECT route_id FROM {schema}.{tablename} WHERE name = $1 LIMIT 1"""\
+                    .format(schema=schema, tablename=tablename)
+            self.__prepared_execute(cur, "lrs_route_id", query, "text", (route_name,))
+        else:
+            query = """SELECT route_id FROM {schema}.{tablename} WHERE name = $1 AND sortnr = $2"""\
+                    .format(schema=schema, tablename=tablename)
+            self.__prepared_execute(cur, "lrs_route_id_sortnr", query, "text, integer", (route_name, int(sortnr)))
+        result = cur.fetchone()
+        if result is not None:
+            return result[0]
+        else:
+            return None
 
-    def linestring_azi_get(self, pg_point1, pg_point2):
-        # pg_point1: first point along the directed route (minor value of meas)
-        # points must be OGC Well-Known text representation (WKT)
+    def route_length_get(self, schema, tablename, route_id):
+        # sum for routes with multipart
         cur = self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        query = """SELECT degrees(ST_Azimuth(ST_GeomFromText('{pg_point1}'), ST_GeomFromText('{pg_point2}')));"""\
-                .format(pg_point1=pg_point1, pg_point2=pg_point2)
-        cur.execute(query)
-        # must return a value, not a list
+        query = """SELECT SUM(length) FROM {schema}.{tablename} WHERE route_id = $1"""\
+                .format(schema=schema, tablename=tablename)
+        self.__prepared_execute(cur, "lrs_route_length", query, "uuid", (str(route_id),))
         result = cur.fetchone()[0]
+        if result is None:
+            return 0
         return result
 
-    def linestring_sortnr_get(self, schema, tablename, route_id, x, y, geomfield, srid):
-        # get sortnr of closest LineString from a point, with given route_id
+    def linestring_parts_get(self, schema, tablename, route_id, geomfield):
+        # get the LineStrings with given route_id as WKB, returns [[sortnr, array of vertices, startmeas], ...]
         cur = self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        query = """SELECT sortnr FROM {schema}.{tablename} a WHERE route_id = '{route_id}' ORDER BY  
-                    ST_Distance(ST_SetSRID(ST_MakePoint({x}, {y}), {srid}), a.{geomfield}) ASC LIMIT 1;"""\
-                .format(geomfield=geomfield, schema=schema, tablename=tablename, route_id=route_id, x=x, y=y, srid=srid)
-        cur.execute(query)
-        # must return a value, not a list
-        result = cur.fetchone()[0]
-        return result
+        query = """SELECT a.sortnr, ST_AsBinary(a.{geomfield}), a.startmeas FROM {schema}.{tablename} a 
+                    WHERE a.route_id = $1 ORDER BY a.sortnr ASC"""\
+                .format(geomfield=geomfield, schema=schema, tablename=tablename)
+        self.__prepared_execute(cur, "lrs_parts", query, "uuid", (str(route_id),))
+        rows_list = cur.fetchall()
+        return [[row[0], wkb.linestring_get(row[1]), row[2]] for row in rows_list]
+
+    def linestrings_parts_get(self, schema, tablename, routelist, geomfield):
+        # get the LineStrings of several routes as WKB,
+        # returns [[route_id, sortnr, array of vertices, startmeas], ...]
+        cur = self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        query = """SELECT a.route_id, a.sortnr, ST_AsBinary(a.{geomfield}), a.startmeas FROM {schema}.{tablename} a 
+                    WHERE a.route_id = ANY($1::uuid[]) ORDER BY a.route_id ASC, a.sortnr ASC"""\
+                .format(geomfield=geomfield, schema=schema, tablename=tablename)
+        # a list of str is bound as text[], no assignment cast to uuid[] -> cast in the statement
+        self.__prepared_execute(cur, "lrs_parts_routes", query, "text[]", ([str(route_id) for route_id in routelist],))
+        rows_list = cur.fetchall()
+        return [[row[0], row[1], wkb.linestring_get(row[2]), row[3]] for row in rows_list]
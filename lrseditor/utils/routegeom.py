@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+    name             :  LRS-Editor
+    description      :  QGIS plugin for editing linear reference systems
+    begin            :  2020-09-01
+    copyright        :  (C) 2020 by Reto Meier (Holenstein Ingenieure AG)
+    email            :  reto.meier@h-ing.ch
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+import math
+
+import numpy as np
+
+
+class RouteGeom:
+    # client-side geometry of a route, computes the same values as PostGIS
+    # ST_LineLocatePoint, ST_LineInterpolatePoint and ST_Azimuth on the route parts (LineStrings)
+    # max. number of points processed at once, limits memory of the point-segment matrix
+    CHUNK_SIZE = 1000
+
+    def __init__(self, partlist):
+        # partlist: [[sortnr, [[x, y], ...], startmeas], ...]
+        # startmeas as stored in the route class, None: summed up from the preceding parts
+        self.__sortnrs = []
+        self.__coords = {}
+        self.__cumlength = {}
+        self.__startmeas = {}
+        meas = 0.0
+        for sortnr, coords, startmeas in sorted(partlist, key=lambda part: part[0]):
+            xy = np.asarray(coords, dtype=float).reshape(-1, 2)
+            seg_length = np.hypot(np.diff(xy[:, 0]), np.diff(xy[:, 1]))
+            # cumulative length at every vertex of the LineString
+            cumlength = np.concatenate(([0.0], np.cumsum(seg_length)))
+            self.__sortnrs.append(sortnr)
+            self.__coords[sortnr] = xy
+            self.__cumlength[sortnr] = cumlength
+            # meas respects multipart linestring
+            if startmeas is not None:
+                meas = float(startmeas)
+            self.__startmeas[sortnr] = meas
+            meas = meas + cumlength[-1]
+        self.__length = meas
+
+    def sortnr_get(self, x, y):
+        # get sortnr of closest LineString from a point
+        return int(self.sortnrs_get([x], [y])[0])
+
+    def fract_get(self, sortnr, x, y):
+        return float(self.fracts_get([sortnr], [x], [y])[0])
+
+    def point_get(self, sortnr, fract):
+        xs, ys = self.points_get([sortnr], [fract])
+        return float(xs[0]), float(ys[0])
+
+    def meas_get(self, sortnr, fract):
+        return float(self.meas_array_get([sortnr], [fract])[0])
+
+    def azi_get(self, sortnr, fract):
+        azi = self.azis_get([sortnr], [fract])[0]
+        if np.isnan(azi):
+            return None
+        return float(azi)
+
+    def sortnrs_get(self, xs, ys):
+        # get sortnr of closest LineString for every point, ties go to the lower sortnr
+        xs, ys = np.asarray(xs, dtype=float), np.asarray(ys, dtype=float)
+        sortnrs = np.full(len(xs), self.__sortnrs[0], dtype=int)
+        dist_min = np.full(len(xs), np.inf)
+        for sortnr in self.__sortnrs:
+            for start in range(0, len(xs), self.CHUNK_SIZE):
+                end = start + self.CHUNK_SIZE
+                dist2, t = self.__segs_proj_get(sortnr, xs[start:end], ys[start:end])
+                dist = dist2.min(axis=1)
+                closer = dist < dist_min[start:end]
+                dist_min[start:end][closer] = dist[closer]
+                sortnrs[start:end][closer] = sortnr
+        return sortnrs
+
+    def fracts_get(self, sortnrs, xs, ys):
+        # like ST_LineLocatePoint: first segment with minimal distance, projected point
+        sortnrs = np.asarray(sortnrs, dtype=int)
+        xs, ys = np.asarray(xs, dtype=float), np.asarray(ys, dtype=float)
+        fracts = np.zeros(len(xs))
+        for sortnr in self.__sortnrs:
+            idx = np.flatnonzero(sortnrs == sortnr)
+            cumlength = self.__cumlength[sortnr]
+            if len(idx) == 0 or cumlength[-1] == 0:
+                continue
+            for start in range(0, len(idx), self.CHUNK_SIZE):
+                idx_chunk = idx[start:start + self.CHUNK_SIZE]
+                dist2, t = self.__segs_proj_get(sortnr, xs[idx_chunk], ys[idx_chunk])
+                seg = np.argmin(dist2, axis=1)
+                t_seg = t[np.arange(len(idx_chunk)), seg]
+                length_proj = cumlength[seg] + t_seg * (cumlength[seg + 1] - cumlength[seg])
+                fracts[idx_chunk] = length_proj / cumlength[-1]
+        return fracts
+
+    def points_get(self, sortnrs, fracts):
+        # like ST_LineInterpolatePoint, returns arrays of x and y
+        sortnrs = np.asarray(sortnrs, dtype=int)
+        fracts = np.clip(np.asarray(fracts, dtype=float), 0.0, 1.0)
+        xs, ys = np.zeros(len(fracts)), np.zeros(len(fracts))
+        for sortnr in self.__sortnrs:
+            idx = np.flatnonzero(sortnrs == sortnr)
+            if len(idx) == 0:
+                continue
+            xy = self.__coords[sortnr]
+            cumlength = self.__cumlength[sortnr]
+            if len(xy) == 1:
+                xs[idx], ys[idx] = xy[0][0], xy[0][1]
+                continue
+            length_fract = fracts[idx] * cumlength[-1]
+            seg = self.__seg_get(sortnr, length_fract)
+            seg_length = cumlength[seg + 1] - cumlength[seg]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                t = np.where(seg_length > 0, (length_fract - cumlength[seg]) / seg_length, 0.0)
+            t = np.clip(t, 0.0, 1.0)
+            xs[idx] = xy[seg, 0] + t * (xy[seg + 1, 0] - xy[seg, 0])
+            ys[idx] = xy[seg, 1] + t * (xy[seg + 1, 1] - xy[seg, 1])
+        return xs, ys
+
+    def meas_array_get(self, sortnrs, fracts):
+        # meas = total distance till position (fract)
+        startmeas = np.array([self.__startmeas[sortnr] for sortnr in sortnrs], dtype=float)
+        lengths = np.array([self.part_length_get(sortnr) for sortnr in sortnrs], dtype=float)
+        return startmeas + lengths * np.asarray(fracts, dtype=float)
+
+    def azis_get(self, sortnrs, fracts):
+        # get azimuth in degrees of the points 0.1 m above and underneath
+        # nan where the azimuth is not defined
+        sortnrs = np.asarray(sortnrs, dtype=int)
+        fracts = np.asarray(fracts, dtype=float)
+        lengths = np.array([self.part_length_get(sortnr) for sortnr in sortnrs], dtype=float)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            delta = np.where(lengths > 0, 0.1 / lengths, 0.0)
+        fracts1 = np.maximum(fracts - delta, 0)
+        fracts2 = np.minimum(fracts + delta, 1)
+        # both points on the same segment: direction of the segment
+        segs1, dx, dy = self.__seg_dirs_get(sortnrs, fracts1)
+        segs2 = self.__seg_dirs_get(sortnrs, fracts2)[0]
+        seg_same = (segs1 == segs2) & ((dx != 0) | (dy != 0))
+        # near vertices: calc points
+        idx = np.flatnonzero(~seg_same)
+        if len(idx) > 0:
+            x1, y1 = self.points_get(sortnrs[idx], fracts1[idx])
+            x2, y2 = self.points_get(sortnrs[idx], fracts2[idx])
+            dx[idx], dy[idx] = x2 - x1, y2 - y1
+        # clockwise from north
+        azis = np.degrees(np.arctan2(dx, dy) % (2 * math.pi))
+        # like ST_Azimuth with identical points
+        azis[(dx == 0) & (dy == 0)] = np.nan
+        return azis
+
+    def part_length_get(self, sortnr):
+        return float(self.__cumlength[sortnr][-1])
+
+    def __seg_get(self, sortnr, length_fract):
+        # index of the segment at the distance length_fract from the start of the LineString
+        cumlength = self.__cumlength[sortnr]
+        seg = np.searchsorted(cumlength, length_fract, side="right") - 1
+        return np.clip(seg, 0, len(cumlength) - 2)
+
+    def __seg_dirs_get(self, sortnrs, fracts):
+        # index and direction (dx, dy) of the segment at fract for every point
+        fracts = np.clip(fracts, 0.0, 1.0)
+        segs = np.zeros(len(fracts), dtype=int)
+        dx, dy = np.zeros(len(fracts)), np.zeros(len(fracts))
+        for sortnr in self.__sortnrs:
+            idx = np.flatnonzero(sortnrs == sortnr)
+            xy = self.__coords[sortnr]
+            if len(idx) == 0 or len(xy) == 1:
+                continue
+            seg = self.__seg_get(sortnr, fracts[idx] * self.__cumlength[sortnr][-1])
+            segs[idx] = seg
+            dx[idx] = xy[seg + 1, 0] - xy[seg, 0]
+            dy[idx] = xy[seg + 1, 1] - xy[seg, 1]
+        return segs, dx, dy
+
+    def __segs_proj_get(self, sortnr, xs, ys):
+        # squared distance and segment parameter t for every point (rows) and segment (columns)
+        xy = self.__coords[sortnr]
+        xs, ys = xs[:, np.newaxis], ys[:, np.newaxis]
+        if len(xy) == 1:
+            dist2 = (xy[:, 0] - xs) ** 2 + (xy[:, 1] - ys) ** 2
+            return dist2, np.zeros(dist2.shape)
+        ax, ay = xy[:-1, 0], xy[:-1, 1]
+        dx, dy = xy[1:, 0] - ax, xy[1:, 1] - ay
+        seg_length2 = dx ** 2 + dy ** 2
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t = np.where(seg_length2 > 0, ((xs - ax) * dx + (ys - ay) * dy) / seg_length2, 0.0)
+        t = np.clip(t, 0.0, 1.0)
+        dist2 = (ax + t * dx - xs) ** 2 + (ay + t * dy - ys) ** 2
+        return dist2, t
+
+    # get properties
+    @property
+    def sortnr_max(self):
+        return self.__sortnrs[-1]
+
+    @property
+    def length(self):
+        return self.__length
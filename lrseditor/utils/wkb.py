@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+    name             :  LRS-Editor
+    description      :  QGIS plugin for editing linear reference systems
+    begin            :  2020-09-01
+    copyright        :  (C) 2020 by Reto Meier (Holenstein Ingenieure AG)
+    email            :  reto.meier@h-ing.ch
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+import struct
+
+import numpy as np
+
+# EWKB flags of the geometry type
+EWKB_Z = 0x80000000
+EWKB_M = 0x40000000
+EWKB_SRID = 0x20000000
+# geometry types
+WKB_POINT = 1
+WKB_LINESTRING = 2
+WKB_MULTIPOINT = 4
+WKB_NAMES = {1: "Point", 2: "LineString", 3: "Polygon", 4: "MultiPoint", 5: "MultiLineString", 6: "MultiPolygon",
+             7: "GeometryCollection"}
+
+
+def point_ewkb_get(x, y, srid):
+    # EWKB (little endian) of a point with srid, can be cast to geometry (bytea::geometry)
+    return struct.pack("<BIIdd", 1, 1 | EWKB_SRID, srid, x, y)
+
+
+def point_get(wkb):
+    # x, y of a point from WKB or EWKB, a MultiPoint must have a single point
+    endian, offset, dims, base_type = _header_get(wkb)
+    if base_type == WKB_MULTIPOINT:
+        count = struct.unpack_from(endian + "I", wkb, offset)[0]
+        if count != 1:
+            raise ValueError("MultiPoint with " + str(count) + " points, a single point is expected")
+        # the point has its own header
+        return point_get(wkb[offset + 4:])
+    _type_check(base_type, WKB_POINT)
+    return struct.unpack_from(endian + "dd", wkb, offset)
+
+
+def linestring_get(wkb):
+    # array of the vertices [[x, y], ...] of a linestring from WKB or EWKB
+    endian, offset, dims, base_type = _header_get(wkb)
+    _type_check(base_type, WKB_LINESTRING)
+    count = struct.unpack_from(endian + "I", wkb, offset)[0]
+    coords = np.frombuffer(wkb, dtype=endian + "f8", count=count * dims, offset=offset + 4)
+    return coords.reshape(count, dims)[:, :2]
+
+
+def _type_check(base_type, expected_type):
+    if base_type != expected_type:
+        raise ValueError(WKB_NAMES.get(base_type, "geometry type " + str(base_type)) + " instead of " +
+                         WKB_NAMES[expected_type])
+
+
+def _header_get(wkb):
+    # byte order, offset of the coordinates, number of dimensions and geometry type without flags
+    endian = "<" if wkb[0] == 1 else ">"
+    geom_type = struct.unpack_from(endian + "I", wkb, 1)[0]
+    offset = 5
+    dims = 2
+    if geom_type & EWKB_SRID:
+        offset = offset + 4
+    # EWKB flags
+    dims = dims + bool(geom_type & EWKB_Z) + bool(geom_type & EWKB_M)
+    # ISO WKB: 1000 Z, 2000 M, 3000 ZM
+    iso_type = (geom_type & 0x0FFFFFFF) // 1000
+    dims = dims + {0: 0, 1: 1, 2: 1, 3: 2}.get(iso_type, 0)
+    base_type = (geom_type & 0x0FFFFFFF) % 1000
+    return endian, offset, dims, base_type